@@ -0,0 +1,298 @@
+"""Server-side achievement evaluation, driven by events derived from saves.
+
+Mirrors the rules of ``frontend/src/utils/achievementLogic.js``. Rather than
+rescanning the whole state, each save is turned into typed events (a quest
+completed, a reward claimed, ...) from what changed since the previous
+save, and each event only runs the rules registered for its type. Rules
+read small per-user progress counters kept in ``achievement_progress``
+next to the unlocked achievements.
+"""
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+from quest_stats import appended_entries, item_id
+from xp_systems import get_current_level, get_xp_system
+
+logger = logging.getLogger(__name__)
+
+# Event types
+QUEST_COMPLETED = "quest_completed"
+REWARD_CLAIMED = "reward_claimed"
+ITEM_USED = "item_used"
+RECURRING_TASK_ADDED = "recurring_task_added"
+MONTHLY_BONUS_APPLIED = "monthly_bonus_applied"
+XP_CHANGED = "xp_changed"
+
+
+class Event(NamedTuple):
+    type: str
+    data: Dict[str, Any]
+
+
+class Achievement(NamedTuple):
+    id: str
+    name: str
+    events: Tuple[str, ...]
+    # (progress counters, event) -> unlocked?
+    check: Callable[[Dict[str, Any], Event], bool]
+
+
+ACHIEVEMENTS: List[Achievement] = [
+    Achievement("first_quest", "First Steps", (QUEST_COMPLETED,),
+                lambda c, e: c["completed"] >= 1),
+    Achievement("quest_master_5", "Quest Apprentice", (QUEST_COMPLETED,),
+                lambda c, e: c["completed"] >= 5),
+    Achievement("quest_master_25", "Quest Veteran", (QUEST_COMPLETED,),
+                lambda c, e: c["completed"] >= 25),
+    Achievement("legendary_hunter", "Legendary Hunter", (QUEST_COMPLETED,),
+                lambda c, e: str(e.data.get("rank", "")).lower() == "legendary"),
+    Achievement("important_quest_master", "Priority Expert", (QUEST_COMPLETED,),
+                lambda c, e: c["important"] >= 5),
+    Achievement("procrastinator_redeemed", "Procrastinator Redeemed", (QUEST_COMPLETED,),
+                lambda c, e: e.data.get("progressStatus") == "delaying"),
+    Achievement("speed_runner", "Speed Runner", (QUEST_COMPLETED,),
+                lambda c, e: c["day_count"] >= 3),
+    Achievement("weekly_warrior", "Weekly Warrior", (QUEST_COMPLETED,),
+                lambda c, e: c["distinct_days"] >= 7),
+    Achievement("perfectionist", "Perfectionist", (QUEST_COMPLETED,),
+                lambda c, e: c["completed"] >= 10 and c["abandoned"] == 0),
+    Achievement("xp_milestone_100", "Rising Adventurer", (XP_CHANGED,),
+                lambda c, e: e.data["total_earned"] >= 100),
+    Achievement("xp_milestone_500", "Experienced Hero", (XP_CHANGED,),
+                lambda c, e: e.data["total_earned"] >= 500),
+    Achievement("xp_milestone_1000", "XP Champion", (XP_CHANGED,),
+                lambda c, e: e.data["total_earned"] >= 1000),
+    Achievement("level_up_master", "Level Up Master", (XP_CHANGED,),
+                lambda c, e: e.data["level"] >= 3),
+    Achievement("reward_spender", "Big Spender", (XP_CHANGED,),
+                lambda c, e: e.data["total_spent"] >= 200),
+    Achievement("first_reward", "Reward Collector", (REWARD_CLAIMED, ITEM_USED),
+                lambda c, e: True),
+    Achievement("inventory_user", "Inventory Master", (ITEM_USED,),
+                lambda c, e: True),
+    Achievement("recurring_master", "Routine Builder", (RECURRING_TASK_ADDED,),
+                lambda c, e: e.data["count"] >= 3),
+    Achievement("monthly_bonus_claimer", "Monthly Bonus Master", (MONTHLY_BONUS_APPLIED,),
+                lambda c, e: True),
+]
+
+# Event type -> the achievements that listen to it
+ACHIEVEMENTS_BY_EVENT: Dict[str, List[Achievement]] = {}
+for _achievement in ACHIEVEMENTS:
+    for _event_type in _achievement.events:
+        ACHIEVEMENTS_BY_EVENT.setdefault(_event_type, []).append(_achievement)
+
+
+def empty_progress() -> Dict[str, Any]:
+    return {
+        # What the previous save looked like, to derive events from the next
+        "seen": {
+            "completed": {"count": 0, "tail_id": None},
+            "claimed": {"count": 0, "tail_id": None},
+            "inventory_ids": [],
+            "recurring_count": 0,
+            "last_monthly_bonus": None,
+            "total_earned": 0,
+            "total_spent": 0,
+            "xp_system": None,
+        },
+        # Counters the rules read
+        "counters": {
+            "completed": 0,
+            "important": 0,
+            "abandoned": 0,
+            "last_day": None,
+            "day_count": 0,
+            "distinct_days": 0,
+        },
+    }
+
+
+def _list(value: Any) -> List[Any]:
+    return value if isinstance(value, list) else []
+
+
+def _dict(value: Any) -> Dict[str, Any]:
+    return value if isinstance(value, dict) else {}
+
+
+def _number(value: Any) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return 0
+
+
+def derive_events(progress: Dict[str, Any], sections: Dict[str, Any], removed: List[str]) -> List[Event]:
+    """Events for the changes in ``sections`` since the state recorded in
+    ``progress``, which is advanced in place. Quest counters restart when the
+    completed history was edited other than by appending."""
+    seen, counters = progress["seen"], progress["counters"]
+    events: List[Event] = []
+
+    if "completedQuests" in sections or "completedQuests" in removed:
+        items = _list(sections.get("completedQuests"))
+        new = appended_entries(seen["completed"]["count"], seen["completed"]["tail_id"], items)
+        if new is None:
+            counters.update(empty_progress()["counters"])
+            new = items
+        events.extend(Event(QUEST_COMPLETED, _dict(item)) for item in new)
+        seen["completed"] = {"count": len(items), "tail_id": item_id(items[-1]) if items else None}
+
+    if "inventory" in sections:
+        ids = [item_id(item) for item in _list(sections["inventory"])]
+        known = set(seen["inventory_ids"])
+        events.extend(
+            Event(REWARD_CLAIMED, _dict(item))
+            for item, entity_id in zip(sections["inventory"], ids)
+            if entity_id is not None and entity_id not in known
+        )
+        seen["inventory_ids"] = [entity_id for entity_id in ids if entity_id is not None]
+
+    if "claimedRewards" in sections or "claimedRewards" in removed:
+        items = _list(sections.get("claimedRewards"))
+        new = appended_entries(seen["claimed"]["count"], seen["claimed"]["tail_id"], items)
+        events.extend(Event(ITEM_USED, _dict(item)) for item in (new if new is not None else items))
+        seen["claimed"] = {"count": len(items), "tail_id": item_id(items[-1]) if items else None}
+
+    if "recurringTasks" in sections:
+        count = len(_list(sections["recurringTasks"]))
+        if count > seen["recurring_count"]:
+            events.append(Event(RECURRING_TASK_ADDED, {"count": count}))
+        seen["recurring_count"] = count
+
+    if "settings" in sections:
+        seen["xp_system"] = _dict(sections["settings"]).get("xpSystem")
+
+    if "xp" in sections:
+        xp = _dict(sections["xp"])
+        last_bonus = xp.get("lastMonthlyBonus")
+        if last_bonus and last_bonus != seen["last_monthly_bonus"]:
+            events.append(Event(MONTHLY_BONUS_APPLIED, {"date": last_bonus}))
+        seen["last_monthly_bonus"] = last_bonus
+        total_earned = _number(xp.get("totalEarned"))
+        total_spent = _number(xp.get("totalSpent"))
+        if (total_earned, total_spent) != (seen["total_earned"], seen["total_spent"]):
+            level = get_current_level(total_earned, get_xp_system(seen["xp_system"]))["level"]
+            events.append(Event(XP_CHANGED, {
+                "total_earned": total_earned, "total_spent": total_spent, "level": level,
+            }))
+        seen["total_earned"], seen["total_spent"] = total_earned, total_spent
+
+    return events
+
+
+def apply_event(counters: Dict[str, Any], event: Event) -> None:
+    """Advance the rule counters by one event."""
+    if event.type != QUEST_COMPLETED:
+        return
+    quest = event.data
+    counters["completed"] += 1
+    if quest.get("isImportant"):
+        counters["important"] += 1
+    if quest.get("progressStatus") == "abandoned":
+        counters["abandoned"] += 1
+    completed = quest.get("dateCompleted")
+    day = completed[:10] if isinstance(completed, str) else None
+    if day is not None:
+        # Completions arrive in order, so a new day starts a new run
+        if day != counters["last_day"]:
+            counters["last_day"] = day
+            counters["day_count"] = 0
+            counters["distinct_days"] += 1
+        counters["day_count"] += 1
+
+
+def evaluate(
+    progress: Dict[str, Any],
+    unlocked: Dict[str, str],
+    events: List[Event],
+    now: str,
+) -> List[Dict[str, Any]]:
+    """Run the rules listening to each event; returns the newly unlocked."""
+    newly_unlocked = []
+    for event in events:
+        apply_event(progress["counters"], event)
+        for achievement in ACHIEVEMENTS_BY_EVENT.get(event.type, ()):
+            if achievement.id in unlocked:
+                continue
+            if achievement.check(progress["counters"], event):
+                unlocked[achievement.id] = now
+                newly_unlocked.append({
+                    "id": achievement.id,
+                    "name": achievement.name,
+                    "unlocked": True,
+                    "dateUnlocked": now,
+                })
+    return newly_unlocked
+
+
+class AchievementEngine:
+    """Keeps per-user achievement progress and unlocks up to date."""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.achievement_progress
+
+    async def unlocked(self, user_id: str) -> Dict[str, str]:
+        """Unlocked achievement ids and when they were unlocked."""
+        document = await self.collection.find_one({"user_id": user_id}, {"_id": 0, "unlocked": 1})
+        return (document or {}).get("unlocked", {})
+
+    async def record(
+        self,
+        user_id: str,
+        sections: Dict[str, Any],
+        removed: List[str],
+        version: int,
+    ) -> List[Dict[str, Any]]:
+        """Evaluate a save of ``sections`` at ``version`` and persist the result.
+
+        Returns achievements unlocked by this save that the saved state did not
+        already mark as unlocked. Saves older than the stored progress are
+        ignored.
+        """
+        for _ in range(3):
+            existing = await self.collection.find_one({"user_id": user_id}, {"_id": 0})
+            if existing is not None and existing.get("version", 0) >= version:
+                return []
+            progress = empty_progress()
+            if existing is not None:
+                progress["seen"].update(existing.get("seen", {}))
+                progress["counters"].update(existing.get("counters", {}))
+            unlocked = dict((existing or {}).get("unlocked", {}))
+
+            # Unlocks the client already shows are recorded, not reported again
+            for achievement in _list(sections.get("achievements")):
+                if isinstance(achievement, dict) and achievement.get("unlocked") and achievement.get("id"):
+                    unlocked.setdefault(
+                        str(achievement["id"]), achievement.get("dateUnlocked") or ""
+                    )
+
+            events = derive_events(progress, sections, removed)
+            newly_unlocked = evaluate(
+                progress, unlocked, events, datetime.utcnow().isoformat() + "Z"
+            )
+            document = {
+                "version": version,
+                "seen": progress["seen"],
+                "counters": progress["counters"],
+                "unlocked": unlocked,
+                "updated_at": datetime.utcnow(),
+            }
+            try:
+                if existing is None:
+                    await self.collection.insert_one({"user_id": user_id, **document})
+                    return newly_unlocked
+                result = await self.collection.update_one(
+                    {"user_id": user_id, "version": existing.get("version", 0)},
+                    {"$set": document},
+                )
+            except DuplicateKeyError:
+                continue
+            if result.matched_count:
+                return newly_unlocked
+        logger.warning("Gave up evaluating achievements for user %s at version %s", user_id, version)
+        return []
@@ -0,0 +1,205 @@
+"""Admission control for the endpoints that hash passwords.
+
+/api/register and /api/login each cost a bcrypt operation, so a burst of
+them, such as credential stuffing, can starve every other route of CPU.
+Before any work is done, each request takes a token from a bucket for its
+client address and, for logins, one for the account named. An empty bucket
+sheds the request with 429 and a ``Retry-After`` of the time until the
+next token. Admitted requests then reach the hash pool. Its worker count
+is the global cap on concurrent hashing, and it sheds with 503 when its
+queue is too deep (see ``hashing.HashPool``).
+
+Buckets live in a ``BucketStore``. ``LocalBucketStore`` keeps them in this
+process, so limits apply per worker and need no external service.
+``MongoBucketStore`` keeps them in ``rate_limit_buckets`` and shares them
+between workers, at the cost of one atomic update per check.
+"""
+import abc
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+ADMISSION_STORE_LOCAL = "local"
+ADMISSION_STORE_MONGO = "mongo"
+
+# Proxies in front of the app whose X-Forwarded-For entries are trusted;
+# with none the peer address is the client
+FORWARDED_HOPS = int(os.getenv("ADMISSION_FORWARDED_HOPS", "0"))
+
+
+class BucketLimit(NamedTuple):
+    """A token bucket refilled at ``rate`` tokens a second, holding ``burst``."""
+    rate: float
+    burst: float
+
+    @classmethod
+    def per_minute(cls, per_minute: float, burst: float) -> "BucketLimit":
+        return cls(per_minute / 60, burst)
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 and self.burst >= 1
+
+
+# Rate limits per client address (register and login) and per account (login);
+# a rate of 0 turns a limit off
+IP_LIMIT = BucketLimit.per_minute(
+    float(os.getenv("AUTH_IP_RATE_PER_MINUTE", "60")), float(os.getenv("AUTH_IP_BURST", "30"))
+)
+ACCOUNT_LIMIT = BucketLimit.per_minute(
+    float(os.getenv("AUTH_ACCOUNT_RATE_PER_MINUTE", "10")), float(os.getenv("AUTH_ACCOUNT_BURST", "5"))
+)
+
+
+class Throttled(Exception):
+    """A request was shed because a bucket it draws from is empty."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Rate limit exceeded ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class BucketStore(abc.ABC):
+    """Where bucket levels are kept."""
+
+    @abc.abstractmethod
+    async def take(self, key: str, limit: BucketLimit, now: float) -> float:
+        """Take a token from bucket ``key``.
+
+        Returns 0 if one was taken, otherwise the seconds until one is
+        available. A bucket not seen before starts full.
+        """
+
+
+def _refill(tokens: float, updated: float, limit: BucketLimit, now: float) -> float:
+    return min(limit.burst, tokens + max(0.0, now - updated) * limit.rate)
+
+
+class LocalBucketStore(BucketStore):
+    """Buckets in this process, the least recently used dropped beyond ``max_keys``.
+
+    A dropped bucket comes back full, so only clients idle long enough to
+    fall out of the LRU regain their burst early.
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key -> [tokens, updated]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def take(self, key: str, limit: BucketLimit, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [limit.burst, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        tokens = _refill(bucket[0], bucket[1], limit, now)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0.0
+        bucket[0] = tokens
+        return (1 - tokens) / limit.rate
+
+
+class MongoBucketStore(BucketStore):
+    """Buckets shared by every worker, one document each.
+
+    The refill and the take are one pipeline update, so concurrent checks
+    from different workers never both spend the last token. A TTL index on
+    ``expires_at`` drops buckets once they would have refilled.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.rate_limit_buckets
+
+    async def take(self, key: str, limit: BucketLimit, now: float) -> float:
+        refilled = {"$min": [limit.burst, {"$add": [
+            {"$ifNull": ["$tokens", limit.burst]},
+            {"$multiply": [{"$max": [0, {"$subtract": [now, {"$ifNull": ["$updated", now]}]}]}, limit.rate]},
+        ]}]}
+        document = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated": now}},
+                {"$set": {"taken": {"$gte": ["$tokens", 1]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$taken", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "expires_at": datetime.utcnow() + timedelta(seconds=limit.burst / limit.rate),
+                }},
+            ],
+            projection={"_id": 0, "tokens": 1, "taken": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if document["taken"]:
+            return 0.0
+        return (1 - document["tokens"]) / limit.rate
+
+
+def client_address(peer: Optional[str], forwarded_for: Optional[str], hops: int = FORWARDED_HOPS) -> str:
+    """The client's address, trusting the last ``hops`` X-Forwarded-For entries."""
+    if hops > 0 and forwarded_for:
+        entries = [entry.strip() for entry in forwarded_for.split(",") if entry.strip()]
+        if entries:
+            return entries[-min(hops, len(entries))]
+    return peer or "unknown"
+
+
+class AdmissionController:
+    """Token buckets in front of the password hashing endpoints."""
+
+    def __init__(
+        self,
+        store: Optional[BucketStore] = None,
+        ip_limit: BucketLimit = IP_LIMIT,
+        account_limit: BucketLimit = ACCOUNT_LIMIT,
+    ):
+        self.store = store or LocalBucketStore()
+        self.ip_limit = ip_limit
+        self.account_limit = account_limit
+        # Requests shed, by the bucket that was empty
+        self.shed = {"ip": 0, "account": 0}
+
+    async def admit(self, address: str, account: Optional[str] = None) -> None:
+        """Take the request's tokens or raise ``Throttled``."""
+        checks: List[Tuple[str, str, BucketLimit]] = [("ip", f"ip:{address}", self.ip_limit)]
+        if account is not None:
+            # Emails and usernames are looked up as typed, but case must not
+            # give an attacker extra buckets
+            checks.append(("account", f"account:{account.strip().lower()}", self.account_limit))
+        now = time.time()
+        for reason, key, limit in checks:
+            if not limit.enabled:
+                continue
+            wait = await self.store.take(key, limit, now)
+            if wait > 0:
+                self.shed[reason] += 1
+                raise Throttled(reason, max(1, math.ceil(wait)))
+
+    def families(self) -> Iterable[Tuple[str, str, str, list]]:
+        """Metric families for the metrics endpoint."""
+        yield (
+            "auth_requests_shed_total", "counter", "Auth requests shed by a rate limit",
+            [("", {"limit": reason}, count) for reason, count in self.shed.items()],
+        )
+
+
+def create_store(kind: str, db: AsyncIOMotorDatabase) -> BucketStore:
+    if kind == ADMISSION_STORE_LOCAL:
+        return LocalBucketStore()
+    if kind == ADMISSION_STORE_MONGO:
+        return MongoBucketStore(db)
+    raise ValueError(f"Unknown admission store: {kind!r}")
@@ -1,33 +1,144 @@
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from typing import Any, Dict, NamedTuple, Optional, Union
+import time
+import uuid
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
+import secrets
 from motor.motor_asyncio import AsyncIOMotorCollection
-from models import User, TokenData
+from cache import TTLCache
+from hashing import HashPool, HashPoolSaturated
+from metrics import observe_hash
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing; lower BCRYPT_ROUNDS in dev/test, raise it in production
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# Hashing runs off the event loop in a bounded pool
+hash_pool = HashPool(
+    max_workers=int(os.getenv("HASH_POOL_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    max_pending=int(os.getenv("HASH_POOL_MAX_PENDING", "64")),
+    observer=observe_hash,
+    # Shed rather than make callers wait longer than this for a worker
+    max_queue_seconds=float(os.getenv("HASH_POOL_MAX_QUEUE_SECONDS", "2")),
+)
 
 # JWT settings
 SECRET_KEY = os.getenv("SECRET_KEY", "quest-tavern-secret-key-2025")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 days
+# Access tokens carry the claims requests are authenticated with, so they
+# are short-lived; clients renew them with a refresh token
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+ACCESS_TOKEN_TYPE = "access"
 
 # OAuth2 scheme
 security = HTTPBearer()
+# For endpoints that also accept requests without a token
+optional_security = HTTPBearer(auto_error=False)
+
+# Shared secret for the admin endpoints; they are disabled when unset
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+
+
+class CurrentUser(NamedTuple):
+    """What request authentication needs to know about a user."""
+    id: str
+    is_active: bool = True
+    username: Optional[str] = None
+
+
+class AccessClaims(NamedTuple):
+    """A verified access token."""
+    user: CurrentUser
+    token_id: str
+    issued_at: int
+    expires_at: int
+
+
+# Fields each read path loads; the password hash and (legacy, inline)
+# profile pictures stay in the database unless the path needs them
+AUTH_PROJECTION = {"_id": 0, "id": 1, "is_active": 1, "username": 1}
+LOGIN_PROJECTION = {"_id": 0, "id": 1, "is_active": 1, "username": 1, "password_hash": 1}
+# The fields of UserResponse
+PROFILE_FIELDS = ("id", "email", "username", "display_name", "profile_picture", "created_at", "is_active")
+PROFILE_PROJECTION = {"_id": 0, **{field: 1 for field in PROFILE_FIELDS}}
+
+# Access tokens already verified, keyed by the token itself: a hit skips
+# signature checking and claim parsing
+verified_tokens: TTLCache[AccessClaims] = TTLCache(
+    max_entries=int(os.getenv("ACCESS_TOKEN_CACHE_MAX_ENTRIES", "10000")),
+    ttl=float(os.getenv("ACCESS_TOKEN_CACHE_TTL_SECONDS", "300")),
+)
+
+
+class RevocationList:
+    """Access tokens revoked before they expire, held in memory until they do.
 
+    Entries are dropped once every token they cover has expired, so the list
+    never holds more than one access token lifetime of revocations. It is
+    per process: with several workers a revocation takes effect where it was
+    made, and everywhere else by expiry.
+    """
+
+    def __init__(self, lifetime: float):
+        self.lifetime = lifetime
+        # token id -> expiry of that token
+        self._tokens: Dict[str, float] = {}
+        # user id -> (tokens issued before this are revoked, entry expiry)
+        self._users: Dict[str, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._tokens) + len(self._users)
+
+    def revoke_token(self, token_id: str, expires_at: float) -> None:
+        self._prune()
+        self._tokens[token_id] = expires_at
+
+    def revoke_user(self, user_id: str) -> None:
+        """Revoke every access token issued to ``user_id`` so far."""
+        self._prune()
+        now = time.time()
+        self._users[user_id] = (now, now + self.lifetime)
+
+    def is_revoked(self, claims: AccessClaims) -> bool:
+        if claims.token_id in self._tokens:
+            return True
+        revoked = self._users.get(claims.user.id)
+        # ``iat`` has whole seconds, so tokens issued within the second of
+        # the revocation are revoked too
+        return revoked is not None and claims.issued_at <= int(revoked[0])
+
+    def _prune(self) -> None:
+        now = time.time()
+        self._tokens = {key: expiry for key, expiry in self._tokens.items() if expiry > now}
+        self._users = {key: entry for key, entry in self._users.items() if entry[1] > now}
+
+
+revocations = RevocationList(ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+async def _run_hash(operation: str, func, *args):
+    try:
+        return await hash_pool.run(operation, func, *args)
+    except HashPoolSaturated as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": str(e.retry_after)},
+        )
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash."""
-    return pwd_context.verify(plain_password, hashed_password)
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash without blocking the event loop."""
+    return await _run_hash("verify", pwd_context.verify, plain_password, hashed_password)
 
-def get_password_hash(password: str) -> str:
-    """Hash a password."""
-    return pwd_context.hash(password)
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password without blocking the event loop."""
+    return await _run_hash("hash", pwd_context.hash, password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -42,54 +153,89 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
-async def get_user_by_email(email: str, users_collection: AsyncIOMotorCollection) -> Optional[User]:
-    """Get user by email."""
-    user_data = await users_collection.find_one({"email": email})
-    if user_data:
-        return User(**user_data)
-    return None
+def create_user_access_token(user: CurrentUser) -> str:
+    """A short-lived access token carrying what authentication needs."""
+    return create_access_token({
+        "sub": user.id,
+        "usr": user.username,
+        "act": user.is_active,
+        "typ": ACCESS_TOKEN_TYPE,
+        "jti": uuid.uuid4().hex,
+        "iat": int(time.time()),
+    })
 
 
-async def get_user_by_username(username: str, users_collection: AsyncIOMotorCollection) -> Optional[User]:
-    """Get user by username."""
-    user_data = await users_collection.find_one({"username": username})
-    if user_data:
-        return User(**user_data)
-    return None
+def decode_access_token(token: str) -> AccessClaims:
+    """Verify an access token; raises ``JWTError`` for invalid ones.
 
+    Tokens that only carry ``sub``, issued with a 30-day lifetime before
+    access tokens had claims, are invalid: they cannot be revoked.
+    """
+    claims = verified_tokens.get(token)
+    if claims is not None:
+        if claims.expires_at > time.time():
+            return claims
+        verified_tokens.invalidate(token)
+        raise JWTError("Signature has expired.")
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if payload.get("typ") != ACCESS_TOKEN_TYPE:
+        raise JWTError("Not an access token")
+    if payload.get("sub") is None or not payload.get("jti"):
+        raise JWTError("Missing subject or token id")
+    claims = AccessClaims(
+        CurrentUser(payload["sub"], payload.get("act", True), payload.get("usr")),
+        payload["jti"],
+        payload.get("iat", 0),
+        payload["exp"],
+    )
+    verified_tokens.set(token, claims)
+    return claims
 
-async def get_user_by_id(user_id: str, users_collection: AsyncIOMotorCollection) -> Optional[User]:
-    """Get user by ID."""
-    user_data = await users_collection.find_one({"id": user_id})
+
+async def get_auth_user(user_id: str, users_collection: AsyncIOMotorCollection) -> Optional[CurrentUser]:
+    """Get the id and active flag of a user."""
+    user_data = await users_collection.find_one({"id": user_id}, AUTH_PROJECTION)
     if user_data:
-        return User(**user_data)
+        return CurrentUser(user_data["id"], user_data.get("is_active", True), user_data.get("username"))
     return None
 
 
+async def get_user_profile(user_id: str, users_collection: AsyncIOMotorCollection) -> Optional[Dict[str, Any]]:
+    """Get the UserResponse fields of a user as a document."""
+    return await users_collection.find_one({"id": user_id}, PROFILE_PROJECTION)
+
+
 async def authenticate_user(
     email_or_username: str, 
     password: str, 
     users_collection: AsyncIOMotorCollection
-) -> Union[User, bool]:
+) -> Union[CurrentUser, bool]:
     """Authenticate a user with email/username and password."""
-    # Try to find user by email first
-    user = await get_user_by_email(email_or_username, users_collection)
-    if not user:
-        # If not found by email, try username
-        user = await get_user_by_username(email_or_username, users_collection)
+    # Usernames cannot contain "@" and emails must, so one lookup suffices
+    field = "email" if "@" in email_or_username else "username"
+    user_data = await users_collection.find_one({field: email_or_username}, LOGIN_PROJECTION)
     
-    if not user:
+    if not user_data:
         return False
-    if not verify_password(password, user.password_hash):
+    if not await verify_password_async(password, user_data["password_hash"]):
         return False
-    return user
+    if not user_data.get("is_active", True):
+        return False
+    return CurrentUser(user_data["id"], user_data.get("is_active", True), user_data.get("username"))
 
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    users_collection: AsyncIOMotorCollection = None
-) -> User:
-    """Get the current authenticated user."""
+) -> CurrentUser:
+    """Get the current authenticated user, from the access token alone."""
+    return verify_access_token(credentials.credentials).user
+
+
+def verify_access_token(token: str) -> AccessClaims:
+    """The claims of a valid, unrevoked access token of an active user.
+
+    Raises a 401 ``HTTPException`` otherwise.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -97,18 +243,33 @@ async def get_current_user(
     )
     
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-        token_data = TokenData(user_id=user_id)
+        claims = decode_access_token(token)
     except JWTError:
         raise credentials_exception
-    
-    user = await get_user_by_id(token_data.user_id, users_collection)
-    if user is None:
+    if revocations.is_revoked(claims) or not claims.user.is_active:
         raise credentials_exception
-    return user
+    return claims
+
+
+def revoke_access_token(token: str) -> Optional[AccessClaims]:
+    """Revoke an access token until it expires and return its claims.
+
+    Invalid tokens are ignored.
+    """
+    try:
+        claims = decode_access_token(token)
+    except JWTError:
+        return None
+    revocations.revoke_token(claims.token_id, claims.expires_at)
+    return claims
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Dependency guarding admin endpoints with the X-Admin-Token header."""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_API_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token")
 
 
 def generate_default_avatar(username: str) -> str:
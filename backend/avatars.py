@@ -0,0 +1,133 @@
+"""Content-addressed storage for profile pictures.
+
+Avatars are stored once per distinct image in the ``avatars`` collection,
+keyed by the SHA-256 of their bytes, and served from
+``GET /api/avatars/{hash}``. User documents only carry the avatar URL, so
+the image no longer rides along with every user read. Avatars are capped
+well below the 16 MB document limit, so one document per image is enough
+and GridFS chunking would only add round trips.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+from datetime import datetime
+from typing import Optional, Set, Tuple
+from urllib.parse import unquote_to_bytes
+
+from bson import Binary
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+AVATAR_PATH = "/api/avatars/"
+AVATAR_MAX_BYTES = int(os.getenv("AVATAR_MAX_BYTES", str(2 * 1024 * 1024)))
+
+
+class InvalidAvatar(ValueError):
+    """Raised when a submitted profile picture cannot be stored."""
+
+
+def parse_data_url(value: str) -> Tuple[bytes, str]:
+    """Decode a ``data:`` URL into its bytes and content type."""
+    header, separator, payload = value.partition(",")
+    if not separator or not header.startswith("data:"):
+        raise InvalidAvatar("Malformed data URL")
+    params = header[len("data:"):].split(";")
+    content_type = params[0] or "text/plain"
+    if not content_type.startswith("image/"):
+        raise InvalidAvatar("Profile picture must be an image")
+    try:
+        if "base64" in params[1:]:
+            data = base64.b64decode(payload, validate=True)
+        else:
+            data = unquote_to_bytes(payload)
+    except (binascii.Error, ValueError):
+        raise InvalidAvatar("Profile picture is not valid base64")
+    return data, content_type
+
+
+class AvatarStore:
+    """Stores avatar images keyed by content hash."""
+
+    def __init__(self, db: AsyncIOMotorDatabase, base_url: str = ""):
+        self.collection = db.avatars
+        self.base_url = base_url.rstrip("/")
+        # Hashes known to be stored already, so repeats skip the database
+        self._known: Set[str] = set()
+
+    def url(self, digest: str) -> str:
+        return f"{self.base_url}{AVATAR_PATH}{digest}"
+
+    async def put(self, data: bytes, content_type: str) -> str:
+        """Store an image once and return its content hash."""
+        if len(data) > AVATAR_MAX_BYTES:
+            raise InvalidAvatar(f"Profile picture must be at most {AVATAR_MAX_BYTES} bytes")
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in self._known:
+            return digest
+        try:
+            await self.collection.insert_one({
+                "_id": digest,
+                "content_type": content_type,
+                "size": len(data),
+                "data": Binary(data),
+                "created_at": datetime.utcnow(),
+            })
+        except DuplicateKeyError:
+            pass  # Identical image stored already
+        self._known.add(digest)
+        return digest
+
+    async def get(self, digest: str) -> Optional[Tuple[bytes, str]]:
+        avatar = await self.collection.find_one({"_id": digest})
+        if avatar is None:
+            return None
+        return bytes(avatar["data"]), avatar["content_type"]
+
+    async def store_picture(self, value: Optional[str]) -> Optional[str]:
+        """Turn a submitted profile picture into the URL to keep on the user.
+
+        Data URLs are stored in the blob store; any other URL is kept as is.
+        """
+        if not value or not value.startswith("data:"):
+            return value
+        data, content_type = parse_data_url(value)
+        return self.url(await self.put(data, content_type))
+
+
+async def migrate_user_avatars(db: AsyncIOMotorDatabase, store: AvatarStore) -> int:
+    """Move inline data-URL profile pictures of existing users into the store."""
+    migrated = 0
+    cursor = db.users.find(
+        {"profile_picture": {"$regex": "^data:"}}, {"_id": 0, "id": 1, "profile_picture": 1}
+    )
+    async for user in cursor:
+        try:
+            url = await store.store_picture(user["profile_picture"])
+        except InvalidAvatar:
+            continue
+        await db.users.update_one(
+            {"id": user["id"], "profile_picture": user["profile_picture"]},
+            {"$set": {"profile_picture": url}},
+        )
+        migrated += 1
+    return migrated
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / ".env")
+
+    async def main() -> None:
+        client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        db = client[os.environ["DB_NAME"]]
+        count = await migrate_user_avatars(db, AvatarStore(db, os.getenv("AVATAR_BASE_URL", "")))
+        print(f"Migrated {count} profile picture(s)")
+        client.close()
+
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""Benchmark of the GET /api/quest-data serialization paths.
+
+Compares, for client-shaped quest data of about 10 KB, 100 KB and 1 MB:
+
+* ``fastapi``: what a ``response_model=dict`` handler returning the dict
+  costs, i.e. response validation, ``jsonable_encoder`` and
+  ``JSONResponse`` rendering;
+* ``stdlib``: ``json.dumps`` of the payload;
+* ``json_codec``: ``json_codec.dumps`` (orjson when installed);
+* ``plain``: what ``QuestStore.read_serialized`` does for an uncompressed
+  document, encoding the stored ``quest_data`` and splicing it in; this is
+  no cheaper than ``json_codec`` since the dict still has to be encoded;
+* ``zlib``: what it does for a compressed document, decompressing the
+  stored blob and splicing the bytes in without decoding them. Only this
+  path skips JSON encoding, so the saving needs quest data compression on.
+
+Run ``python bench_json.py``; times are the median of several runs.
+"""
+import asyncio
+import json
+import random
+import statistics
+import time
+import zlib
+from typing import Any, Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+import json_codec
+from loadtest import make_quest_data
+
+SIZES = {"10KB": 10 * 1024, "100KB": 100 * 1024, "1MB": 1024 * 1024}
+
+
+def payload_of_size(target: int) -> Dict[str, Any]:
+    """Quest data whose JSON encoding is at least ``target`` bytes."""
+    completed = 1
+    while True:
+        quest_data = make_quest_data(random.Random(0), completed, max(1, completed // 20))
+        if len(json.dumps(quest_data)) >= target:
+            return {"quest_data": quest_data}
+        completed = max(completed + 1, int(completed * 1.2))
+
+
+def median_ms(func: Callable[[], Any], budget: float = 1.0) -> float:
+    timings: List[float] = []
+    deadline = time.perf_counter() + budget
+    while len(timings) < 5 or (time.perf_counter() < deadline and len(timings) < 200):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main() -> None:
+    field = create_response_field(name="Response_get_quest_data", type_=dict)
+    loop = asyncio.new_event_loop()
+
+    def fastapi_path(payload):
+        content = loop.run_until_complete(
+            serialize_response(field=field, response_content=payload, is_coroutine=True)
+        )
+        return JSONResponse(jsonable_encoder(content)).body
+
+    print(f"encoder: {json_codec.ENCODER}")
+    print(f"{'size':<8}{'bytes':>10}{'fastapi':>11}{'stdlib':>10}{'json_codec':>12}{'plain':>10}{'zlib':>13}  (ms)")
+    for name, target in SIZES.items():
+        payload = payload_of_size(target)
+        raw = json_codec.dumps(payload["quest_data"])
+        stored = zlib.compress(raw, 6)
+        results = [
+            median_ms(lambda: fastapi_path(payload)),
+            median_ms(lambda: json.dumps(payload, separators=(",", ":")).encode("utf-8")),
+            median_ms(lambda: json_codec.dumps(payload)),
+            median_ms(lambda: json_codec.object_with_raw("quest_data", json_codec.dumps(payload["quest_data"]))),
+            median_ms(lambda: json_codec.object_with_raw("quest_data", zlib.decompress(stored))),
+        ]
+        print(f"{name:<8}{len(raw):>10}" + "".join(
+            f"{value:>{width}.3f}" for value, width in zip(results, (11, 10, 12, 10, 13))
+        ))
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
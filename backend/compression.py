@@ -0,0 +1,168 @@
+"""Compression codecs for quest data transport and storage.
+
+gzip and zlib come from the standard library; zstd and brotli are used
+when the optional ``zstandard`` / ``brotli`` packages are installed.
+Every call is timed in CPU seconds and counted per codec so the ratio and
+cost can be tuned.
+"""
+import gzip
+import time
+import zlib
+from typing import Dict, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+# Don't bother compressing payloads smaller than this
+MIN_COMPRESS_BYTES = 1024
+
+# Preferred first when the client accepts several
+_PREFERENCE = ("zstd", "br", "gzip")
+
+
+class UnsupportedEncoding(ValueError):
+    """Raised for a content coding this server cannot handle."""
+
+
+class PayloadTooLarge(ValueError):
+    """Raised when a compressed payload expands beyond the allowed size."""
+
+
+def available_encodings() -> Tuple[str, ...]:
+    return tuple(
+        encoding for encoding in _PREFERENCE
+        if (encoding != "zstd" or zstandard) and (encoding != "br" or brotli)
+    )
+
+
+def storage_codecs() -> Tuple[str, ...]:
+    """Codecs usable for compressing stored quest data."""
+    return ("zlib", "zstd") if zstandard else ("zlib",)
+
+
+stats: Dict[str, Dict[str, float]] = {}
+
+
+def _record(key: str, bytes_in: int, bytes_out: int, cpu_seconds: float) -> None:
+    entry = stats.get(key)
+    if entry is None:
+        entry = stats[key] = {"calls": 0, "bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0}
+    entry["calls"] += 1
+    entry["bytes_in"] += bytes_in
+    entry["bytes_out"] += bytes_out
+    entry["cpu_seconds"] += cpu_seconds
+
+
+def compression_ratios() -> Dict[str, float]:
+    """Uncompressed / compressed size per codec over all compress calls."""
+    return {
+        key.split(":", 1)[1]: entry["bytes_in"] / entry["bytes_out"]
+        for key, entry in stats.items()
+        if key.startswith("compress:") and entry["bytes_out"]
+    }
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if encoding in ("zlib", "deflate"):
+        return zlib.compress(data, 6)
+    if encoding == "zstd" and zstandard:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if encoding == "br" and brotli:
+        return brotli.compress(data, quality=5)
+    raise UnsupportedEncoding(f"Unsupported encoding: {encoding!r}")
+
+
+# Compressed bytes fed to the brotli decompressor at a time; brotli can't
+# cap its output per call, so small inputs keep each step's expansion bounded
+BROTLI_INPUT_CHUNK = 4096
+
+
+def _too_large(max_size: Optional[int]) -> PayloadTooLarge:
+    return PayloadTooLarge(f"Payload expands beyond {max_size} bytes")
+
+
+def _decompress(data: bytes, encoding: str, max_size: Optional[int]) -> bytes:
+    if encoding in ("gzip", "zlib", "deflate"):
+        # wbits: gzip header, zlib header
+        decompressor = zlib.decompressobj(31 if encoding == "gzip" else 15)
+        result = decompressor.decompress(data, max_size or 0)
+        if decompressor.unconsumed_tail:
+            raise _too_large(max_size)
+        if not decompressor.eof:
+            raise ValueError(f"Truncated {encoding} stream")
+        return result
+    if encoding == "zstd" and zstandard:
+        decompressor = zstandard.ZstdDecompressor()
+        reader = decompressor.stream_reader(data)
+        limit = max_size + 1 if max_size else -1
+        result = reader.read(limit)
+        if max_size and len(result) > max_size:
+            raise _too_large(max_size)
+        return result
+    if encoding == "br" and brotli:
+        decompressor = brotli.Decompressor()
+        parts = []
+        size = 0
+        for offset in range(0, len(data), BROTLI_INPUT_CHUNK):
+            part = decompressor.process(data[offset:offset + BROTLI_INPUT_CHUNK])
+            size += len(part)
+            if max_size and size > max_size:
+                raise _too_large(max_size)
+            parts.append(part)
+        if not decompressor.is_finished():
+            raise ValueError("Truncated br stream")
+        return b"".join(parts)
+    raise UnsupportedEncoding(f"Unsupported encoding: {encoding!r}")
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    started = time.thread_time()
+    result = _compress(data, encoding)
+    _record(f"compress:{encoding}", len(data), len(result), time.thread_time() - started)
+    return result
+
+
+def decompress(data: bytes, encoding: str, max_size: Optional[int] = None) -> bytes:
+    """Decompress ``data``, refusing to expand past ``max_size`` bytes."""
+    encoding = encoding.strip().lower()
+    started = time.thread_time()
+    result = _decompress(data, encoding, max_size)
+    _record(f"decompress:{encoding}", len(data), len(result), time.thread_time() - started)
+    return result
+
+
+def negotiate(
+    accept_encoding: Optional[str], encodings: Optional[Tuple[str, ...]] = None
+) -> Optional[str]:
+    """Pick the best supported encoding from an Accept-Encoding header,
+    optionally limited to ``encodings``."""
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in available_encodings():
+        if encodings is not None and encoding not in encodings:
+            continue
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
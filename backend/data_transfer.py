@@ -0,0 +1,194 @@
+"""Streaming NDJSON export and bulk import of all user data.
+
+Each line is ``{"collection": ..., "document": ...}`` in MongoDB Extended
+JSON, so dates and binary fields (compressed quest data, avatars) survive
+the round trip. Exports read cursors batch by batch and imports insert
+batch by batch; neither side holds more than one batch in memory. The
+export is not a point-in-time snapshot of a live database.
+"""
+import functools
+import json
+import zlib
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from bson import json_util
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from quest_store import ENTITY_COLLECTIONS
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 10000
+# A document is at most 16 MB of BSON; leave room for the JSON encoding
+MAX_LINE_BYTES = 64 * 1024 * 1024
+
+# Collection -> fields identifying a document across environments
+COLLECTION_KEYS: Dict[str, Tuple[str, ...]] = {
+    "users": ("id",),
+    "avatars": ("_id",),
+    "quest_data": ("user_id",),
+    **{name: ("user_id", "id") for name in ENTITY_COLLECTIONS.values()},
+    "quest_stats": ("user_id",),
+    "achievement_progress": ("user_id",),
+    "quest_events": ("user_id", "seq"),
+    "quest_event_heads": ("user_id",),
+}
+
+ON_CONFLICT_SKIP = "skip"
+ON_CONFLICT_REPLACE = "replace"
+
+_JSON_OPTIONS = json_util.JSONOptions(json_mode=json_util.JSONMode.RELAXED)
+# The C encoder handles plain JSON; only BSON types go through json_util
+_encode_bson = functools.partial(json_util.default, json_options=_JSON_OPTIONS)
+
+
+class InvalidImportLine(ValueError):
+    """Raised for an import line that cannot be applied."""
+
+
+async def export_lines(
+    db: AsyncIOMotorDatabase,
+    collections: Optional[List[str]] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> AsyncIterator[bytes]:
+    """NDJSON chunks for ``collections``, one chunk per cursor batch."""
+    for name in collections or list(COLLECTION_KEYS):
+        # Object ids mean nothing in another environment; other keys do
+        projection = None if "_id" in COLLECTION_KEYS[name] else {"_id": 0}
+        cursor = db[name].find({}, projection).batch_size(batch_size)
+        lines: List[str] = []
+        async for document in cursor:
+            lines.append(json.dumps(
+                {"collection": name, "document": document},
+                default=_encode_bson, separators=(",", ":"),
+            ))
+            if len(lines) >= batch_size:
+                yield ("\n".join(lines) + "\n").encode("utf-8")
+                lines = []
+        if lines:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Gzip a byte stream on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def gunzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    decompressor = zlib.decompressobj(31)
+    async for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    remainder = decompressor.flush()
+    if remainder:
+        yield remainder
+    if not decompressor.eof:
+        raise zlib.error("Truncated gzip stream")
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a byte stream into lines without buffering more than one line."""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+        if len(pending) > MAX_LINE_BYTES:
+            raise InvalidImportLine(f"Line longer than {MAX_LINE_BYTES} bytes")
+    if pending:
+        yield pending
+
+
+class Importer:
+    """Applies NDJSON lines to the database in batches per collection."""
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        on_conflict: str = ON_CONFLICT_SKIP,
+    ):
+        if on_conflict not in (ON_CONFLICT_SKIP, ON_CONFLICT_REPLACE):
+            raise ValueError(f"Unknown conflict mode: {on_conflict!r}")
+        self.db = db
+        self.batch_size = batch_size
+        self.on_conflict = on_conflict
+        self._batches: Dict[str, List[Dict[str, Any]]] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _stats(self, name: str) -> Dict[str, int]:
+        return self.stats.setdefault(name, {"inserted": 0, "replaced": 0, "skipped": 0})
+
+    async def add_line(self, line_number: int, line: bytes) -> None:
+        if not line.strip():
+            return
+        try:
+            record = json_util.loads(line)
+        except (ValueError, TypeError):
+            raise InvalidImportLine(f"Line {line_number}: not valid JSON")
+        if not isinstance(record, dict) or not isinstance(record.get("document"), dict):
+            raise InvalidImportLine(f"Line {line_number}: expected a collection and a document")
+        name = record.get("collection")
+        if name not in COLLECTION_KEYS:
+            raise InvalidImportLine(f"Line {line_number}: unknown collection {name!r}")
+        document = record["document"]
+        if any(field not in document for field in COLLECTION_KEYS[name]):
+            raise InvalidImportLine(f"Line {line_number}: document lacks {', '.join(COLLECTION_KEYS[name])}")
+        batch = self._batches.setdefault(name, [])
+        batch.append(document)
+        if len(batch) >= self.batch_size:
+            await self._flush(name)
+
+    async def _flush(self, name: str) -> None:
+        documents = self._batches.pop(name, [])
+        if not documents:
+            return
+        stats = self._stats(name)
+        collection = self.db[name]
+        if self.on_conflict == ON_CONFLICT_REPLACE:
+            operations = [
+                ReplaceOne({field: document[field] for field in COLLECTION_KEYS[name]}, document, upsert=True)
+                for document in documents
+            ]
+            result = await collection.bulk_write(operations, ordered=False)
+            stats["inserted"] += result.upserted_count
+            stats["replaced"] += result.matched_count
+            return
+        try:
+            result = await collection.insert_many(documents, ordered=False)
+            stats["inserted"] += len(result.inserted_ids)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            # Already present (unique index on the key): leave it alone
+            stats["inserted"] += e.details.get("nInserted", 0)
+            stats["skipped"] += len(errors)
+
+    async def finish(self) -> Dict[str, Dict[str, int]]:
+        for name in list(self._batches):
+            await self._flush(name)
+        return self.stats
+
+
+async def import_stream(
+    db: AsyncIOMotorDatabase,
+    chunks: AsyncIterator[bytes],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    on_conflict: str = ON_CONFLICT_SKIP,
+) -> Dict[str, Any]:
+    """Import an NDJSON byte stream; returns per-collection counts."""
+    importer = Importer(db, batch_size, on_conflict)
+    lines = 0
+    async for line in iter_lines(chunks):
+        lines += 1
+        await importer.add_line(lines, line)
+    return {"lines": lines, "collections": await importer.finish()}
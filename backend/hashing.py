@@ -0,0 +1,120 @@
+"""Bounded worker pool for CPU-heavy password hashing.
+
+bcrypt takes tens to hundreds of milliseconds per call and would stall the
+event loop if run inline. The bcrypt backend releases the GIL while
+hashing, so a small thread pool gives real parallelism.
+"""
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+class HashPoolSaturated(RuntimeError):
+    """Raised when too many hash operations are already running or queued."""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        # Whole seconds until the queue has likely drained
+        self.retry_after = retry_after
+
+
+class HashPool:
+    """Runs blocking hash functions in a dedicated, size-bounded thread pool.
+
+    At most ``max_workers`` operations run at once and at most
+    ``max_pending`` are admitted in total (running plus queued); beyond that
+    callers are rejected immediately rather than queueing without bound.
+    With ``max_queue_seconds`` callers are also rejected when the queue
+    ahead of them would likely take longer than that to drain, judged by
+    the recent mean operation time.
+    """
+
+    # Weight of the latest operation in the running mean
+    MEAN_WEIGHT = 0.2
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_pending: int,
+        observer: Optional[Callable[[str, float, float], None]] = None,
+        max_queue_seconds: Optional[float] = None,
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_queue_seconds = max_queue_seconds
+        self.pending = 0
+        self.mean_seconds = 0.0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password-hash"
+        )
+        self.stats: Dict[str, Dict[str, float]] = {}
+        # Rejections by cause: too many pending, or too long a wait
+        self.rejected = {"pending": 0, "wait": 0}
+        # Called with (operation, queued seconds, elapsed seconds) per operation
+        self.observer = observer
+
+    def _record(self, operation: str, queued: float, elapsed: float) -> None:
+        stats = self.stats.get(operation)
+        if stats is None:
+            stats = self.stats[operation] = {
+                "count": 0,
+                "total_seconds": 0.0,
+                "max_seconds": 0.0,
+                "queue_seconds": 0.0,
+            }
+        stats["count"] += 1
+        stats["total_seconds"] += elapsed
+        stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+        stats["queue_seconds"] += queued
+        if self.mean_seconds:
+            self.mean_seconds += self.MEAN_WEIGHT * (elapsed - self.mean_seconds)
+        else:
+            self.mean_seconds = elapsed
+        if self.observer is not None:
+            self.observer(operation, queued, elapsed)
+
+    def estimated_wait(self) -> float:
+        """Seconds a newly submitted operation would likely queue."""
+        waiting = max(0, self.pending - self.max_workers + 1)
+        return waiting / self.max_workers * self.mean_seconds
+
+    async def run(self, operation: str, func: Callable[..., Any], *args: Any) -> Any:
+        """Run ``func(*args)`` in the pool, timing it under ``operation``."""
+        wait = self.estimated_wait()
+        if self.pending >= self.max_pending:
+            cause = "pending"
+        elif self.max_queue_seconds is not None and wait > self.max_queue_seconds:
+            cause = "wait"
+        else:
+            cause = None
+        if cause is not None:
+            self.rejected[cause] += 1
+            raise HashPoolSaturated(
+                f"{self.pending} hash operations already pending",
+                retry_after=max(1, math.ceil(wait)),
+            )
+
+        self.pending += 1
+        submitted = time.perf_counter()
+        timings = {}
+
+        def timed() -> Any:
+            started = time.perf_counter()
+            timings["queued"] = started - submitted
+            try:
+                return func(*args)
+            finally:
+                timings["elapsed"] = time.perf_counter() - started
+
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, timed)
+        finally:
+            self.pending -= 1
+            if "elapsed" in timings:
+                self._record(operation, timings["queued"], timings["elapsed"])
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,90 @@
+"""Cursor pagination over the append-only history sections of quest data.
+
+History is returned newest first, ordered by a timestamp field and then by
+entity id so the order is stable. Cursors are opaque to clients: they
+encode the (timestamp, id) of the last item on the previous page. Entries
+without the timestamp are not listed.
+"""
+import base64
+import binascii
+import json
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class HistoryView(NamedTuple):
+    section: str  # top-level quest data key
+    field: str  # ISO timestamp the view is ordered by
+
+
+HISTORY_VIEWS: Dict[str, HistoryView] = {
+    "completed_quests": HistoryView("completedQuests", "dateCompleted"),
+    "claimed_rewards": HistoryView("claimedRewards", "dateClaimed"),
+    "used_items": HistoryView("claimedRewards", "dateUsed"),
+}
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue."""
+
+
+def encode_cursor(position: Tuple[str, str]) -> str:
+    raw = json.dumps(list(position), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, str]]:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, entity_id = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(timestamp, str) or not isinstance(entity_id, str):
+        raise InvalidCursor("Invalid cursor")
+    return timestamp, entity_id
+
+
+def page_from_positions(
+    rows: List[Tuple[Tuple[str, str], Any]], limit: int
+) -> Tuple[List[Any], Optional[str]]:
+    """Build a page from up to ``limit + 1`` already ordered (position, item) rows."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1][0]) if has_more and rows else None
+    return [item for _, item in rows], next_cursor
+
+
+def page_items(
+    items: List[Any],
+    ids: List[str],
+    field: str,
+    cursor: Optional[Tuple[str, str]],
+    limit: int,
+) -> Tuple[List[Any], Optional[str]]:
+    """Page through an in-memory history list, newest first."""
+    rows = [
+        ((item[field], entity_id), item)
+        for entity_id, item in zip(ids, items)
+        if isinstance(item, dict) and isinstance(item.get(field), str)
+    ]
+    rows.sort(key=lambda row: row[0], reverse=True)
+    if cursor is not None:
+        rows = [row for row in rows if row[0] < cursor]
+    return page_from_positions(rows[:limit + 1], limit)
+
+
+def after_cursor_query(field: str, cursor: Optional[Tuple[str, str]]) -> Dict[str, Any]:
+    """Mongo filter for entity documents strictly after ``cursor`` (newest first)."""
+    if cursor is None:
+        return {field: {"$type": "string"}}
+    timestamp, entity_id = cursor
+    return {
+        "$or": [
+            {field: {"$lt": timestamp, "$type": "string"}},
+            {field: timestamp, "id": {"$lt": entity_id}},
+        ]
+    }
@@ -0,0 +1,87 @@
+"""HTTP content negotiation for compressed request and response bodies."""
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException, Request, Response, status
+from fastapi.routing import APIRoute
+
+import json_codec
+from compression import (
+    MIN_COMPRESS_BYTES, PayloadTooLarge, UnsupportedEncoding, compress, decompress, negotiate
+)
+
+# Largest request body we are willing to inflate
+MAX_DECOMPRESSED_BYTES = int(os.getenv("MAX_DECOMPRESSED_BYTES", str(32 * 1024 * 1024)))
+
+
+class DecompressedRequest(Request):
+    """Request whose body is transparently decoded from its Content-Encoding."""
+
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            body = await super().body()
+            encoding = self.headers.get("content-encoding", "identity")
+            if body and encoding.lower() != "identity":
+                try:
+                    body = decompress(body, encoding, MAX_DECOMPRESSED_BYTES)
+                except UnsupportedEncoding as e:
+                    raise HTTPException(
+                        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e)
+                    )
+                except PayloadTooLarge as e:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e)
+                    )
+                except Exception:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Malformed {encoding} request body",
+                    )
+            self._body = body
+        return self._body
+
+
+class DecompressingRoute(APIRoute):
+    """Route class accepting gzip/zstd/br compressed request bodies."""
+
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            if "content-encoding" in request.headers:
+                request = DecompressedRequest(request.scope, request.receive)
+            return await original_route_handler(request)
+
+        return route_handler
+
+
+def json_response(
+    payload: Any,
+    accept_encoding: Optional[str],
+    headers: Optional[Dict[str, str]] = None,
+    status_code: int = status.HTTP_200_OK,
+) -> Response:
+    """Serialize ``payload`` as JSON, compressed if the client accepts it."""
+    return encoded_json_response(json_codec.dumps(payload), accept_encoding, headers, status_code)
+
+
+def encoded_json_response(
+    body: bytes,
+    accept_encoding: Optional[str],
+    headers: Optional[Dict[str, str]] = None,
+    status_code: int = status.HTTP_200_OK,
+) -> Response:
+    """Send already serialized JSON ``body``, compressed if the client accepts it."""
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    encoding = negotiate(accept_encoding) if len(body) >= MIN_COMPRESS_BYTES else None
+    if encoding:
+        started = time.thread_time()
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+        # Lets clients and proxies see what compression costs per response
+        headers["Server-Timing"] = f"compress;desc={encoding};dur={(time.thread_time() - started) * 1000:.2f}"
+    return Response(
+        content=body, status_code=status_code, media_type="application/json", headers=headers
+    )
@@ -0,0 +1,179 @@
+"""MongoDB index definitions and startup bootstrap.
+
+Every hot query filters on a field other than ``_id``; these indexes keep
+those lookups from scanning whole collections.
+"""
+import logging
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from history import HISTORY_VIEWS
+from quest_store import ENTITY_COLLECTIONS
+from status_checks import RETENTION_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Index bootstrap modes (MONGO_INDEX_MODE)
+INDEX_MODE_CREATE = "create"  # create anything missing
+INDEX_MODE_VERIFY = "verify"  # refuse to start if anything is missing
+INDEX_MODE_OFF = "off"
+
+
+class IndexSpec(NamedTuple):
+    collection: str
+    keys: List[Tuple[str, int]]
+    name: str
+    unique: bool = False
+    expire_after_seconds: Optional[int] = None  # TTL index
+
+
+REQUIRED_INDEXES: List[IndexSpec] = [
+    IndexSpec("users", [("id", ASCENDING)], "users_id_unique", unique=True),
+    IndexSpec("users", [("email", ASCENDING)], "users_email_unique", unique=True),
+    IndexSpec("users", [("username", ASCENDING)], "users_username_unique", unique=True),
+    IndexSpec("quest_data", [("user_id", ASCENDING)], "quest_data_user_id_unique", unique=True),
+    IndexSpec("quest_stats", [("user_id", ASCENDING)], "quest_stats_user_id_unique", unique=True),
+    IndexSpec("achievement_progress", [("user_id", ASCENDING)], "achievement_progress_user_id_unique", unique=True),
+    IndexSpec(
+        "status_checks", [("timestamp", ASCENDING)], "status_checks_timestamp_ttl",
+        expire_after_seconds=RETENTION_SECONDS,
+    ),
+    IndexSpec(
+        "status_checks",
+        [("client_name", ASCENDING), ("timestamp", DESCENDING), ("id", DESCENDING)],
+        "status_checks_client_name_timestamp",
+    ),
+    IndexSpec(
+        "quest_events", [("user_id", ASCENDING), ("seq", ASCENDING)], "quest_events_user_id_seq_unique",
+        unique=True,
+    ),
+    IndexSpec("quest_event_heads", [("user_id", ASCENDING)], "quest_event_heads_user_id_unique", unique=True),
+    IndexSpec(
+        "refresh_tokens", [("token_hash", ASCENDING)], "refresh_tokens_token_hash_unique", unique=True
+    ),
+    IndexSpec("refresh_tokens", [("family", ASCENDING)], "refresh_tokens_family"),
+    IndexSpec("refresh_tokens", [("user_id", ASCENDING)], "refresh_tokens_user_id"),
+    IndexSpec("refresh_tokens", [("expires_at", ASCENDING)], "refresh_tokens_expires_at_ttl", expire_after_seconds=0),
+    # Only written with ADMISSION_STORE=mongo
+    IndexSpec(
+        "rate_limit_buckets", [("expires_at", ASCENDING)], "rate_limit_buckets_expires_at_ttl",
+        expire_after_seconds=0,
+    ),
+]
+
+# Only needed by the normalized quest data layout
+ENTITY_INDEXES: List[IndexSpec] = [
+    spec
+    for name in ENTITY_COLLECTIONS.values()
+    for spec in (
+        IndexSpec(name, [("user_id", ASCENDING), ("id", ASCENDING)], f"{name}_user_id_id_unique", unique=True),
+        IndexSpec(name, [("user_id", ASCENDING), ("position", ASCENDING)], f"{name}_user_id_position"),
+    )
+] + [
+    # Cursor-paginated history views, newest first
+    IndexSpec(
+        ENTITY_COLLECTIONS[view.section],
+        [("user_id", ASCENDING), (f"data.{view.field}", DESCENDING), ("id", DESCENDING)],
+        f"{ENTITY_COLLECTIONS[view.section]}_{view.field}_history",
+    )
+    for view in HISTORY_VIEWS.values()
+]
+
+
+async def _retune_ttl(db: AsyncIOMotorDatabase, spec: IndexSpec) -> bool:
+    """Change the expiry of an existing TTL index in place, if there is one."""
+    info = await db[spec.collection].index_information()
+    if not any(
+        _same_keys(index, spec) and "expireAfterSeconds" in index for index in info.values()
+    ):
+        return False
+    await db.command(
+        "collMod", spec.collection,
+        index={"keyPattern": dict(spec.keys), "expireAfterSeconds": spec.expire_after_seconds},
+    )
+    return True
+
+
+class MissingIndexError(RuntimeError):
+    """Raised in verify mode when required indexes do not exist."""
+
+
+def _same_keys(existing: Dict, spec: IndexSpec) -> bool:
+    # index_information() lists keys as (field, direction) pairs
+    key = existing.get("key", [])
+    pairs = key.items() if isinstance(key, dict) else key
+    return [tuple(pair) for pair in pairs] == spec.keys
+
+
+def _matches(existing: Dict, spec: IndexSpec) -> bool:
+    return (
+        _same_keys(existing, spec)
+        and bool(existing.get("unique", False)) == spec.unique
+        and existing.get("expireAfterSeconds") == spec.expire_after_seconds
+    )
+
+
+def required_indexes(normalized: bool = False) -> List[IndexSpec]:
+    return REQUIRED_INDEXES + (ENTITY_INDEXES if normalized else [])
+
+
+async def missing_indexes(db: AsyncIOMotorDatabase, normalized: bool = False) -> List[IndexSpec]:
+    """Required indexes that do not exist yet, matched by keys, uniqueness
+    and TTL."""
+    existing_by_collection: Dict[str, List[Dict]] = {}
+    missing = []
+    for spec in required_indexes(normalized):
+        if spec.collection not in existing_by_collection:
+            info = await db[spec.collection].index_information()
+            existing_by_collection[spec.collection] = list(info.values())
+        if not any(_matches(index, spec) for index in existing_by_collection[spec.collection]):
+            missing.append(spec)
+    return missing
+
+
+async def ensure_indexes(
+    db: AsyncIOMotorDatabase, mode: str = INDEX_MODE_CREATE, normalized: bool = False
+) -> List[str]:
+    """Bring the database's indexes in line with the required ones.
+
+    Idempotent: only missing indexes are created, and their names are
+    returned. An index that cannot be built (e.g. duplicate emails blocking
+    a unique index) is logged and skipped. In verify mode nothing is created
+    and ``MissingIndexError`` is raised instead.
+    """
+    if mode == INDEX_MODE_OFF:
+        return []
+    if mode not in (INDEX_MODE_CREATE, INDEX_MODE_VERIFY):
+        raise ValueError(f"Unknown index mode: {mode!r}")
+
+    missing = await missing_indexes(db, normalized)
+    if mode == INDEX_MODE_VERIFY:
+        if missing:
+            raise MissingIndexError(
+                "Missing required indexes: "
+                + ", ".join(f"{spec.collection}.{spec.name}" for spec in missing)
+            )
+        return []
+
+    created = []
+    for spec in missing:
+        options = {"name": spec.name, "unique": spec.unique}
+        if spec.expire_after_seconds is not None:
+            options["expireAfterSeconds"] = spec.expire_after_seconds
+        try:
+            if spec.expire_after_seconds is not None and await _retune_ttl(db, spec):
+                created.append(f"{spec.collection}.{spec.name}")
+                continue
+            await db[spec.collection].create_index(spec.keys, **options)
+        except OperationFailure:
+            logger.exception("Could not create index %s.%s", spec.collection, spec.name)
+            continue
+        created.append(f"{spec.collection}.{spec.name}")
+    if created:
+        logger.info("Created indexes: %s", ", ".join(created))
+    else:
+        logger.info("All required indexes already exist")
+    return created
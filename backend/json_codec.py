@@ -0,0 +1,41 @@
+"""JSON encoding for the large quest data payloads.
+
+orjson is used when the optional ``orjson`` package is installed; on the
+multi-hundred-KB quest data blobs it is several times faster than the
+standard library, which remains the fallback. Both produce compact UTF-8
+JSON, so data written with one is read back with the other.
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+ENCODER = "orjson" if orjson is not None else "json"
+
+
+def dumps(value: Any) -> bytes:
+    """Compact JSON bytes for ``value``."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            # orjson refuses what the stdlib accepts, e.g. integers over 64 bits
+            pass
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            pass
+    return json.loads(data)
+
+
+def object_with_raw(key: str, raw: bytes) -> bytes:
+    """``{key: <raw>}`` for already serialized JSON ``raw``, without decoding it."""
+    return b"{" + dumps(key) + b":" + raw + b"}"
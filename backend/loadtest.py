@@ -0,0 +1,443 @@
+"""Concurrent load generator for the API.
+
+``concurrency`` virtual users each run a weighted mix of scenarios back to
+back for ``duration`` seconds. The scenarios are registering, logging in,
+and reading and saving quest data shaped like the client's state. Saves
+send the whole blob, as the client does, and each save grows the user's
+history by one completed quest. Results are per scenario latency
+percentiles, throughput and error rates, optionally written to a JSON file
+and checked against thresholds. Requests shed by admission control (429
+and 503) count towards ``shed_rate`` rather than ``error_rate``.
+
+Against a running server::
+
+    python loadtest.py --base-url http://localhost:8001 --concurrency 50 --duration 60
+
+In-process, with the app's startup hooks and the database from ``.env``::
+
+    python loadtest.py --in-process --concurrency 20 --duration 30 \\
+        --threshold "get_quest_data.p95_ms<=150" --threshold "total.error_rate<=0.01"
+
+The exit status is 1 when a threshold is violated. Lower ``BCRYPT_ROUNDS``
+on the server under test, and set ``AUTH_IP_RATE_PER_MINUTE`` and
+``AUTH_ACCOUNT_RATE_PER_MINUTE`` to 0 since every virtual user shares one
+address, unless password hashing or admission control is what is being
+measured.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+
+PASSWORD = "LoadTest123"
+RANKS = ("Common", "Rare", "Epic", "Legendary")
+RANK_XP = {"Common": 25, "Rare": 50, "Epic": 75, "Legendary": 100}
+# Responses of a server shedding load, as opposed to failing
+SHED_STATUSES = ("429", "503")
+
+DEFAULT_MIX = {"get_quest_data": 6, "save_quest_data": 3, "login": 1}
+DEFAULT_COMPLETED = 500
+DEFAULT_QUESTS = 50
+
+# Metrics a threshold may refer to, per scenario or for "total"
+THRESHOLD_METRICS = ("p50_ms", "p95_ms", "p99_ms", "max_ms", "mean_ms", "error_rate", "rps", "requests")
+_THRESHOLD = re.compile(r"^\s*(\w+)\.(\w+)\s*(<=|>=)\s*([0-9.]+)\s*$")
+
+
+class Threshold(NamedTuple):
+    scenario: str
+    metric: str
+    operator: str
+    limit: float
+
+    def __str__(self) -> str:
+        return f"{self.scenario}.{self.metric}{self.operator}{self.limit:g}"
+
+
+def parse_threshold(value: str) -> Threshold:
+    match = _THRESHOLD.match(value)
+    if not match or match.group(2) not in THRESHOLD_METRICS:
+        raise argparse.ArgumentTypeError(
+            f"Expected <scenario|total>.<{'|'.join(THRESHOLD_METRICS)}><=|>=<number>, got {value!r}"
+        )
+    return Threshold(match.group(1), match.group(2), match.group(3), float(match.group(4)))
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario {name!r}; known: {', '.join(SCENARIOS)}")
+        try:
+            mix[name] = int(weight or "1")
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Weight of {name!r} must be an integer")
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("At least one scenario needs a positive weight")
+    return mix
+
+
+def completed_quest(rng: random.Random, index: int, when: datetime) -> Dict[str, Any]:
+    rank = rng.choice(RANKS)
+    return {
+        "id": f"c{index}-{uuid.uuid4().hex[:8]}",
+        "name": f"Finished quest {index}",
+        "rank": rank,
+        "xpEarned": RANK_XP[rank],
+        "dateCompleted": when.isoformat() + "Z",
+        "reward": "Movie Night",
+        "description": "Wrapped up with notes on what went well and what to try next time.",
+        "isImportant": rng.random() < 0.2,
+        "progressStatus": "completed",
+    }
+
+
+def make_quest_data(rng: random.Random, completed: int, quests: int) -> Dict[str, Any]:
+    """A full client state with ``completed`` history entries and ``quests`` open quests."""
+    start = datetime(2024, 1, 1)
+    history = [
+        completed_quest(rng, index, start + timedelta(hours=index * 7))
+        for index in range(completed)
+    ]
+    open_quests = [
+        {
+            "id": f"q{index}",
+            "name": f"Open quest {index}",
+            "rank": rng.choice(RANKS),
+            "dueDate": (start + timedelta(days=400 + index)).date().isoformat(),
+            "reward": "Ice Cream",
+            "description": "Deep clean all rooms including bathroom and kitchen.",
+            "xpReward": 25,
+            "dateAdded": start.date().isoformat(),
+            "isImportant": False,
+            "attachments": [],
+            "progressStatus": "not_started",
+        }
+        for index in range(quests)
+    ]
+    total_earned = sum(quest["xpEarned"] for quest in history)
+    return {
+        "xp": {
+            "currentXP": total_earned,
+            "totalEarned": total_earned,
+            "totalSpent": 0,
+            "completedQuests": completed,
+            "lastMonthlyBonus": "2024-12-01T00:00:00Z",
+        },
+        "quests": open_quests,
+        "completedQuests": history,
+        "rewards": [
+            {"id": str(index), "name": f"Reward {index}", "cost": 25 * index, "icon": "🎮",
+             "description": "A treat", "isCustom": False, "category": "Treats"}
+            for index in range(1, 9)
+        ],
+        "inventory": [],
+        "claimedRewards": [],
+        "settings": {"xpSystem": "default"},
+        "recurringTasks": [
+            {"id": "1", "name": "Daily Exercise", "rank": "Common", "frequency": "Daily",
+             "days": ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"], "status": "Active",
+             "lastAdded": "2025-01-13", "xpReward": 25, "isImportant": False,
+             "startBeforeDue": 0, "customFrequency": None, "yearlyDate": None},
+        ],
+        "achievements": [],
+        "notifications": [],
+    }
+
+
+class VirtualUser:
+    def __init__(self, rng: random.Random, completed: int, quests: int):
+        suffix = uuid.uuid4().hex[:12]
+        self.email = f"load-{suffix}@example.com"
+        self.username = f"load{suffix}"
+        self.rng = rng
+        self.token: Optional[str] = None
+        self.quest_data = make_quest_data(rng, completed, quests)
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+class Recorder:
+    """Latencies and outcomes per scenario."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.recording = False
+
+    async def timed(self, scenario: str, request: Awaitable[httpx.Response]) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError as e:
+            outcome, response = type(e).__name__, None
+        else:
+            outcome = None if response.is_success else str(response.status_code)
+        if self.recording:
+            self.latencies.setdefault(scenario, []).append(time.perf_counter() - started)
+            if outcome is not None:
+                errors = self.errors.setdefault(scenario, {})
+                errors[outcome] = errors.get(outcome, 0) + 1
+        return response if outcome is None else None
+
+
+async def register(client: httpx.AsyncClient, user: VirtualUser, recorder: Recorder) -> None:
+    fresh = VirtualUser(user.rng, 0, 0)
+    await recorder.timed("register", client.post("/api/register", json={
+        "email": fresh.email, "username": fresh.username, "password": PASSWORD,
+    }))
+
+
+async def login(client: httpx.AsyncClient, user: VirtualUser, recorder: Recorder) -> None:
+    response = await recorder.timed("login", client.post("/api/login", json={
+        "email_or_username": user.email, "password": PASSWORD,
+    }))
+    if response is not None:
+        user.token = response.json()["access_token"]
+
+
+async def get_quest_data(client: httpx.AsyncClient, user: VirtualUser, recorder: Recorder) -> None:
+    await recorder.timed("get_quest_data", client.get("/api/quest-data", headers=user.headers))
+
+
+async def save_quest_data(client: httpx.AsyncClient, user: VirtualUser, recorder: Recorder) -> None:
+    history = user.quest_data["completedQuests"]
+    history.append(completed_quest(user.rng, len(history), datetime.utcnow()))
+    await recorder.timed("save_quest_data", client.post(
+        "/api/quest-data", headers=user.headers, json={"quest_data": user.quest_data},
+    ))
+
+
+SCENARIOS: Dict[str, Callable[[httpx.AsyncClient, VirtualUser, Recorder], Awaitable[None]]] = {
+    "register": register,
+    "login": login,
+    "get_quest_data": get_quest_data,
+    "save_quest_data": save_quest_data,
+}
+
+
+def _percentile(ordered: List[float], percent: float) -> float:
+    # Nearest rank
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies: List[float], errors: Dict[str, int], elapsed: float) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    count = len(ordered)
+    shed = sum(errors.get(kind, 0) for kind in SHED_STATUSES)
+    failed = sum(errors.values()) - shed
+    summary: Dict[str, Any] = {
+        "requests": count,
+        "errors": failed,
+        "error_rate": round(failed / count, 4) if count else 0.0,
+        "shed": shed,
+        "shed_rate": round(shed / count, 4) if count else 0.0,
+        "rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "errors_by_kind": dict(errors),
+    }
+    for name, value in (
+        ("p50_ms", _percentile(ordered, 50) if count else 0.0),
+        ("p95_ms", _percentile(ordered, 95) if count else 0.0),
+        ("p99_ms", _percentile(ordered, 99) if count else 0.0),
+        ("max_ms", ordered[-1] if count else 0.0),
+        ("mean_ms", sum(ordered) / count if count else 0.0),
+    ):
+        summary[name] = round(value * 1000, 2)
+    return summary
+
+
+def check_thresholds(result: Dict[str, Any], thresholds: List[Threshold]) -> List[str]:
+    """Descriptions of the violated thresholds."""
+    violations = []
+    for threshold in thresholds:
+        stats = result["total"] if threshold.scenario == "total" else result["scenarios"].get(threshold.scenario)
+        if stats is None:
+            violations.append(f"{threshold}: scenario did not run")
+            continue
+        value = stats[threshold.metric]
+        ok = value <= threshold.limit if threshold.operator == "<=" else value >= threshold.limit
+        if not ok:
+            violations.append(f"{threshold}: got {value:g}")
+    return violations
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    concurrency: int = 10,
+    duration: float = 30.0,
+    mix: Optional[Dict[str, int]] = None,
+    completed: int = DEFAULT_COMPLETED,
+    quests: int = DEFAULT_QUESTS,
+    warmup: float = 0.0,
+    thresholds: Optional[List[Threshold]] = None,
+    seed: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Run the scenario ``mix`` from ``concurrency`` users; returns the result document."""
+    mix = mix or DEFAULT_MIX
+    names = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in names]
+    rng = random.Random(seed)
+    recorder = Recorder()
+
+    # Setup is not measured: every virtual user registers and saves its blob once
+    setup_started = time.perf_counter()
+    users = [VirtualUser(random.Random(rng.random()), completed, quests) for _ in range(concurrency)]
+
+    async def set_up(user: VirtualUser) -> None:
+        while True:
+            response = await client.post("/api/register", json={
+                "email": user.email, "username": user.username, "password": PASSWORD,
+            })
+            if str(response.status_code) not in SHED_STATUSES:
+                break
+            await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+        response.raise_for_status()
+        user.token = response.json()["access_token"]
+        response = await client.post("/api/quest-data", headers=user.headers, json={"quest_data": user.quest_data})
+        response.raise_for_status()
+
+    await asyncio.gather(*(set_up(user) for user in users))
+    setup_seconds = time.perf_counter() - setup_started
+
+    deadline = time.perf_counter() + warmup + duration
+    measured_from = time.perf_counter() + warmup
+
+    async def virtual_user(user: VirtualUser) -> None:
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                return
+            recorder.recording = now >= measured_from
+            await SCENARIOS[user.rng.choices(names, weights)[0]](client, user, recorder)
+
+    measure_started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(user) for user in users))
+    elapsed = time.perf_counter() - max(measured_from, measure_started)
+
+    scenarios = {
+        name: summarize(recorder.latencies.get(name, []), recorder.errors.get(name, {}), elapsed)
+        for name in names
+    }
+    all_errors: Dict[str, int] = {}
+    for errors in recorder.errors.values():
+        for kind, count in errors.items():
+            all_errors[kind] = all_errors.get(kind, 0) + count
+    result = {
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "config": {
+            "concurrency": concurrency,
+            "duration_seconds": duration,
+            "warmup_seconds": warmup,
+            "mix": mix,
+            "completed_quests": completed,
+            "open_quests": quests,
+            "blob_bytes": len(json.dumps({"quest_data": users[0].quest_data})) if users else 0,
+        },
+        "setup_seconds": round(setup_seconds, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "scenarios": scenarios,
+        "total": summarize(
+            [latency for latencies in recorder.latencies.values() for latency in latencies],
+            all_errors, elapsed,
+        ),
+    }
+    violations = check_thresholds(result, thresholds or [])
+    result["thresholds"] = {
+        "checked": [str(threshold) for threshold in thresholds or []],
+        "violations": violations,
+        "passed": not violations,
+    }
+    return result
+
+
+def client_limits(concurrency: int) -> httpx.Limits:
+    return httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+
+async def run_against(base_url: str, timeout: float = 30.0, **options: Any) -> Dict[str, Any]:
+    """``run_load`` against a server listening at ``base_url``."""
+    async with httpx.AsyncClient(
+        base_url=base_url, timeout=timeout, limits=client_limits(options.get("concurrency", 10))
+    ) as client:
+        return await run_load(client, **options)
+
+
+async def run_in_process(timeout: float = 30.0, **options: Any) -> Dict[str, Any]:
+    """``run_load`` against the app in this process, without a network hop."""
+    import server
+
+    await server.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=timeout) as client:
+            return await run_load(client, **options)
+    finally:
+        await server.app.router.shutdown()
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    lines = [
+        f"{'scenario':<18}{'requests':>10}{'rps':>9}{'err%':>8}{'shed%':>8}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    ]
+    for name, stats in list(result["scenarios"].items()) + [("total", result["total"])]:
+        lines.append(
+            f"{name:<18}{stats['requests']:>10}{stats['rps']:>9}{stats['error_rate'] * 100:>8.2f}"
+            f"{stats['shed_rate'] * 100:>8.2f}"
+            f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}"
+        )
+    for violation in result["thresholds"]["violations"]:
+        lines.append(f"THRESHOLD VIOLATED {violation}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / ".env")
+
+    parser = argparse.ArgumentParser(description="Concurrent load test of the API")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--base-url", help="e.g. http://localhost:8001")
+    target.add_argument("--in-process", action="store_true", help="Drive the app in this process")
+    parser.add_argument("--concurrency", type=int, default=10, help="Virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=0.0, help="Unmeasured seconds before that")
+    parser.add_argument(
+        "--mix", type=parse_mix, default=DEFAULT_MIX,
+        help="Weighted scenarios, e.g. get_quest_data=6,save_quest_data=3,login=1,register=0",
+    )
+    parser.add_argument("--completed", type=int, default=DEFAULT_COMPLETED, help="Completed quests per blob")
+    parser.add_argument("--quests", type=int, default=DEFAULT_QUESTS, help="Open quests per blob")
+    parser.add_argument("--threshold", type=parse_threshold, action="append", default=[])
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    options = dict(
+        concurrency=args.concurrency, duration=args.duration, mix=args.mix,
+        completed=args.completed, quests=args.quests, warmup=args.warmup,
+        thresholds=args.threshold, seed=args.seed,
+    )
+    result = asyncio.run(
+        run_in_process(**options) if args.in_process else run_against(args.base_url, **options)
+    )
+    print(format_result(result))
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+    sys.exit(0 if result["thresholds"]["passed"] else 1)
@@ -0,0 +1,242 @@
+"""In-process metrics, exposed in the Prometheus text format.
+
+Histograms are sharded per thread: a thread only ever updates
+its own shard, a preallocated list, so recording takes no lock and
+allocates nothing once a series exists. Mongo command events arrive on
+Motor's worker threads and everything else on the event loop. A scrape
+sums the shards, so a series may be read mid-update and be off by the
+observation in flight, as with any lock-free exporter.
+
+Stats that components already keep (cache hit counts, the hash pool, the
+write buffer, compression) are not duplicated; collectors registered with
+``register_collector`` read them at scrape time.
+"""
+import time
+from bisect import bisect_left
+from threading import get_ident
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+# Upper bounds of histogram buckets; +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0, 5.0)
+# 256 bytes to 16 MB in powers of 4
+SIZE_BUCKETS = tuple(float(256 * 4 ** i) for i in range(9))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# A metric family: name, type, help text and (name suffix, labels, value) samples
+Sample = Tuple[str, Dict[str, str], float]
+Family = Tuple[str, str, str, List[Sample]]
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+class Histogram:
+    """Cumulative histogram with a fixed set of label names."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> thread id -> [count per bucket..., count over the last bucket, sum]
+        self._series: Dict[Tuple[str, ...], Dict[int, List[float]]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        shards = self._series.get(labels)
+        if shards is None:
+            shards = self._series.setdefault(labels, {})
+        shard = shards.get(get_ident())
+        if shard is None:
+            shard = shards.setdefault(get_ident(), [0] * (len(self.buckets) + 1) + [0.0])
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def collect(self) -> Iterable[Family]:
+        samples = []
+        for values, shards in list(self._series.items()):
+            labels = dict(zip(self.labels, values))
+            totals = [sum(column) for column in zip(*list(shards.values()))]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), totals):
+                cumulative += count
+                samples.append(("_bucket", {**labels, "le": _format_value(float(bound))}, cumulative))
+            samples.append(("_sum", labels, totals[-1]))
+            samples.append(("_count", labels, cumulative))
+        yield self.name, self.kind, self.help, samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Any] = []
+        self.collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        families = [family for metric in self.metrics for family in metric.collect()]
+        families += [family for collector in self.collectors for family in collector()]
+        for name, kind, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+register_collector = registry.register_collector
+
+REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to serve a request, until the last body byte was sent",
+    ("method", "route", "status"), LATENCY_BUCKETS,
+))
+REQUEST_BYTES = registry.register(Histogram(
+    "http_request_size_bytes", "Request body size as received", ("method", "route"), SIZE_BUCKETS,
+))
+RESPONSE_BYTES = registry.register(Histogram(
+    "http_response_size_bytes", "Response body size as sent, after compression",
+    ("method", "route"), SIZE_BUCKETS,
+))
+MONGO_SECONDS = registry.register(Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round trips by collection",
+    ("collection", "command", "outcome"), MONGO_BUCKETS,
+))
+HASH_SECONDS = registry.register(Histogram(
+    "password_hash_duration_seconds", "bcrypt hash and verify time, excluding the queue wait",
+    ("operation",), HASH_BUCKETS,
+))
+HASH_QUEUE_SECONDS = registry.register(Histogram(
+    "password_hash_queue_seconds", "Time hash operations waited for a pool worker",
+    ("operation",), HASH_BUCKETS,
+))
+
+
+class _InFlight:
+    # Only touched from the event loop
+    value = 0
+
+    def collect(self) -> Iterable[Family]:
+        yield "http_requests_in_flight", "gauge", "Requests being served", [("", {}, self.value)]
+
+
+IN_FLIGHT = registry.register(_InFlight())
+
+
+def observe_hash(operation: str, queued: float, elapsed: float) -> None:
+    HASH_SECONDS.observe((operation,), elapsed)
+    HASH_QUEUE_SECONDS.observe((operation,), queued)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request and counting body bytes.
+
+    Requests are labelled by route template, never by raw path, so the
+    number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        # request bytes, response bytes, status
+        state = [0, 0, 500]
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state[0] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                state[2] = message["status"]
+            elif message["type"] == "http.response.body":
+                state[1] += len(message.get("body", b""))
+            await send(message)
+
+        IN_FLIGHT.value += 1
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            IN_FLIGHT.value -= 1
+            # Set by FastAPI once a route matched
+            route = scope.get("route")
+            labels = (scope["method"], getattr(route, "path", UNMATCHED_ROUTE))
+            REQUEST_SECONDS.observe(labels + (str(state[2]),), time.perf_counter() - started)
+            REQUEST_BYTES.observe(labels, state[0])
+            RESPONSE_BYTES.observe(labels, state[1])
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times MongoDB commands per collection from pymongo command monitoring."""
+
+    def __init__(self):
+        # request id -> collection, between a command's start and its outcome
+        self._collections: Dict[int, str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        command = event.command
+        target = command.get("collection") if event.command_name == "getMore" else command.get(event.command_name)
+        self._collections[event.request_id] = target if isinstance(target, str) else ""
+
+    def _observe(self, event, outcome: str) -> None:
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_SECONDS.observe((collection, event.command_name, outcome), event.duration_micros / 1e6)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._observe(event, "success")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._observe(event, "failure")
+
+
+def cache_families(caches: Dict[str, Any]) -> Iterable[Family]:
+    """Families for ``TTLCache`` instances, keyed by cache name."""
+    for stat in ("hits", "misses", "evictions", "expirations", "invalidations"):
+        yield (
+            f"cache_{stat}_total", "counter", f"Cache {stat}",
+            [("", {"cache": name}, cache.stats[stat]) for name, cache in caches.items()],
+        )
+    yield (
+        "cache_hit_ratio", "gauge", "Hits over lookups since start",
+        [("", {"cache": name}, cache.hit_ratio()) for name, cache in caches.items()],
+    )
+    yield (
+        "cache_entries", "gauge", "Entries currently cached",
+        [("", {"cache": name}, len(cache)) for name, cache in caches.items()],
+    )
+
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, EmailStr, validator
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 from datetime import datetime
 import uuid
 import re
@@ -77,11 +77,20 @@ class UserUpdate(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None  # access token lifetime in seconds
     user: UserResponse
 
 
-class TokenData(BaseModel):
-    user_id: Optional[str] = None
+class TokenRefresh(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    refresh_token: str
+    expires_in: int
+
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
 
 # Quest-related models that will be user-specific
@@ -89,6 +98,7 @@ class QuestData(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
     quest_data: Dict[str, Any]  # Store the entire quest context state
+    version: int = 1  # Incremented on every write, exposed as the ETag
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -98,4 +108,25 @@ class QuestDataCreate(BaseModel):
 
 
 class QuestDataUpdate(BaseModel):
-    quest_data: Dict[str, Any]
\ No newline at end of file
+    quest_data: Dict[str, Any]
+
+
+# A single RFC 6902 JSON Patch operation against the quest data blob
+class QuestDataPatchOperation(BaseModel):
+    op: Literal["add", "remove", "replace", "move", "copy", "test"]
+    path: str
+    value: Any = None
+    from_: Optional[str] = Field(None, alias="from")
+
+
+# One reducer action of the client's quest state, as appended to the event log
+class QuestEvent(BaseModel):
+    seq: int
+    type: str
+    payload: Any = None
+    at: Optional[str] = None  # when the action happened; defaults to receipt
+    key: Optional[str] = None  # id of the entity the action creates, if the client chose one
+
+
+class QuestEventBatch(BaseModel):
+    events: List[QuestEvent]
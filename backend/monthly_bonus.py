@@ -0,0 +1,273 @@
+"""Batch job applying the monthly XP bonus to every user.
+
+Run ``python monthly_bonus.py [--month YYYY-MM]``. Quest data is streamed in
+``user_id`` order in batches; each user's bonus is ``monthlyBonusXP`` for
+their level in their XP system, as in the client's APPLY_MONTHLY_BONUS.
+Bonuses are applied with unordered ``bulk_write`` calls whose filters skip
+anyone already credited for the month, so re-running the job never pays
+twice. Progress is checkpointed after every batch in ``job_checkpoints``,
+and a crashed run resumes after the last finished batch. Months are
+calendar months in UTC.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from quest_store import QuestStore
+from xp_systems import batch_levels, get_xp_system
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+_PROJECTION = {
+    "_id": 0,
+    "user_id": 1,
+    "quest_data.xp": 1,
+    "quest_data.settings": 1,
+    "quest_data_codec": 1,
+}
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+
+def already_credited(xp: Dict[str, Any], month: str) -> bool:
+    """Whether the user got a bonus in ``month`` (YYYY-MM) or later."""
+    last = xp.get("lastMonthlyBonus")
+    return isinstance(last, str) and last >= month
+
+
+def compute_bonuses(users: List[Dict[str, Any]]) -> List[int]:
+    """Monthly bonus per user, computed a whole XP system at a time."""
+    bonuses = [0] * len(users)
+    by_system: Dict[str, List[int]] = {}
+    for index, user in enumerate(users):
+        by_system.setdefault(get_xp_system(user["xp_system"]).id, []).append(index)
+    for system_id, indexes in by_system.items():
+        levels = batch_levels([users[i]["total_earned"] for i in indexes], get_xp_system(system_id))
+        for i, bonus in zip(indexes, levels["monthly_bonus_xp"].tolist()):
+            bonuses[i] = bonus
+    return bonuses
+
+
+def _bonus_update(bonus: int, now: datetime) -> Dict[str, Any]:
+    return {
+        "$inc": {
+            "quest_data.xp.currentXP": bonus,
+            "quest_data.xp.totalEarned": bonus,
+            "version": 1,
+        },
+        "$set": {
+            "quest_data.xp.lastMonthlyBonus": now.isoformat() + "Z",
+            "updated_at": datetime.utcnow(),
+        },
+    }
+
+
+class MonthlyBonusJob:
+    """One resumable run of the monthly bonus for a given month."""
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        store: QuestStore,
+        month: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ):
+        self.db = db
+        self.store = store
+        if not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", month):
+            raise ValueError(f"Month must be YYYY-MM, got {month!r}")
+        self.month = month
+        self.batch_size = batch_size
+        self.checkpoint_id = f"monthly_bonus:{month}"
+        self.stats = {"scanned": 0, "credited": 0, "skipped": 0, "failed": 0}
+        self.last_user_id: Optional[str] = None
+        self._saved: Dict[str, int] = {}
+
+    async def _load_checkpoint(self) -> Optional[Dict[str, Any]]:
+        return await self.db.job_checkpoints.find_one({"_id": self.checkpoint_id})
+
+    async def _save_checkpoint(self, last_user_id: Optional[str], finished: bool = False) -> None:
+        update: Dict[str, Any] = {"last_user_id": last_user_id, "updated_at": datetime.utcnow()}
+        if finished:
+            update["finished_at"] = datetime.utcnow()
+        await self.db.job_checkpoints.update_one(
+            {"_id": self.checkpoint_id},
+            {"$set": update, "$inc": {f"stats.{key}": value for key, value in self._delta().items()}},
+            upsert=True,
+        )
+
+    def _delta(self) -> Dict[str, int]:
+        delta = {key: self.stats[key] - self._saved.get(key, 0) for key in self.stats}
+        self._saved = dict(self.stats)
+        return delta
+
+    async def _apply_compressed(self, user_id: str, now: datetime) -> bool:
+        # A compressed blob cannot be updated in place: rewrite it whole
+        for _ in range(3):
+            loaded = await self.store.read(user_id)
+            if loaded is None:
+                return False
+            quest_data, version = loaded
+            xp = quest_data.get("xp")
+            total_earned = _number(xp.get("totalEarned")) if isinstance(xp, dict) else None
+            if total_earned is None or already_credited(xp, self.month):
+                return False
+            settings = quest_data.get("settings")
+            bonus = compute_bonuses([{
+                "total_earned": total_earned,
+                "xp_system": settings.get("xpSystem") if isinstance(settings, dict) else None,
+            }])[0]
+            if bonus <= 0:
+                return False
+            quest_data["xp"] = {
+                **xp,
+                "currentXP": (_number(xp.get("currentXP")) or 0) + bonus,
+                "totalEarned": total_earned + bonus,
+                "lastMonthlyBonus": now.isoformat() + "Z",
+            }
+            if await self.store.write(user_id, quest_data, version) is not None:
+                return True
+        return False
+
+    def _credited_at(self) -> datetime:
+        # Backfilling a past month must not also count as this month's bonus
+        now = datetime.utcnow()
+        if now.strftime("%Y-%m") == self.month:
+            return now
+        return datetime.strptime(self.month, "%Y-%m")
+
+    async def _apply_batch(self, batch: List[Dict[str, Any]]) -> None:
+        now = self._credited_at()
+        eligible = []
+        for root in batch:
+            if "quest_data_codec" in root:
+                if await self._apply_compressed(root["user_id"], now):
+                    self.stats["credited"] += 1
+                else:
+                    self.stats["skipped"] += 1
+                continue
+            xp = (root.get("quest_data") or {}).get("xp")
+            total_earned = _number(xp.get("totalEarned")) if isinstance(xp, dict) else None
+            if total_earned is None or already_credited(xp, self.month):
+                self.stats["skipped"] += 1
+                continue
+            settings = (root.get("quest_data") or {}).get("settings")
+            eligible.append({
+                "user_id": root["user_id"],
+                "total_earned": total_earned,
+                "xp_system": settings.get("xpSystem") if isinstance(settings, dict) else None,
+            })
+
+        operations = []
+        for user, bonus in zip(eligible, compute_bonuses(eligible)):
+            if bonus <= 0:
+                self.stats["skipped"] += 1
+                continue
+            operations.append(UpdateOne(
+                {
+                    "user_id": user["user_id"],
+                    "quest_data_z": {"$exists": False},
+                    # Idempotence: never credit the same month twice
+                    "quest_data.xp.lastMonthlyBonus": {"$not": {"$gte": self.month}},
+                },
+                _bonus_update(bonus, now),
+            ))
+        if not operations:
+            return
+
+        failed = 0
+        try:
+            result = await self.db.quest_data.bulk_write(operations, ordered=False)
+            modified = result.modified_count
+        except BulkWriteError as e:
+            # e.g. a non-numeric currentXP; the rest of the batch still applies
+            modified = e.details.get("nModified", 0)
+            failed = len(e.details.get("writeErrors", []))
+            logger.warning("Monthly bonus batch had %d failed update(s)", failed)
+        self.stats["credited"] += modified
+        self.stats["failed"] += failed
+        # Unmatched filters: credited concurrently since the batch was read
+        self.stats["skipped"] += len(operations) - modified - failed
+
+    async def run(self) -> Dict[str, int]:
+        checkpoint = await self._load_checkpoint()
+        if checkpoint is not None and checkpoint.get("finished_at") is not None:
+            logger.info("Monthly bonus for %s already finished", self.month)
+            return dict(checkpoint.get("stats", {}))
+        last_user_id = checkpoint.get("last_user_id") if checkpoint else None
+        if last_user_id is not None:
+            logger.info("Resuming monthly bonus for %s after user %s", self.month, last_user_id)
+
+        started = time.perf_counter()
+        query = {"user_id": {"$gt": last_user_id}} if last_user_id is not None else {}
+        cursor = self.db.quest_data.find(query, _PROJECTION).sort("user_id", ASCENDING).batch_size(self.batch_size)
+        batch: List[Dict[str, Any]] = []
+
+        async def flush() -> None:
+            await self._apply_batch(batch)
+            self.stats["scanned"] += len(batch)
+            self.last_user_id = batch[-1]["user_id"]
+            await self._save_checkpoint(self.last_user_id)
+            elapsed = time.perf_counter() - started
+            logger.info(
+                "Monthly bonus %s: %d users scanned, %d credited, %.0f users/s",
+                self.month, self.stats["scanned"], self.stats["credited"],
+                self.stats["scanned"] / elapsed if elapsed else 0.0,
+            )
+            batch.clear()
+
+        async for root in cursor:
+            batch.append(root)
+            if len(batch) >= self.batch_size:
+                await flush()
+        if batch:
+            await flush()
+        await self._save_checkpoint(self.last_user_id or last_user_id, finished=True)
+
+        elapsed = time.perf_counter() - started
+        self.stats["users_per_second"] = round(self.stats["scanned"] / elapsed, 1) if elapsed else 0.0
+        return self.stats
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / ".env")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Apply the monthly XP bonus to all users")
+    parser.add_argument("--month", default=datetime.utcnow().strftime("%Y-%m"), help="YYYY-MM, default current")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    async def main() -> None:
+        client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        db = client[os.environ["DB_NAME"]]
+        store = QuestStore(
+            db,
+            os.getenv("QUEST_DATA_STORAGE", "document"),
+            compression=os.getenv("QUEST_DATA_COMPRESSION") or None,
+        )
+        stats = await MonthlyBonusJob(db, store, args.month, args.batch_size).run()
+        print(f"Monthly bonus {args.month}: {stats}")
+        client.close()
+
+    asyncio.run(main())
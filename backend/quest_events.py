@@ -0,0 +1,574 @@
+"""Event-sourced quest data: reducer actions appended to a per-user log.
+
+Clients send the actions QuestContext's reducer dispatches (ADD_QUEST,
+COMPLETE_QUEST, CLAIM_REWARD, ...) in ordered batches, numbered by a
+per-user sequence starting at 1. Each action is one small document in
+``quest_events``. Every ``QUEST_EVENT_SNAPSHOT_EVERY`` events the log is
+compacted: the actions since the last snapshot are applied to the stored
+quest data, which is written back through the ``QuestStore``, so the
+snapshot is what every other endpoint reads. ``quest_event_heads`` records
+the sequence number and quest data version of each user's snapshot, and
+the lease of a compaction under way, which keeps workers from compacting
+the same user at once. Reads return the snapshot plus the tail
+of the log after it. Events are kept after compaction, as history.
+
+The client's reducer takes ids and dates from the clock, so replaying it
+would not rebuild the same state. Appending resolves every action once:
+it is stamped with ``at`` and, if it creates an entity, with the entity's
+``key``. Replay only uses those values. Actions are also applied
+idempotently: an entity whose key exists is not created again (a claimed
+reward is recognised by the inventory key it records), and completing a
+quest that is no longer open does nothing. Replaying a tail over a
+snapshot that already contains part of it, as after a crash between
+writing the snapshot and recording its sequence, gives the same result.
+
+That only holds for state this log built. A full-state save through
+/api/quest-data carries the ids the client's reducer generated, which no
+event's key matches unless the client sent its id as the key. Replaying
+the tail over such a save applies creating actions, and the XP of
+claims, a second time, so a client should not mix the two for the same
+actions.
+
+Achievement progress and notifications are derived client state that the
+reducer leaves alone. Achievements unlock server-side when a snapshot is
+written, as for any other save. RESET_ALL is not accepted, because it
+restores the client's bundled sample data.
+"""
+import asyncio
+import copy
+import os
+import weakref
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from monthly_bonus import already_credited
+from quest_store import QuestStore
+from xp_systems import get_current_level, get_xp_system, monthly_bonus_xp
+
+SNAPSHOT_EVERY = int(os.getenv("QUEST_EVENT_SNAPSHOT_EVERY", "100"))
+MAX_BATCH_EVENTS = 500
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+
+# Concurrent full-state saves make a snapshot write lose its version check;
+# the tail is replayed over the new state this many times before giving up.
+# Reads racing a compaction are retried as often, READ_RETRY_SECONDS apart.
+SNAPSHOT_ATTEMPTS = 3
+READ_RETRY_SECONDS = 0.05
+# A compaction holds a lease on the user's head for at most this long, so one
+# that died midway stops blocking others once the lease runs out
+COMPACTION_LEASE_SECONDS = 30
+
+# The non-custom entries of mockRewards in frontend/src/data/mock.js, which
+# RESET_EVERYTHING restores
+DEFAULT_REWARDS: List[Dict[str, Any]] = [
+    {
+        "id": "1", "name": "🎮 Gaming Session", "cost": 50, "description": "Enjoy 1 hour of your favorite game",
+        "isCustom": False, "icon": "🎮", "category": "Entertainment",
+    },
+    {
+        "id": "2", "name": "💰 Spending Money", "cost": 25, "description": "Small treat or coffee money",
+        "isCustom": False, "icon": "💰", "category": "Treats",
+    },
+    {
+        "id": "3", "name": "🍿 Movie Night", "cost": 75, "description": "Watch a movie with snacks",
+        "isCustom": False, "icon": "🍿", "category": "Entertainment",
+    },
+    {
+        "id": "4", "name": "📱 Social Media Time", "cost": 30, "description": "30 minutes of guilt-free scrolling",
+        "isCustom": False, "icon": "📱", "category": "Digital",
+    },
+]
+
+_EVENT_PROJECTION = {"_id": 0, "seq": 1, "type": 1, "payload": 1, "key": 1, "at": 1}
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+class SequenceConflict(Exception):
+    """A batch does not continue the user's log from its current head."""
+
+    def __init__(self, message: str, head_seq: int):
+        super().__init__(message)
+        self.head_seq = head_seq
+
+
+class SnapshotBusy(Exception):
+    """The snapshot kept changing while it was read."""
+
+
+class Snapshot(NamedTuple):
+    seq: int  # last event applied
+    version: int  # quest data version written
+    quest_data: Dict[str, Any]
+
+
+class AppendResult(NamedTuple):
+    head_seq: int
+    events: List[Dict[str, Any]]  # the batch as stored, with keys and timestamps
+    snapshot: Optional[Snapshot]  # written by this append, if any
+
+
+def iso_timestamp(value: datetime) -> str:
+    """``value`` (naive UTC) formatted like JavaScript's ``toISOString``."""
+    return value.strftime("%Y-%m-%dT%H:%M:%S.") + f"{value.microsecond // 1000:03d}Z"
+
+
+def _number(value: Any) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return 0
+
+
+def _section(state: Dict[str, Any], key: str) -> List[Any]:
+    items = state.get(key)
+    if not isinstance(items, list):
+        items = state[key] = []
+    return items
+
+
+def _object(state: Dict[str, Any], key: str) -> Dict[str, Any]:
+    value = state.get(key)
+    if not isinstance(value, dict):
+        value = state[key] = {}
+    return value
+
+
+def _find(items: List[Any], item_id: Any) -> Optional[Dict[str, Any]]:
+    for item in items:
+        if isinstance(item, dict) and item.get("id") == item_id:
+            return item
+    return None
+
+
+def _without(items: List[Any], item_id: Any) -> List[Any]:
+    return [item for item in items if not (isinstance(item, dict) and item.get("id") == item_id)]
+
+
+def _update(state: Dict[str, Any], section: str, changes: Dict[str, Any]) -> None:
+    item = _find(_section(state, section), changes["id"])
+    if item is not None:
+        item.update(changes)
+
+
+# Reducers: (state, payload, key, at) -> None, updating ``state`` in place
+
+def _add_quest(state, payload, key, at):
+    if _find(_section(state, "quests"), key) or _find(_section(state, "completedQuests"), key):
+        return
+    state["quests"].append(
+        {**payload, "id": key, "progressStatus": payload.get("progressStatus") or "not_started"}
+    )
+
+
+def _update_quest_progress(state, payload, key, at):
+    _update(state, "quests", {"id": payload["id"], "progressStatus": payload.get("progressStatus")})
+
+
+def _complete_quest(state, payload, key, at):
+    quest = _find(_section(state, "quests"), payload)
+    if quest is None:
+        return
+    reward = _number(quest.get("xpReward"))
+    state["quests"] = _without(state["quests"], payload)
+    _section(state, "completedQuests").append({**quest, "dateCompleted": at, "xpEarned": quest.get("xpReward")})
+    xp = _object(state, "xp")
+    xp["currentXP"] = _number(xp.get("currentXP")) + reward
+    xp["totalEarned"] = _number(xp.get("totalEarned")) + reward
+    xp["completedQuests"] = _number(xp.get("completedQuests")) + 1
+
+
+def _claim_reward(state, payload, key, at):
+    inventory = _section(state, "inventory")
+    if _find(inventory, key) or any(
+        isinstance(used, dict) and used.get("inventoryId") == key
+        for used in _section(state, "claimedRewards")
+    ):
+        return
+    reward = _find(_section(state, "rewards"), payload)
+    xp = _object(state, "xp")
+    cost = _number(reward.get("cost")) if reward else 0
+    if reward is None or _number(xp.get("currentXP")) < cost:
+        return
+    inventory.append({
+        "id": key,
+        "rewardId": reward.get("id"),
+        "rewardName": reward.get("name"),
+        "dateClaimed": at,
+        "xpCost": reward.get("cost"),
+        "description": reward.get("description"),
+    })
+    xp["currentXP"] = _number(xp.get("currentXP")) - cost
+    xp["totalSpent"] = _number(xp.get("totalSpent")) + cost
+
+
+def _use_inventory_item(state, payload, key, at):
+    item = _find(_section(state, "inventory"), payload)
+    if item is None:
+        return
+    state["inventory"] = _without(state["inventory"], payload)
+    _section(state, "claimedRewards").append({
+        "id": key,
+        "inventoryId": item.get("id"),
+        "rewardName": item.get("rewardName"),
+        "xpCost": item.get("xpCost"),
+        "dateClaimed": item.get("dateClaimed"),
+        "dateUsed": at,
+    })
+
+
+def _add_reward(state, payload, key, at):
+    rewards = _section(state, "rewards")
+    if not _find(rewards, key):
+        rewards.append({**payload, "id": key, "isCustom": True})
+
+
+def _add_recurring_task(state, payload, key, at):
+    tasks = _section(state, "recurringTasks")
+    if not _find(tasks, key):
+        tasks.append({
+            **payload,
+            "id": key,
+            "startBeforeDue": payload.get("startBeforeDue") or 0,
+            "customFrequency": payload.get("customFrequency") or None,
+            "yearlyDate": payload.get("yearlyDate") or None,
+        })
+
+
+def _delete(section: str):
+    def reduce(state, payload, key, at):
+        state[section] = _without(_section(state, section), payload)
+    return reduce
+
+
+def _change_xp_system(state, payload, key, at):
+    ceiling = get_xp_system(payload).reward_range["max"]
+    for reward in _section(state, "rewards"):
+        if isinstance(reward, dict) and "cost" in reward:
+            reward["cost"] = min(_number(reward["cost"]), ceiling)
+    _object(state, "settings")["xpSystem"] = payload
+
+
+def _apply_monthly_bonus(state, payload, key, at):
+    xp = _object(state, "xp")
+    if already_credited(xp, at[:7]):
+        return
+    system = get_xp_system(_object(state, "settings").get("xpSystem"))
+    level = get_current_level(_number(xp.get("totalEarned")), system)["level"]
+    bonus = monthly_bonus_xp(level, system)
+    if bonus > 0:
+        xp["currentXP"] = _number(xp.get("currentXP")) + bonus
+        xp["totalEarned"] = _number(xp.get("totalEarned")) + bonus
+        xp["lastMonthlyBonus"] = at
+
+
+def _reset_everything(state, payload, key, at):
+    options = payload or {}
+    erase_rewards = options.get("eraseRewards", True)
+    xp_system = "default" if options.get("resetXPSystem", False) else _object(state, "settings").get("xpSystem")
+    rewards = _section(state, "rewards")
+    claimed = _section(state, "claimedRewards")
+    state.clear()
+    state.update({
+        "xp": {"currentXP": 0, "totalEarned": 0, "totalSpent": 0, "completedQuests": 0, "lastMonthlyBonus": None},
+        "quests": [],
+        "completedQuests": [],
+        "rewards": copy.deepcopy(DEFAULT_REWARDS) if erase_rewards else rewards,
+        "inventory": [],
+        "claimedRewards": [] if erase_rewards else claimed,
+        "settings": {
+            "xpSystem": xp_system,
+            "autoCleanup": {
+                "enabled": False,
+                "frequency": "1month",
+                "recurringOnly": False,
+                "keepImportant": True,
+                "includeRewards": False,
+            },
+            "notifications": {"levelUp": True, "questDue": True, "rewardClaimed": True},
+            "calendarView": {"enabled": True, "defaultView": "month"},
+        },
+        "recurringTasks": [],
+        "achievements": [],
+        "notifications": [],
+    })
+
+
+def _load_state(state, payload, key, at):
+    state.clear()
+    state.update(payload)
+
+
+def _dismiss_notification(state, payload, key, at):
+    state["notifications"] = _without(_section(state, "notifications"), payload)
+
+
+# Payload shapes
+OBJECT = "object"
+ENTITY = "entity"  # object with an "id"
+ID = "id"
+ANY = "any"
+
+Reducer = Callable[[Dict[str, Any], Any, Optional[str], str], None]
+
+
+class Action(NamedTuple):
+    payload: str
+    reduce: Reducer
+    # Prefix of generated keys, for actions that create an entity
+    key_prefix: Optional[str] = None
+
+
+ACTIONS: Dict[str, Action] = {
+    "ADD_QUEST": Action(OBJECT, _add_quest, ""),
+    "UPDATE_QUEST": Action(ENTITY, lambda state, payload, key, at: _update(state, "quests", payload)),
+    "UPDATE_QUEST_PROGRESS": Action(ENTITY, _update_quest_progress),
+    "DELETE_QUEST": Action(ID, _delete("quests")),
+    "COMPLETE_QUEST": Action(ID, _complete_quest),
+    "CLAIM_REWARD": Action(ID, _claim_reward, "inv_"),
+    "USE_INVENTORY_ITEM": Action(ID, _use_inventory_item, "claimed_"),
+    "ADD_REWARD": Action(OBJECT, _add_reward, ""),
+    "UPDATE_REWARD": Action(ENTITY, lambda state, payload, key, at: _update(state, "rewards", payload)),
+    "DELETE_REWARD": Action(ID, _delete("rewards")),
+    "ADD_RECURRING_TASK": Action(OBJECT, _add_recurring_task, ""),
+    "UPDATE_RECURRING_TASK": Action(
+        ENTITY, lambda state, payload, key, at: _update(state, "recurringTasks", payload)
+    ),
+    "DELETE_RECURRING_TASK": Action(ID, _delete("recurringTasks")),
+    "UPDATE_SETTINGS": Action(OBJECT, lambda state, payload, key, at: _object(state, "settings").update(payload)),
+    "CHANGE_XP_SYSTEM": Action(ID, _change_xp_system),
+    "APPLY_MONTHLY_BONUS": Action(ANY, _apply_monthly_bonus),
+    "RESET_EVERYTHING": Action(ANY, _reset_everything),
+    "LOAD_STATE": Action(OBJECT, _load_state),
+    "DISMISS_NOTIFICATION": Action(ID, _dismiss_notification),
+}
+
+
+def _check_payload(action_type: str, shape: str, payload: Any) -> None:
+    if shape == OBJECT and not isinstance(payload, dict):
+        raise InvalidEvent(f"{action_type} needs an object payload")
+    if shape == ENTITY and not (isinstance(payload, dict) and "id" in payload):
+        raise InvalidEvent(f"{action_type} needs an object payload with an id")
+    if shape == ID and (not isinstance(payload, (str, int)) or isinstance(payload, bool)):
+        raise InvalidEvent(f"{action_type} needs an id as its payload")
+    if action_type == "RESET_EVERYTHING" and payload is not None and not isinstance(payload, dict):
+        raise InvalidEvent("RESET_EVERYTHING takes an optional object payload")
+
+
+def _parse_at(value: Any, now: datetime) -> datetime:
+    if value is None:
+        return now
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        raise InvalidEvent(f"Invalid event timestamp: {value!r}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def resolve(event: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    """The stored form of a submitted event: validated, timestamped and keyed.
+
+    ``at`` defaults to ``now``; creating actions get ``key`` from the event,
+    or one generated the way the client generates ids.
+    """
+    action = ACTIONS.get(event["type"])
+    if action is None:
+        raise InvalidEvent(f"Unknown or unsupported action: {event['type']!r}")
+    _check_payload(event["type"], action.payload, event.get("payload"))
+    at = _parse_at(event.get("at"), now)
+    resolved = {"seq": event["seq"], "type": event["type"], "payload": event.get("payload"), "at": iso_timestamp(at)}
+    if action.key_prefix is not None:
+        millis = int(at.replace(tzinfo=timezone.utc).timestamp() * 1000)
+        resolved["key"] = event.get("key") or f"{action.key_prefix}{millis}-{event['seq']}"
+    return resolved
+
+
+def apply_events(state: Dict[str, Any], events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Apply stored events to ``state`` in place, in order, and return it."""
+    for event in events:
+        ACTIONS[event["type"]].reduce(state, event.get("payload"), event.get("key"), event["at"])
+    return state
+
+
+def _same_event(stored: Dict[str, Any], submitted: Dict[str, Any]) -> bool:
+    return (
+        stored["type"] == submitted["type"]
+        and stored.get("payload") == submitted.get("payload")
+        and submitted.get("key") in (None, stored.get("key"))
+    )
+
+
+class QuestEventLog:
+    """Appends quest actions per user and compacts them into snapshots."""
+
+    def __init__(self, db: AsyncIOMotorDatabase, store: QuestStore, snapshot_every: int = SNAPSHOT_EVERY):
+        self.events = db.quest_events
+        self.heads = db.quest_event_heads
+        self.store = store
+        self.snapshot_every = snapshot_every
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = (
+            weakref.WeakValueDictionary()
+        )
+
+    async def head_seq(self, user_id: str) -> int:
+        last = await self.events.find_one(
+            {"user_id": user_id}, {"_id": 0, "seq": 1}, sort=[("seq", DESCENDING)]
+        )
+        return last["seq"] if last else 0
+
+    async def snapshot_seq(self, user_id: str) -> int:
+        head = await self.heads.find_one({"user_id": user_id}, {"_id": 0, "snapshot_seq": 1})
+        return head.get("snapshot_seq", 0) if head else 0
+
+    async def read_events(
+        self, user_id: str, after: int, limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Events with a sequence number over ``after``, oldest first."""
+        cursor = self.events.find(
+            {"user_id": user_id, "seq": {"$gt": after}}, _EVENT_PROJECTION
+        ).sort("seq", ASCENDING)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return [event async for event in cursor]
+
+    async def append(self, user_id: str, events: List[Dict[str, Any]]) -> AppendResult:
+        """Append a batch whose sequence numbers continue the user's log.
+
+        Events the log already holds with the same action are acknowledged
+        again, so a retried batch is harmless. Raises ``SequenceConflict``
+        when the batch skips ahead of the log or disagrees with it, and
+        ``InvalidEvent`` for actions that cannot be applied.
+        """
+        if not events:
+            raise InvalidEvent("A batch needs at least one event")
+        if len(events) > MAX_BATCH_EVENTS:
+            raise InvalidEvent(f"A batch holds at most {MAX_BATCH_EVENTS} events")
+        first = events[0]["seq"]
+        if first < 1 or any(event["seq"] != first + i for i, event in enumerate(events)):
+            raise InvalidEvent("Sequence numbers must be consecutive and start at 1 or more")
+
+        head = await self.head_seq(user_id)
+        if first > head + 1:
+            raise SequenceConflict(f"Expected sequence {head + 1}, got {first}", head)
+        now = datetime.utcnow()
+        new = [resolve(event, now) for event in events if event["seq"] > head]
+        overlap = min(len(events), head - first + 1)
+        stored = await self.read_events(user_id, first - 1, overlap) if overlap > 0 else []
+        if not all(_same_event(old, event) for old, event in zip(stored, events)):
+            raise SequenceConflict("Events already recorded under these sequence numbers differ", head)
+
+        if new:
+            try:
+                await self.events.insert_many(
+                    [{"user_id": user_id, **event, "created_at": now} for event in new], ordered=True
+                )
+            except BulkWriteError:
+                # Another batch took these sequence numbers first
+                raise SequenceConflict("The log was appended to concurrently", await self.head_seq(user_id))
+            head = new[-1]["seq"]
+
+        snapshot = None
+        if head - await self.snapshot_seq(user_id) >= self.snapshot_every:
+            snapshot = await self.compact(user_id)
+        return AppendResult(head, stored + new, snapshot)
+
+    async def compact(self, user_id: str) -> Optional[Snapshot]:
+        """Apply the tail of the log to the stored quest data and record it.
+
+        Returns the snapshot written, or None when there was nothing to
+        apply or another worker holds the compaction lease.
+        """
+        async with self._lock(user_id):
+            lease = await self._take_lease(user_id)
+            if lease is None:
+                return None
+            try:
+                for _ in range(SNAPSHOT_ATTEMPTS):
+                    tail = await self.read_events(user_id, await self.snapshot_seq(user_id))
+                    if not tail:
+                        return None
+                    loaded = await self.store.read(user_id)
+                    state, version = loaded if loaded is not None else ({}, None)
+                    apply_events(state, tail)
+                    written = await self.store.write(user_id, state, version)
+                    if written is None:
+                        # Saved concurrently: replay the tail over the newer state
+                        continue
+                    await self.heads.update_one(
+                        {"user_id": user_id},
+                        {
+                            "$max": {"snapshot_seq": tail[-1]["seq"]},
+                            "$set": {"version": written, "updated_at": datetime.utcnow()},
+                        },
+                    )
+                    return Snapshot(tail[-1]["seq"], written, state)
+                return None
+            finally:
+                await self.heads.update_one(
+                    {"user_id": user_id, "compacting_until": lease}, {"$set": {"compacting_until": None}}
+                )
+
+    async def _take_lease(self, user_id: str) -> Optional[datetime]:
+        """Lease the user's head for a compaction; None if someone else holds it.
+
+        Readers see the lease and do not pair a snapshot being rewritten
+        with the head from before it.
+        """
+        now = datetime.utcnow()
+        until = now + timedelta(seconds=COMPACTION_LEASE_SECONDS)
+        # Stored with millisecond precision, and matched on when released
+        until = until.replace(microsecond=until.microsecond // 1000 * 1000)
+        try:
+            await self.heads.update_one(
+                {"user_id": user_id}, {"$setOnInsert": {"snapshot_seq": 0}}, upsert=True
+            )
+        except DuplicateKeyError:
+            pass
+        taken = await self.heads.update_one(
+            {"user_id": user_id, "$or": [{"compacting_until": None}, {"compacting_until": {"$lte": now}}]},
+            {"$set": {"compacting_until": until}},
+        )
+        return until if taken.modified_count else None
+
+    async def read(self, user_id: str) -> Tuple[int, Optional[Tuple[Dict[str, Any], int]], List[Dict[str, Any]]]:
+        """The snapshot sequence, the stored quest data and version, and the tail.
+
+        The head is read before the quest data, so a compaction in between
+        would return a snapshot that already includes part of the tail. The
+        pair is used when the quest data has the version the head records,
+        or when no compaction lease was held and the head did not move
+        (the quest data was saved in full since the last compaction).
+        Otherwise it is read again, and ``SnapshotBusy`` is raised when no
+        consistent pair turns up.
+        """
+        for attempt in range(SNAPSHOT_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(READ_RETRY_SECONDS * attempt)
+            head = await self.heads.find_one({"user_id": user_id}, {"_id": 0}) or {}
+            snapshot = await self.store.read(user_id)
+            lease = head.get("compacting_until")
+            if (
+                snapshot is None
+                or snapshot[1] == head.get("version")
+                or (lease is None or lease <= datetime.utcnow())
+                and (await self.heads.find_one({"user_id": user_id}, {"_id": 0}) or {}) == head
+            ):
+                seq = head.get("snapshot_seq", 0)
+                return seq, snapshot, await self.read_events(user_id, seq)
+        raise SnapshotBusy("The quest data snapshot is being rewritten, try again")
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        # One compaction per user at a time within this process
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
@@ -0,0 +1,266 @@
+"""JSON Patch (RFC 6902) support for incremental quest data updates."""
+import copy
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class JsonPatchError(ValueError):
+    """Raised when a patch document is malformed or cannot be applied."""
+
+
+class JsonPatchTestFailed(JsonPatchError):
+    """Raised when a ``test`` operation does not match the current document."""
+
+
+def parse_pointer(pointer: str) -> List[str]:
+    """Split a JSON Pointer (RFC 6901) into its unescaped reference tokens."""
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise JsonPatchError(f"Invalid JSON pointer: {pointer!r}")
+    return [
+        token.replace("~1", "/").replace("~0", "~")
+        for token in pointer[1:].split("/")
+    ]
+
+
+def _array_index(token: str, array: list, allow_end: bool) -> int:
+    """Resolve an array reference token to an index."""
+    if allow_end and token == "-":
+        return len(array)
+    if not token.isdigit() or (len(token) > 1 and token.startswith("0")):
+        raise JsonPatchError(f"Invalid array index: {token!r}")
+    index = int(token)
+    limit = len(array) if allow_end else len(array) - 1
+    if index > limit:
+        raise JsonPatchError(f"Array index out of range: {index}")
+    return index
+
+
+def _resolve_parent(document: Any, tokens: List[str]) -> Any:
+    """Walk to the container holding the last token of a path."""
+    target = document
+    for token in tokens[:-1]:
+        if isinstance(target, dict):
+            if token not in target:
+                raise JsonPatchError(f"Path does not exist: {token!r}")
+            target = target[token]
+        elif isinstance(target, list):
+            target = target[_array_index(token, target, allow_end=False)]
+        else:
+            raise JsonPatchError(f"Cannot traverse into a scalar at {token!r}")
+    return target
+
+
+def _get(document: Any, tokens: List[str]) -> Any:
+    if not tokens:
+        return document
+    parent = _resolve_parent(document, tokens)
+    key = tokens[-1]
+    if isinstance(parent, dict):
+        if key not in parent:
+            raise JsonPatchError(f"Path does not exist: {key!r}")
+        return parent[key]
+    if isinstance(parent, list):
+        return parent[_array_index(key, parent, allow_end=False)]
+    raise JsonPatchError(f"Cannot read from a scalar at {key!r}")
+
+
+def _add(document: Any, tokens: List[str], value: Any) -> Any:
+    if not tokens:
+        return value
+    parent = _resolve_parent(document, tokens)
+    key = tokens[-1]
+    if isinstance(parent, dict):
+        parent[key] = value
+    elif isinstance(parent, list):
+        parent.insert(_array_index(key, parent, allow_end=True), value)
+    else:
+        raise JsonPatchError(f"Cannot add to a scalar at {key!r}")
+    return document
+
+
+def _remove(document: Any, tokens: List[str]) -> Any:
+    if not tokens:
+        raise JsonPatchError("Cannot remove the document root")
+    parent = _resolve_parent(document, tokens)
+    key = tokens[-1]
+    if isinstance(parent, dict):
+        if key not in parent:
+            raise JsonPatchError(f"Path does not exist: {key!r}")
+        del parent[key]
+    elif isinstance(parent, list):
+        del parent[_array_index(key, parent, allow_end=False)]
+    else:
+        raise JsonPatchError(f"Cannot remove from a scalar at {key!r}")
+    return document
+
+
+def apply_operation(document: Any, operation: Dict[str, Any]) -> Any:
+    """Apply a single patch operation in place and return the new document."""
+    op = operation.get("op")
+    path = operation.get("path")
+    if not isinstance(path, str):
+        raise JsonPatchError("Operation is missing a 'path'")
+    tokens = parse_pointer(path)
+
+    if op in ("add", "replace", "test") and "value" not in operation:
+        raise JsonPatchError(f"'{op}' operation requires a 'value'")
+    if op in ("move", "copy") and not isinstance(operation.get("from"), str):
+        raise JsonPatchError(f"'{op}' operation requires a 'from' pointer")
+
+    if op == "add":
+        return _add(document, tokens, copy.deepcopy(operation["value"]))
+    if op == "remove":
+        return _remove(document, tokens)
+    if op == "replace":
+        _get(document, tokens)
+        if not tokens:
+            return copy.deepcopy(operation["value"])
+        document = _remove(document, tokens)
+        return _add(document, tokens, copy.deepcopy(operation["value"]))
+    if op == "move":
+        from_tokens = parse_pointer(operation["from"])
+        if tokens[:len(from_tokens)] == from_tokens and tokens != from_tokens:
+            raise JsonPatchError("Cannot move a value into one of its children")
+        value = _get(document, from_tokens)
+        document = _remove(document, from_tokens)
+        return _add(document, tokens, value)
+    if op == "copy":
+        value = _get(document, parse_pointer(operation["from"]))
+        return _add(document, tokens, copy.deepcopy(value))
+    if op == "test":
+        if _get(document, tokens) != operation["value"]:
+            raise JsonPatchTestFailed(f"Test failed at {path!r}")
+        return document
+    raise JsonPatchError(f"Unknown patch operation: {op!r}")
+
+
+def apply_patch(document: Any, operations: List[Dict[str, Any]]) -> Any:
+    """Apply a list of patch operations to a copy of ``document``."""
+    result = copy.deepcopy(document)
+    for operation in operations:
+        result = apply_operation(result, operation)
+    return result
+
+
+def touched_keys(operations: List[Dict[str, Any]]) -> Optional[List[str]]:
+    """Top-level keys read or written by a patch.
+
+    Returns None if the patch targets the document root or a top-level key
+    that cannot be addressed as a Mongo field.
+    """
+    keys = []
+    for operation in operations:
+        for pointer in (operation.get("path"), operation.get("from")):
+            if not isinstance(pointer, str):
+                continue
+            tokens = parse_pointer(pointer)
+            if not tokens or _mongo_path("", tokens[:1]) is None:
+                return None
+            if tokens[0] not in keys:
+                keys.append(tokens[0])
+    return keys
+
+
+def _mongo_path(prefix: str, tokens: List[str]) -> Optional[str]:
+    """Dotted Mongo field path for pointer tokens, if they can be expressed."""
+    for token in tokens:
+        if not token or "." in token or token.startswith("$"):
+            return None
+    return ".".join([prefix] + tokens)
+
+
+def _compile_operation(
+    document: Any, operation: Dict[str, Any], prefix: str
+) -> Optional[List[Tuple[str, str, Any]]]:
+    """Translate one operation into (operator, field, argument) update clauses.
+
+    ``document`` is the state just before the operation is applied, which tells
+    us whether each parent is an object or an array.
+    """
+    op = operation["op"]
+    tokens = parse_pointer(operation["path"])
+    if not tokens:
+        return None
+    if op == "test":
+        return []
+    if op in ("move", "copy"):
+        from_tokens = parse_pointer(operation["from"])
+        value = _get(document, from_tokens)
+        clauses = []
+        if op == "move":
+            clauses = _compile_operation(
+                document, {"op": "remove", "path": operation["from"]}, prefix
+            )
+            if clauses is None:
+                return None
+        added = _compile_operation(
+            document, {"op": "add", "path": operation["path"], "value": value}, prefix
+        )
+        if added is None:
+            return None
+        return clauses + added
+
+    parent = _resolve_parent(document, tokens)
+    key = tokens[-1]
+    field = _mongo_path(prefix, tokens)
+    parent_field = _mongo_path(prefix, tokens[:-1])
+    if field is None and not isinstance(parent, list):
+        return None
+
+    if isinstance(parent, dict):
+        if op == "remove":
+            return [("$unset", field, "")]
+        return [("$set", field, operation["value"])]
+
+    if isinstance(parent, list):
+        if parent_field is None:
+            return None
+        if op == "add":
+            index = _array_index(key, parent, allow_end=True)
+            each = {"$each": [operation["value"]]}
+            if index < len(parent):
+                each["$position"] = index
+            return [("$push", parent_field, each)]
+        index = _array_index(key, parent, allow_end=False)
+        if op == "replace":
+            return [("$set", f"{parent_field}.{index}", operation["value"])]
+        if index == len(parent) - 1:
+            return [("$pop", parent_field, 1)]
+        if index == 0:
+            return [("$pop", parent_field, -1)]
+    return None
+
+
+def _conflicts(field: str, other: str) -> bool:
+    return (
+        field == other
+        or field.startswith(other + ".")
+        or other.startswith(field + ".")
+    )
+
+
+def compile_patch(
+    document: Any, operations: List[Dict[str, Any]], prefix: str = "quest_data"
+) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Compile a patch into a single targeted Mongo update document.
+
+    Returns None when the patch cannot be expressed as one conflict-free
+    update (root replacement, mid-array removal, overlapping paths, or keys
+    Mongo cannot address); callers should then write the touched keys whole.
+    The patch must already have been validated with ``apply_patch``.
+    """
+    update: Dict[str, Dict[str, Any]] = {}
+    fields: List[str] = []
+    state = copy.deepcopy(document)
+    for operation in operations:
+        clauses = _compile_operation(state, operation, prefix)
+        if clauses is None:
+            return None
+        for operator, field, argument in clauses:
+            if any(_conflicts(field, other) for other in fields):
+                return None
+            fields.append(field)
+            update.setdefault(operator, {})[field] = argument
+        state = apply_operation(state, operation)
+    return update
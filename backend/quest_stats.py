@@ -0,0 +1,350 @@
+"""Per-user statistics kept up to date as quest data is saved.
+
+The Statistics page used to reduce the whole ``completedQuests`` and
+``claimedRewards`` history on every render. Instead, each user has a small
+counters document in ``quest_stats`` (counts, XP sums, rank and weekday
+histograms) that every save advances by the entries appended since the
+previous save. History is append-only in the client, so this is O(delta);
+when a section was edited in any other way (a reset, a deletion) that
+section is recounted.
+
+``python quest_stats.py`` rebuilds the counters for every user in bulk.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import json_codec
+from compression import decompress
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+
+class StatSection(NamedTuple):
+    xp_field: str  # XP gained or spent per entry
+    date_field: str  # timestamp bucketed into weekdays
+
+
+# Quest state key -> how its entries are counted
+STAT_SECTIONS: Dict[str, StatSection] = {
+    "completedQuests": StatSection("xpEarned", "dateCompleted"),
+    "claimedRewards": StatSection("xpCost", "dateClaimed"),
+}
+
+
+def _number(value: Any) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return 0
+
+
+def _weekday(value: Any) -> Optional[str]:
+    """Weekday of an ISO timestamp, in UTC when it carries an offset."""
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return WEEKDAYS[parsed.weekday()]
+
+
+def item_id(item: Any) -> Optional[str]:
+    raw = item.get("id") if isinstance(item, dict) else None
+    return str(raw) if raw is not None else None
+
+
+def empty_counters() -> Dict[str, Any]:
+    return {"count": 0, "xp": 0, "ranks": {}, "weekdays": {}, "tail_id": None}
+
+
+def add_entries(counters: Dict[str, Any], section: StatSection, items: Iterable[Any]) -> None:
+    """Advance ``counters`` by ``items`` in place."""
+    for item in items:
+        counters["count"] += 1
+        counters["tail_id"] = item_id(item)
+        if not isinstance(item, dict):
+            continue
+        counters["xp"] += _number(item.get(section.xp_field))
+        rank = item.get("rank")
+        if isinstance(rank, str):
+            counters["ranks"][rank] = counters["ranks"].get(rank, 0) + 1
+        weekday = _weekday(item.get(section.date_field))
+        if weekday is not None:
+            counters["weekdays"][weekday] = counters["weekdays"].get(weekday, 0) + 1
+
+
+def appended_entries(count: int, tail_id: Optional[str], items: List[Any]) -> Optional[List[Any]]:
+    """Entries added after the first ``count``, or None if ``items`` was not
+    just appended to since it had ``count`` entries ending in ``tail_id``."""
+    if len(items) < count:
+        return None
+    if count and (tail_id is None or item_id(items[count - 1]) != tail_id):
+        return None
+    return items[count:]
+
+
+def advance(counters: Optional[Dict[str, Any]], section: StatSection, items: Any) -> Dict[str, Any]:
+    """Counters for ``items``, reusing ``counters`` when only entries were appended."""
+    if not isinstance(items, list):
+        items = []
+    appended = (
+        appended_entries(counters["count"], counters["tail_id"], items)
+        if counters is not None else None
+    )
+    if appended is not None:
+        updated = {
+            **counters,
+            "ranks": dict(counters["ranks"]),
+            "weekdays": dict(counters["weekdays"]),
+        }
+        add_entries(updated, section, appended)
+    else:
+        updated = empty_counters()
+        add_entries(updated, section, items)
+    return updated
+
+
+def _average(total: float, count: int) -> int:
+    # Math.round, as the Statistics page did, rather than round-half-even
+    return math.floor(total / count + 0.5) if count else 0
+
+
+def summarize(document: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """The ``GET /api/stats`` payload for a counters document."""
+    sections = (document or {}).get("sections", {})
+    quests = sections.get("completedQuests") or empty_counters()
+    rewards = sections.get("claimedRewards") or empty_counters()
+    weekdays = quests["weekdays"]
+    most_active = max(weekdays.items(), key=lambda entry: entry[1], default=(None, 0))
+    return {
+        "version": (document or {}).get("version"),
+        "quests": {
+            "completed": quests["count"],
+            "xp_earned": quests["xp"],
+            "average_xp": _average(quests["xp"], quests["count"]),
+            "rank_distribution": quests["ranks"],
+            "weekday_activity": weekdays,
+            "most_active_day": {"day": most_active[0], "count": most_active[1]},
+        },
+        "rewards": {
+            "claimed": rewards["count"],
+            "xp_spent": rewards["xp"],
+            "average_xp": _average(rewards["xp"], rewards["count"]),
+            "weekday_activity": rewards["weekdays"],
+        },
+    }
+
+
+class QuestStats:
+    """Reads and incrementally maintains the per-user counters documents."""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.quest_stats
+
+    async def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"user_id": user_id}, {"_id": 0})
+
+    async def record(
+        self,
+        user_id: str,
+        sections: Dict[str, Any],
+        removed: List[str],
+        version: int,
+        replace: bool = False,
+    ) -> None:
+        """Fold a successful quest data write at ``version`` into the counters.
+
+        ``sections`` holds the written top-level sections and ``removed`` the
+        dropped ones; with ``replace`` every section absent from ``sections``
+        counts as removed. Writes older than the stored counters are ignored.
+        """
+        tracked = [
+            key for key in STAT_SECTIONS
+            if replace or key in sections or key in removed
+        ]
+        if not tracked:
+            return
+        # Compare-and-set on the counters' version; retry if another save won
+        for _ in range(3):
+            existing = await self.get(user_id)
+            if existing is not None and existing.get("version", 0) >= version:
+                return
+            stored = (existing or {}).get("sections", {})
+            advanced = {
+                key: advance(stored.get(key), STAT_SECTIONS[key], sections.get(key))
+                for key in tracked
+            }
+            try:
+                if existing is None:
+                    await self.collection.insert_one({
+                        "user_id": user_id,
+                        "version": version,
+                        "updated_at": datetime.utcnow(),
+                        "sections": advanced,
+                    })
+                    return
+                update = {"version": version, "updated_at": datetime.utcnow()}
+                update.update({f"sections.{key}": value for key, value in advanced.items()})
+                result = await self.collection.update_one(
+                    {"user_id": user_id, "version": existing.get("version", 0)}, {"$set": update}
+                )
+            except DuplicateKeyError:
+                continue
+            if result.matched_count:
+                return
+        logger.warning("Gave up updating quest stats for user %s at version %s", user_id, version)
+
+
+def rebuild_frame(users: List[Dict[str, Any]]):
+    """Counters documents for a batch of users, aggregated with pandas.
+
+    ``users`` holds dicts with ``user_id``, ``version`` and ``quest_data``.
+    """
+    import pandas as pd
+
+    rows: Dict[str, list] = {"user_id": [], "section": [], "xp": [], "rank": [], "date": []}
+    documents = {}
+    for user in users:
+        documents[user["user_id"]] = {
+            "user_id": user["user_id"],
+            "version": user["version"],
+            "sections": {key: empty_counters() for key in STAT_SECTIONS},
+        }
+        for key, section in STAT_SECTIONS.items():
+            items = user["quest_data"].get(key)
+            if not isinstance(items, list) or not items:
+                continue
+            counters = documents[user["user_id"]]["sections"][key]
+            counters["tail_id"] = item_id(items[-1])
+            for item in items:
+                entry = item if isinstance(item, dict) else {}
+                rows["user_id"].append(user["user_id"])
+                rows["section"].append(key)
+                rows["xp"].append(_number(entry.get(section.xp_field)))
+                rank = entry.get("rank")
+                rows["rank"].append(rank if isinstance(rank, str) else None)
+                date = entry.get(section.date_field)
+                rows["date"].append(date if isinstance(date, str) else None)
+    if not rows["user_id"]:
+        return list(documents.values())
+
+    frame = pd.DataFrame(rows)
+    frame["weekday"] = pd.to_datetime(
+        frame["date"], utc=True, errors="coerce", format="ISO8601"
+    ).dt.day_name()
+    grouped = frame.groupby(["user_id", "section"])
+    totals = grouped.agg(count=("xp", "size"), xp=("xp", "sum"))
+    for (user_id, key), row in totals.iterrows():
+        counters = documents[user_id]["sections"][key]
+        counters["count"] = int(row["count"])
+        xp = row["xp"]
+        counters["xp"] = int(xp) if float(xp).is_integer() else float(xp)
+    for column, field in (("rank", "ranks"), ("weekday", "weekdays")):
+        sizes = frame.dropna(subset=[column]).groupby(["user_id", "section", column]).size()
+        for (user_id, key, value), size in sizes.items():
+            documents[user_id]["sections"][key][field][value] = int(size)
+    return list(documents.values())
+
+
+async def _load_entities(store, users: List[Dict[str, Any]]) -> None:
+    """Fill in the stat sections of normalized ``users`` from the entity
+    collections, one query per section for the whole batch."""
+    for key in STAT_SECTIONS:
+        owners = {user["user_id"]: user for user in users if key in user["entity_keys"]}
+        if not owners:
+            continue
+        for user in owners.values():
+            user["quest_data"][key] = []
+        cursor = store.entities[key].find(
+            {"user_id": {"$in": list(owners)}}, {"_id": 0, "user_id": 1, "data": 1}
+        ).sort([("user_id", ASCENDING), ("position", ASCENDING)])
+        async for entity in cursor:
+            owners[entity["user_id"]]["quest_data"][key].append(entity["data"])
+
+
+async def rebuild_all(db: AsyncIOMotorDatabase, store, batch_size: int = 500) -> int:
+    """Recompute every user's counters from their stored quest data.
+
+    Quest data documents are streamed through one cursor projected to the
+    stat sections; compressed blobs are decoded in process and normalized
+    users' entities are fetched per batch.
+    """
+    rebuilt = 0
+    batch: List[Dict[str, Any]] = []
+
+    async def flush() -> None:
+        await _load_entities(store, batch)
+        operations = [
+            UpdateOne(
+                {"user_id": document["user_id"], "version": {"$not": {"$gt": document["version"]}}},
+                {"$set": {**document, "updated_at": datetime.utcnow()}},
+                upsert=True,
+            )
+            for document in rebuild_frame(batch)
+        ]
+        try:
+            await db.quest_stats.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Duplicate keys mean a live save already wrote newer counters
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+        batch.clear()
+
+    projection = {
+        "_id": 0, "user_id": 1, "version": 1, "storage": 1, "entity_keys": 1,
+        "quest_data_z": 1, "quest_data_codec": 1,
+        **{f"quest_data.{key}": 1 for key in STAT_SECTIONS},
+    }
+    async for root in db.quest_data.find({}, projection).batch_size(batch_size):
+        if "quest_data_z" in root:
+            quest_data = json_codec.loads(decompress(root["quest_data_z"], root["quest_data_codec"]))
+            quest_data = {key: quest_data[key] for key in STAT_SECTIONS if key in quest_data}
+        else:
+            quest_data = root.get("quest_data", {})
+        # Sections the normalized layout keeps in entity collections
+        entity_keys = list(root.get("entity_keys", {})) if root.get("storage") == "normalized" else []
+        batch.append({
+            "user_id": root["user_id"], "version": root.get("version", 0),
+            "quest_data": quest_data, "entity_keys": entity_keys,
+        })
+        rebuilt += 1
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    return rebuilt
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from quest_store import QuestStore
+
+    load_dotenv(Path(__file__).parent / ".env")
+
+    async def main() -> None:
+        client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        db = client[os.environ["DB_NAME"]]
+        store = QuestStore(db, os.getenv("QUEST_DATA_STORAGE", "document"))
+        started = time.perf_counter()
+        count = await rebuild_all(db, store, int(os.getenv("QUEST_STATS_BATCH_SIZE", "500")))
+        print(f"Rebuilt stats for {count} user(s) in {time.perf_counter() - started:.1f}s")
+        client.close()
+
+    asyncio.run(main())
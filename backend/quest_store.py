@@ -0,0 +1,524 @@
+"""Storage backends for per-user quest data.
+
+Quest data is stored in one of two layouts:
+
+* ``document`` - the whole client state lives in ``quest_data.quest_data``.
+* ``document`` with ``compression`` - the same, but stored as a compressed
+  JSON blob in ``quest_data_z`` (BSON binary), decompressed on read.
+* ``normalized`` - each growing list (quests, completedQuests, ...) lives in
+  its own collection with one document per entity, keyed by
+  ``(user_id, id)``; ``quest_data`` keeps only the small scalar sections
+  plus the version counter.
+
+Reads honour the layout recorded on each user's document, so switching the
+mode migrates users lazily on their next write.
+"""
+import asyncio
+import hashlib
+import json
+import weakref
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from bson import Binary
+from pymongo import ASCENDING, DESCENDING, DeleteMany, ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import json_codec
+from compression import compress, decompress, storage_codecs
+from history import HistoryView, after_cursor_query, page_from_positions, page_items
+from models import QuestData
+from quest_stats import QuestStats
+
+
+# Quest state key -> collection holding one document per entity
+ENTITY_COLLECTIONS = {
+    "quests": "quests",
+    "completedQuests": "completed_quests",
+    "rewards": "rewards",
+    "inventory": "inventory_items",
+    "claimedRewards": "claimed_rewards",
+    "recurringTasks": "recurring_tasks",
+    "achievements": "achievements",
+    "notifications": "notifications",
+}
+
+STORAGE_DOCUMENT = "document"
+STORAGE_NORMALIZED = "normalized"
+
+
+def version_filter(user_id: str, version: int) -> dict:
+    """Query matching a user's quest data at exactly ``version``."""
+    if version == 0:
+        # Documents written before versioning have no counter yet
+        return {"user_id": user_id, "version": {"$exists": False}}
+    return {"user_id": user_id, "version": version}
+
+
+def _checksum(item: Any) -> str:
+    encoded = json.dumps(item, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def entity_ids(items: List[Any]) -> List[str]:
+    """Stable per-user keys for list items, disambiguating duplicate ids."""
+    ids = []
+    seen: Dict[str, int] = {}
+    for position, item in enumerate(items):
+        raw = item.get("id") if isinstance(item, dict) else None
+        key = str(raw) if raw is not None else f"#{position}"
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        ids.append(key if count == 0 else f"{key}#{count}")
+    return ids
+
+
+class QuestStore:
+    """Reads and writes quest data in either storage layout."""
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        mode: str = STORAGE_DOCUMENT,
+        compression: Optional[str] = None,
+        counters: Optional[QuestStats] = None,
+    ):
+        if mode not in (STORAGE_DOCUMENT, STORAGE_NORMALIZED):
+            raise ValueError(f"Unknown quest data storage mode: {mode!r}")
+        if compression is not None and compression not in storage_codecs():
+            raise ValueError(f"Unsupported quest data compression: {compression!r}")
+        self.mode = mode
+        # Only applies to the document layout
+        self.compression = compression
+        # Statistics advanced after every successful write
+        self.counters = counters
+        self.collection = db.quest_data
+        self.entities = {
+            key: db[name] for key, name in ENTITY_COLLECTIONS.items()
+        }
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = (
+            weakref.WeakValueDictionary()
+        )
+
+    @property
+    def normalized(self) -> bool:
+        return self.mode == STORAGE_NORMALIZED
+
+    async def read_version(self, user_id: str) -> Optional[int]:
+        """Current version of a user's quest data, or None if there is none."""
+        existing = await self.collection.find_one(
+            {"user_id": user_id}, {"_id": 0, "version": 1}
+        )
+        if existing is None:
+            return None
+        return existing.get("version", 0)
+
+    async def read(
+        self,
+        user_id: str,
+        keys: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+    ) -> Optional[Tuple[Dict[str, Any], int]]:
+        """Load a user's quest data and version.
+
+        With ``keys`` only those top-level sections are loaded; sections in
+        ``exclude`` are left out.
+        """
+        exclude = exclude or []
+        if keys is None and exclude:
+            # Exclusion projection: everything on the document except these
+            projection = {"_id": 0, **{f"quest_data.{key}": 0 for key in exclude}}
+        else:
+            projection = {
+                "_id": 0, "version": 1, "storage": 1, "entity_keys": 1,
+                "quest_data_z": 1, "quest_data_codec": 1,
+            }
+            if keys is None:
+                projection["quest_data"] = 1
+            else:
+                projection.update({f"quest_data.{key}": 1 for key in keys})
+        root = await self.collection.find_one({"user_id": user_id}, projection)
+        if root is None:
+            return None
+
+        if "quest_data_z" in root:
+            raw = decompress(root["quest_data_z"], root["quest_data_codec"])
+            quest_data = json_codec.loads(raw)
+            quest_data = {
+                k: v for k, v in quest_data.items()
+                if (keys is None or k in keys) and k not in exclude
+            }
+        else:
+            quest_data = root.get("quest_data", {})
+        if root.get("storage") == STORAGE_NORMALIZED:
+            wanted = [
+                key for key in root.get("entity_keys", {})
+                if key in self.entities and (keys is None or key in keys) and key not in exclude
+            ]
+            loaded = await asyncio.gather(
+                *(self._read_entities(user_id, key) for key in wanted)
+            )
+            quest_data.update(zip(wanted, loaded))
+        return quest_data, root.get("version", 0)
+
+    async def read_serialized(self, user_id: str) -> Optional[Tuple[bytes, int]]:
+        """A user's whole quest data as JSON bytes, and its version.
+
+        Compressed blobs are only decompressed, never decoded and re-encoded.
+        The other layouts are read as documents and encoded here, which costs
+        the same as serializing the dict.
+        """
+        root = await self.collection.find_one({"user_id": user_id}, {"_id": 0, "user_id": 0})
+        if root is None:
+            return None
+        if root.get("storage") == STORAGE_NORMALIZED:
+            loaded = await self.read(user_id)
+            return (json_codec.dumps(loaded[0]), loaded[1]) if loaded else None
+        if "quest_data_z" in root:
+            raw = decompress(root["quest_data_z"], root["quest_data_codec"])
+        else:
+            raw = json_codec.dumps(root.get("quest_data", {}))
+        return raw, root.get("version", 0)
+
+    async def read_history(
+        self,
+        user_id: str,
+        view: HistoryView,
+        cursor: Optional[Tuple[str, str]],
+        limit: int,
+    ) -> Optional[Tuple[List[Any], Optional[str]]]:
+        """One page of a history view, newest first, plus the next cursor.
+
+        In the normalized layout this is an indexed range query; otherwise
+        the section is loaded and paged in memory.
+        """
+        root = await self.collection.find_one(
+            {"user_id": user_id}, {"_id": 0, "storage": 1}
+        )
+        if root is None:
+            return None
+        if root.get("storage") == STORAGE_NORMALIZED:
+            field = f"data.{view.field}"
+            entities = self.entities[view.section].find(
+                {"user_id": user_id, **after_cursor_query(field, cursor)},
+                {"_id": 0, "id": 1, "data": 1},
+            ).sort([(field, DESCENDING), ("id", DESCENDING)]).limit(limit + 1)
+            rows = [
+                ((entity["data"][view.field], entity["id"]), entity["data"])
+                async for entity in entities
+            ]
+            return page_from_positions(rows, limit)
+
+        loaded = await self.read(user_id, [view.section])
+        items = loaded[0].get(view.section) if loaded else None
+        if not isinstance(items, list):
+            items = []
+        return page_items(items, entity_ids(items), view.field, cursor, limit)
+
+    async def _read_entities(self, user_id: str, key: str) -> List[Any]:
+        cursor = self.entities[key].find(
+            {"user_id": user_id}, {"_id": 0, "data": 1}
+        ).sort("position", ASCENDING)
+        return [entity["data"] async for entity in cursor]
+
+    async def write(
+        self,
+        user_id: str,
+        quest_data: Dict[str, Any],
+        expected_version: Optional[int],
+        new_version: Optional[int] = None,
+    ) -> Optional[int]:
+        """Replace a user's quest data.
+
+        ``expected_version`` is the version the caller read, or None when the
+        user had no quest data. The stored version becomes ``new_version``
+        (by default the next one). Returns the new version, or None if the
+        stored version no longer matches.
+        """
+        written = await self._write(user_id, quest_data, expected_version, new_version)
+        if written is not None and self.counters is not None:
+            await self.counters.record(user_id, quest_data, [], written, replace=True)
+        return written
+
+    async def _write(
+        self,
+        user_id: str,
+        quest_data: Dict[str, Any],
+        expected_version: Optional[int],
+        new_version: Optional[int] = None,
+    ) -> Optional[int]:
+        if new_version is None:
+            new_version = 1 if expected_version is None else expected_version + 1
+        if expected_version is None:
+            quest_data_obj = QuestData(user_id=user_id, quest_data={}, version=new_version)
+            document = quest_data_obj.dict()
+            if self.normalized:
+                document["storage"] = STORAGE_NORMALIZED
+            else:
+                del document["quest_data"]
+                document.update(self._encode(quest_data)[0])
+            async with self._lock(user_id):
+                try:
+                    await self.collection.insert_one(document)
+                except DuplicateKeyError:
+                    # Another request created the user's document first
+                    return None
+                if self.normalized:
+                    await self._write_normalized(
+                        user_id, quest_data, [], None, replace=True
+                    )
+            return quest_data_obj.version
+
+        if not self.normalized:
+            set_fields, unset_fields = self._encode(quest_data)
+            update = {
+                "$set": {
+                    **set_fields,
+                    "updated_at": datetime.utcnow(),
+                    "version": new_version,
+                },
+                "$unset": unset_fields,
+            }
+            if await self._update_document(user_id, expected_version, update):
+                return new_version
+            if not await self._stored_normalized(user_id, expected_version):
+                return None
+            # Switching back from the normalized layout: fold entities back in
+            update["$unset"].update({"storage": "", "entity_keys": ""})
+            result = await self.collection.update_one(
+                version_filter(user_id, expected_version), update
+            )
+            if not result.matched_count:
+                return None
+            await asyncio.gather(
+                *(entities.delete_many({"user_id": user_id}) for entities in self.entities.values())
+            )
+            return new_version
+
+        async with self._lock(user_id):
+            written = await self._write_normalized(
+                user_id, quest_data, [], expected_version, replace=True,
+                new_version=new_version
+            )
+        return new_version if written else None
+
+    async def write_sections(
+        self,
+        user_id: str,
+        sections: Dict[str, Any],
+        removed: List[str],
+        expected_version: int,
+        update: Optional[Dict[str, Dict[str, Any]]] = None,
+    ) -> Optional[int]:
+        """Replace some top-level sections and drop others.
+
+        In the uncompressed document layout a precompiled Mongo ``update`` is
+        used as-is when given. Returns the new version, or None on a version
+        mismatch.
+        """
+        written = await self._write_sections(user_id, sections, removed, expected_version, update)
+        if written is not None and self.counters is not None:
+            await self.counters.record(user_id, sections, removed, written)
+        return written
+
+    async def _write_sections(
+        self,
+        user_id: str,
+        sections: Dict[str, Any],
+        removed: List[str],
+        expected_version: int,
+        update: Optional[Dict[str, Dict[str, Any]]] = None,
+    ) -> Optional[int]:
+        if not self.normalized and self.compression is None:
+            if update is None:
+                update = {
+                    "$set": {f"quest_data.{k}": v for k, v in sections.items()},
+                    "$unset": {f"quest_data.{k}": "" for k in removed},
+                }
+            update = {operator: dict(fields) for operator, fields in update.items()}
+            update.setdefault("$set", {})["updated_at"] = datetime.utcnow()
+            update["$inc"] = {"version": 1}
+            update = {operator: fields for operator, fields in update.items() if fields}
+            if await self._update_document(user_id, expected_version, update, plain_only=True):
+                return expected_version + 1
+
+        if not self.normalized:
+            # The stored blob is compressed or in another layout, so merge
+            # the sections in memory and rewrite it whole
+            loaded = await self.read(user_id)
+            if loaded is None or loaded[1] != expected_version:
+                return None
+            quest_data = loaded[0]
+            for key in removed:
+                quest_data.pop(key, None)
+            quest_data.update(sections)
+            return await self._write(user_id, quest_data, expected_version)
+
+        async with self._lock(user_id):
+            written = await self._write_normalized(
+                user_id, sections, removed, expected_version
+            )
+        return expected_version + 1 if written else None
+
+    def _encode(self, quest_data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """Fields to set and unset to store ``quest_data`` in the document layout."""
+        if self.compression is None:
+            return {"quest_data": quest_data}, {"quest_data_z": "", "quest_data_codec": ""}
+        raw = json_codec.dumps(quest_data)
+        return (
+            {
+                "quest_data_z": Binary(compress(raw, self.compression)),
+                "quest_data_codec": self.compression,
+            },
+            {"quest_data": ""},
+        )
+
+    async def _update_document(
+        self,
+        user_id: str,
+        expected_version: int,
+        update: Dict[str, Any],
+        plain_only: bool = False,
+    ) -> bool:
+        query = version_filter(user_id, expected_version)
+        query["storage"] = {"$ne": STORAGE_NORMALIZED}
+        if plain_only:
+            # Targeted updates only make sense on an uncompressed blob
+            query["quest_data_z"] = {"$exists": False}
+        result = await self.collection.update_one(query, update)
+        return bool(result.matched_count)
+
+    async def _stored_normalized(self, user_id: str, expected_version: int) -> bool:
+        root = await self.collection.find_one(
+            version_filter(user_id, expected_version), {"_id": 0, "storage": 1}
+        )
+        return root is not None and root.get("storage") == STORAGE_NORMALIZED
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        # Serializes the multi-collection writes of one user within this process
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+    async def _write_normalized(
+        self,
+        user_id: str,
+        sections: Dict[str, Any],
+        removed: List[str],
+        expected_version: Optional[int],
+        replace: bool = False,
+        new_version: Optional[int] = None,
+    ) -> bool:
+        """Write sections in the normalized layout.
+
+        The version bump on the root document acts as the compare-and-set;
+        entity collections are only touched once it has succeeded.
+        """
+        root = await self.collection.find_one(
+            {"user_id": user_id}, {"_id": 0, "storage": 1, "quest_data": 1}
+        )
+        if root is None:
+            return False
+        migrating = root.get("storage") != STORAGE_NORMALIZED
+        if migrating:
+            # Carry legacy blob sections over before splitting them out
+            merged = dict(root.get("quest_data") or {}) if not replace else {}
+            for key in removed:
+                merged.pop(key, None)
+            merged.update(sections)
+            sections, removed, replace = merged, [], True
+
+        entity_sections = {
+            k: v for k, v in sections.items() if k in self.entities and isinstance(v, list)
+        }
+        scalar_sections = {k: v for k, v in sections.items() if k not in entity_sections}
+        if replace:
+            cleared = [k for k in self.entities if k not in entity_sections]
+        else:
+            cleared = [k for k in self.entities if k in removed or k in scalar_sections]
+
+        set_fields: Dict[str, Any] = {
+            "updated_at": datetime.utcnow(),
+            "storage": STORAGE_NORMALIZED,
+        }
+        unset_fields: Dict[str, str] = {}
+        if replace:
+            set_fields["quest_data"] = scalar_sections
+        else:
+            set_fields.update({f"quest_data.{k}": v for k, v in scalar_sections.items()})
+            # Entity sections may previously have held a non-list value
+            unset_fields.update(
+                {f"quest_data.{k}": "" for k in list(removed) + list(entity_sections)}
+            )
+        set_fields.update({f"entity_keys.{k}": True for k in entity_sections})
+        unset_fields.update({f"entity_keys.{k}": "" for k in cleared})
+
+        update: Dict[str, Any] = {"$set": set_fields}
+        if expected_version is not None:
+            if new_version is None:
+                new_version = expected_version + 1
+            set_fields["version"] = new_version
+            query = version_filter(user_id, expected_version)
+        else:
+            query = {"user_id": user_id}
+        if unset_fields:
+            update["$unset"] = unset_fields
+        result = await self.collection.update_one(query, update)
+        if not result.matched_count:
+            return False
+
+        await asyncio.gather(
+            *(self._sync_entities(user_id, k, items) for k, items in entity_sections.items()),
+            *(self.entities[k].delete_many({"user_id": user_id}) for k in cleared),
+        )
+        return True
+
+    async def _sync_entities(self, user_id: str, key: str, items: List[Any]) -> None:
+        """Bring one entity collection in line with ``items``, touching only changes."""
+        collection = self.entities[key]
+        stored = {
+            entity["id"]: entity
+            async for entity in collection.find(
+                {"user_id": user_id}, {"_id": 0, "id": 1, "position": 1, "checksum": 1}
+            )
+        }
+
+        operations = []
+        last_position = -1
+        ids = entity_ids(items)
+        for entity_id, item in zip(ids, items):
+            existing = stored.get(entity_id)
+            # Keep stored positions while they stay in order so that appends
+            # and removals never renumber the rest of the list
+            if existing is not None and existing.get("position", -1) > last_position:
+                position = existing["position"]
+            else:
+                position = last_position + 1
+            last_position = position
+
+            checksum = _checksum(item)
+            if existing is None or existing.get("checksum") != checksum:
+                operations.append(ReplaceOne(
+                    {"user_id": user_id, "id": entity_id},
+                    {
+                        "user_id": user_id,
+                        "id": entity_id,
+                        "position": position,
+                        "checksum": checksum,
+                        "data": item,
+                    },
+                    upsert=True,
+                ))
+            elif existing.get("position") != position:
+                operations.append(UpdateOne(
+                    {"user_id": user_id, "id": entity_id},
+                    {"$set": {"position": position}},
+                ))
+
+        gone = set(stored) - set(ids)
+        if gone:
+            operations.append(DeleteMany({"user_id": user_id, "id": {"$in": list(gone)}}))
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
@@ -0,0 +1,269 @@
+"""Occurrence generation for recurring tasks.
+
+Every series is a lazy generator of due dates, so even a never-ending task
+only yields the dates a caller consumes. Series without an occurrence
+limit jump straight to the requested window instead of walking from their
+first occurrence; ``occurrences_between`` merges the series of many tasks
+in date order.
+
+A series starts at the task's ``startDate`` or ``createdAt``, or else at
+the creation time the client encodes in its id. ``lastAdded`` moves every
+time an occurrence is added to the quest log, so it is only used for tasks
+with none of those; anchoring on it would shift the phase of N-weekly and
+N-monthly series and restart their occurrence limit. An ``endAfter`` limit
+counts scheduled occurrences from the start; a task whose
+``generatedCount`` has reached it has none left.
+
+Monthly occurrences on a day the month does not have fall on its last day;
+yearly ones on 29 February are skipped in other years. Series end at
+``date.max``.
+"""
+import calendar
+import hashlib
+import heapq
+import json
+import re
+from datetime import date, datetime, timedelta
+from itertools import count, dropwhile, islice, takewhile
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DAY_NAMES = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+WEEKDAYS = frozenset(range(5))
+WEEKENDS = frozenset({5, 6})
+EVERY_DAY = frozenset(range(7))
+ONE_DAY = timedelta(days=1)
+# Client ids are Date.now() millisecond timestamps; shorter numbers are
+# hand-written ids such as the mock data's
+MIN_TIMESTAMP_ID = 10 ** 12
+
+
+def parse_date(value: Any) -> Optional[date]:
+    """The date part of an ISO date or timestamp string."""
+    if not isinstance(value, str) or len(value) < 10:
+        return None
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return None
+
+
+def _weekdays(days: Any) -> frozenset:
+    if not isinstance(days, list):
+        return frozenset()
+    return frozenset(DAY_NAMES.index(day) for day in days if day in DAY_NAMES)
+
+
+def _day_of_month(days: Any, fallback: int) -> int:
+    """Day of month from the client's ``['1st']``-style list."""
+    if isinstance(days, list) and days and isinstance(days[0], str):
+        match = re.match(r"(\d+)", days[0])
+        if match and 1 <= int(match.group(1)) <= 31:
+            return int(match.group(1))
+    return fallback
+
+
+def _month_date(year: int, month: int, day: int) -> date:
+    return date(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+
+def _add_months(anchor: date, months: int, day: int) -> date:
+    index = anchor.year * 12 + anchor.month - 1 + months
+    return _month_date(index // 12, index % 12 + 1, day)
+
+
+def _positive_int(value: Any, default: int = 1) -> int:
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return value
+    return default
+
+
+def _on_weekdays(anchor: date, days: frozenset, skip_to: date) -> Iterator[date]:
+    if not days:
+        return
+    current = max(anchor, skip_to)
+    while True:
+        if current.weekday() in days:
+            yield current
+        if current == date.max:
+            return
+        current += ONE_DAY
+
+
+def _every_n_days(anchor: date, interval: int, skip_to: date) -> Iterator[date]:
+    first = max(0, -(-(skip_to - anchor).days // interval))
+    for k in count(first):
+        try:
+            occurrence = anchor + timedelta(days=k * interval)
+        except OverflowError:
+            return
+        yield occurrence
+
+
+def _every_n_weeks(anchor: date, interval: int, days: frozenset, skip_to: date) -> Iterator[date]:
+    days = sorted(days) or [anchor.weekday()]
+    week_start = anchor - timedelta(days=anchor.weekday())
+    first = max(0, (skip_to - week_start).days // 7 // interval)
+    for k in count(first):
+        for day in days:
+            try:
+                occurrence = week_start + timedelta(weeks=k * interval, days=day)
+            except OverflowError:
+                return
+            if occurrence >= anchor:
+                yield occurrence
+
+
+def _every_n_months(anchor: date, interval: int, day: int, skip_to: date) -> Iterator[date]:
+    months = (skip_to.year - anchor.year) * 12 + skip_to.month - anchor.month
+    first = max(0, months // interval)
+    for k in count(first):
+        try:
+            occurrence = _add_months(anchor, k * interval, day)
+        except ValueError:  # past year 9999
+            return
+        if occurrence >= anchor:
+            yield occurrence
+
+
+def _every_n_years(anchor: date, interval: int, month: int, day: int, skip_to: date) -> Iterator[date]:
+    first = max(0, (skip_to.year - anchor.year) // interval)
+    for k in count(first):
+        year = anchor.year + k * interval
+        if year > date.max.year:
+            return
+        if month == 2 and day == 29 and not calendar.isleap(year):
+            continue
+        occurrence = date(year, month, day)
+        if occurrence >= anchor:
+            yield occurrence
+
+
+def _created_from_id(value: Any) -> Optional[date]:
+    if not isinstance(value, str) or not value.isdigit() or int(value) < MIN_TIMESTAMP_ID:
+        return None
+    try:
+        return datetime.utcfromtimestamp(int(value) / 1000).date()
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+def anchor_date(task: Dict[str, Any]) -> Optional[date]:
+    """The date a task's series starts from."""
+    return (
+        parse_date(task.get("startDate"))
+        or parse_date(task.get("createdAt"))
+        or _created_from_id(task.get("id"))
+        or parse_date(task.get("lastAdded"))
+    )
+
+
+def occurrences(task: Dict[str, Any], not_before: Optional[date] = None) -> Iterator[date]:
+    """Due dates of a recurring task in order, from ``not_before`` on.
+
+    Paused or inactive tasks and tasks without a start date have none.
+    """
+    anchor = anchor_date(task)
+    if anchor is None or task.get("status", "Active") != "Active":
+        return iter(())
+    not_before = not_before or anchor
+    frequency = task.get("frequency")
+    custom = task.get("customFrequency") if isinstance(task.get("customFrequency"), dict) else {}
+    end_condition = custom.get("endCondition") if frequency == "Custom" else None
+    # With an occurrence limit the series has to be counted from its start
+    skip_to = anchor if end_condition == "after" else not_before
+
+    if frequency == "Daily":
+        series = _on_weekdays(anchor, _weekdays(task.get("days")) or EVERY_DAY, skip_to)
+    elif frequency == "Weekdays":
+        series = _on_weekdays(anchor, WEEKDAYS, skip_to)
+    elif frequency == "Weekends":
+        series = _on_weekdays(anchor, WEEKENDS, skip_to)
+    elif frequency == "Weekly":
+        days = _weekdays(task.get("days")) or frozenset({anchor.weekday()})
+        series = _on_weekdays(anchor, days, skip_to)
+    elif frequency == "Monthly":
+        day = _day_of_month(task.get("days"), anchor.day)
+        series = _every_n_months(anchor, 1, day, skip_to)
+    elif frequency == "Yearly":
+        match = re.fullmatch(r"(\d{1,2})-(\d{1,2})", str(task.get("yearlyDate") or "")[-5:])
+        try:
+            month, day = (int(match.group(1)), int(match.group(2))) if match else (anchor.month, anchor.day)
+            date(2000, month, day)  # a leap year, so 02-29 is valid
+        except ValueError:
+            return iter(())
+        series = _every_n_years(anchor, 1, month, day, skip_to)
+    elif frequency == "Custom" and custom:
+        interval = _positive_int(custom.get("interval"))
+        unit = custom.get("unit")
+        if unit == "days":
+            series = _every_n_days(anchor, interval, skip_to)
+        elif unit == "weeks":
+            series = _every_n_weeks(anchor, interval, _weekdays(custom.get("weeklyDays")), skip_to)
+        elif unit == "months":
+            series = _every_n_months(anchor, interval, anchor.day, skip_to)
+        elif unit == "years":
+            series = _every_n_years(anchor, interval, anchor.month, anchor.day, skip_to)
+        else:
+            return iter(())
+    else:
+        return iter(())
+
+    if end_condition == "after":
+        limit = _positive_int(custom.get("endAfter"))
+        generated = task.get("generatedCount")
+        if isinstance(generated, int) and not isinstance(generated, bool) and generated >= limit:
+            return iter(())
+        series = islice(series, limit)
+    elif end_condition == "on":
+        end_date = parse_date(custom.get("endDate"))
+        if end_date is not None:
+            series = takewhile(lambda occurrence: occurrence <= end_date, series)
+    return dropwhile(lambda occurrence: occurrence < not_before, series)
+
+
+def tasks_fingerprint(tasks: Any) -> str:
+    """Digest of the recurring tasks, changing whenever any task does."""
+    encoded = json.dumps(tasks, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def occurrences_between(
+    tasks: List[Any], start: date, end: date
+) -> Iterator[Dict[str, Any]]:
+    """Occurrences of all ``tasks`` due from ``start`` to ``end`` inclusive,
+    in date order."""
+    def task_occurrences(position: int, task: Dict[str, Any]) -> Iterator[Tuple[date, int]]:
+        for due in occurrences(task, start):
+            if due > end:
+                return
+            yield due, position
+
+    payloads = {}
+    streams = []
+    for position, task in enumerate(tasks):
+        if not isinstance(task, dict):
+            continue
+        lead = task.get("startBeforeDue")
+        if not isinstance(lead, int) or isinstance(lead, bool) or lead < 0:
+            lead = 0
+        payloads[position] = (
+            {
+                "task_id": task.get("id"),
+                "name": task.get("name"),
+                "rank": task.get("rank"),
+                "xpReward": task.get("xpReward"),
+                "isImportant": bool(task.get("isImportant")),
+            },
+            timedelta(days=lead),
+        )
+        streams.append(task_occurrences(position, task))
+
+    # (date, position) tuples order by date, then task, without a key function
+    for due, position in heapq.merge(*streams):
+        payload, lead = payloads[position]
+        yield {
+            **payload,
+            "dueDate": due.isoformat(),
+            # When the occurrence is added to the quest log
+            "startDate": (due - min(lead, due - date.min)).isoformat(),
+        }
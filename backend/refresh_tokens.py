@@ -0,0 +1,100 @@
+"""Refresh tokens, stored server-side and rotated on every use.
+
+A refresh token is an opaque random string. Only its SHA-256 digest is
+stored, in ``refresh_tokens``, so the collection cannot be replayed.
+Redeeming a token marks it used and issues its successor in the same
+family. Presenting a used token again means it leaked, and then the whole
+family is revoked. The one exception is a second use within
+``REUSE_GRACE_SECONDS``, the usual sign of two tabs refreshing at once,
+which is refused without revoking anything. A TTL index on ``expires_at``
+removes expired tokens.
+"""
+import hashlib
+import os
+import secrets
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, NamedTuple, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+REUSE_GRACE_SECONDS = 10
+
+
+class RefreshTokenReused(Exception):
+    """A rotated-out refresh token was presented again."""
+
+    def __init__(self, user_id: str):
+        super().__init__("Refresh token reused")
+        self.user_id = user_id
+
+
+class Redeemed(NamedTuple):
+    user_id: str
+    family: str
+
+
+def _digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class RefreshTokenStore:
+    """Issues, rotates and revokes refresh tokens."""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.refresh_tokens
+
+    async def issue(self, user_id: str, family: Optional[str] = None) -> str:
+        """A new refresh token for ``user_id``, starting a family unless given one."""
+        token = secrets.token_urlsafe(32)
+        now = datetime.utcnow()
+        await self.collection.insert_one({
+            "token_hash": _digest(token),
+            "user_id": user_id,
+            "family": family or uuid.uuid4().hex,
+            "created_at": now,
+            "expires_at": now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+            "used_at": None,
+            "revoked": False,
+        })
+        return token
+
+    async def redeem(self, token: str) -> Optional[Redeemed]:
+        """Mark ``token`` used and return whose it was.
+
+        Returns None for unknown, expired or revoked tokens. Raises
+        ``RefreshTokenReused`` after revoking the family when a used token
+        comes back.
+        """
+        now = datetime.utcnow()
+        digest = _digest(token)
+        document = await self.collection.find_one_and_update(
+            {"token_hash": digest, "used_at": None, "revoked": False, "expires_at": {"$gt": now}},
+            {"$set": {"used_at": now}},
+            projection={"_id": 0, "user_id": 1, "family": 1},
+        )
+        if document is not None:
+            return Redeemed(document["user_id"], document["family"])
+        existing: Optional[Dict[str, Any]] = await self.collection.find_one(
+            {"token_hash": digest}, {"_id": 0, "user_id": 1, "family": 1, "used_at": 1, "revoked": 1}
+        )
+        if existing is None or existing["used_at"] is None or existing["revoked"]:
+            return None
+        if now - existing["used_at"] <= timedelta(seconds=REUSE_GRACE_SECONDS):
+            return None
+        await self.collection.update_many({"family": existing["family"]}, {"$set": {"revoked": True}})
+        raise RefreshTokenReused(existing["user_id"])
+
+    async def revoke(self, token: str) -> Optional[str]:
+        """Revoke the family ``token`` belongs to; returns its user id."""
+        existing = await self.collection.find_one(
+            {"token_hash": _digest(token)}, {"_id": 0, "user_id": 1, "family": 1}
+        )
+        if existing is None:
+            return None
+        await self.collection.update_many({"family": existing["family"]}, {"$set": {"revoked": True}})
+        return existing["user_id"]
+
+    async def revoke_user(self, user_id: str) -> None:
+        await self.collection.update_many({"user_id": user_id}, {"$set": {"revoked": True}})
@@ -1,24 +1,73 @@
-from fastapi import FastAPI, APIRouter, HTTPException, status, Depends
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import (
+    FastAPI, APIRouter, HTTPException, status, Depends, Header, Query, Request, Response, WebSocket
+)
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
+import re
+import zlib
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 import uuid
-from datetime import datetime, timedelta
+from datetime import date, datetime
 
 # Import authentication modules
 from models import (
     User, UserCreate, UserLogin, UserResponse, UserUpdate, 
-    Token, QuestData, QuestDataCreate, QuestDataUpdate
+    Token, TokenRefresh, RefreshTokenRequest, QuestDataCreate,
+    QuestDataPatchOperation, QuestEventBatch
 )
 from auth import (
-    get_password_hash, authenticate_user, create_access_token,
-    get_current_user, generate_default_avatar, security
+    get_password_hash_async, authenticate_user, create_user_access_token,
+    get_current_user, generate_default_avatar, security, optional_security,
+    hash_pool, require_admin, get_user_profile, get_auth_user, PROFILE_PROJECTION,
+    ACCESS_TOKEN_EXPIRE_MINUTES, CurrentUser, revocations, revoke_access_token, verified_tokens,
+    verify_access_token
+)
+from refresh_tokens import RefreshTokenReused, RefreshTokenStore
+from admission import ADMISSION_STORE_LOCAL, AdmissionController, Throttled, client_address, create_store
+from quest_store import QuestStore, STORAGE_DOCUMENT, entity_ids
+from cache import TTLCache
+from recurrence import occurrences_between, tasks_fingerprint
+from quest_stats import STAT_SECTIONS, QuestStats, summarize
+from write_buffer import QuestWriteBuffer
+from xp_systems import get_current_level, get_level_progress, get_xp_system
+from indexes import INDEX_MODE_CREATE, ensure_indexes
+from achievements import AchievementEngine
+from avatars import AvatarStore, InvalidAvatar
+from http_compression import DecompressingRoute, encoded_json_response, json_response
+from json_codec import object_with_raw
+import compression
+from compression import negotiate
+from data_transfer import (
+    COLLECTION_KEYS, DEFAULT_BATCH_SIZE, MAX_BATCH_SIZE, ON_CONFLICT_REPLACE, ON_CONFLICT_SKIP,
+    InvalidImportLine, export_lines, gunzip_chunks, gzip_chunks, import_stream
+)
+from history import (
+    DEFAULT_PAGE_SIZE, HISTORY_VIEWS, MAX_PAGE_SIZE, InvalidCursor, decode_cursor, page_items
+)
+from status_checks import (
+    DEFAULT_PAGE_SIZE as STATUS_PAGE_SIZE, MAX_PAGE_SIZE as STATUS_MAX_PAGE_SIZE, SUMMARY_BUCKETS,
+    UNPAGED_LIMIT as STATUS_UNPAGED_LIMIT, StatusCheckStore, decode_position, filter_query, utc_naive
+)
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, MongoCommandListener, cache_families,
+    register_collector, registry as metrics_registry
+)
+from quest_events import (
+    DEFAULT_PAGE_SIZE as EVENT_PAGE_SIZE, MAX_PAGE_SIZE as EVENT_MAX_PAGE_SIZE, InvalidEvent,
+    QuestEventLog, SequenceConflict, SnapshotBusy
+)
+from sync_hub import CLOSE_POLICY_VIOLATION, CLOSE_TRY_AGAIN_LATER, SyncHub
+from quest_patch import (
+    JsonPatchError, JsonPatchTestFailed, apply_patch, compile_patch, touched_keys
 )
 
 
@@ -27,16 +76,54 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandListener()])
 db = client[os.environ['DB_NAME']]
 users_collection = db.users
 quest_data_collection = db.quest_data
+quest_stats = QuestStats(db)
+achievement_engine = AchievementEngine(db)
+quest_store = QuestStore(
+    db,
+    os.environ.get('QUEST_DATA_STORAGE', STORAGE_DOCUMENT),
+    compression=os.environ.get('QUEST_DATA_COMPRESSION') or None,
+    counters=quest_stats
+)
+avatar_store = AvatarStore(db, os.environ.get('AVATAR_BASE_URL', ''))
+status_check_store = StatusCheckStore(db)
+refresh_token_store = RefreshTokenStore(db)
+# Rate limits in front of register and login, per worker unless ADMISSION_STORE=mongo
+admission = AdmissionController(
+    create_store(os.environ.get('ADMISSION_STORE', ADMISSION_STORE_LOCAL), db)
+)
+quest_event_log = QuestEventLog(db, quest_store)
+# Change notifications to a user's other connections on /api/sync
+sync_hub = SyncHub()
+
+# Optional write-behind buffer for full-state saves (disabled when 0)
+write_buffer = QuestWriteBuffer(
+    quest_store,
+    delay=float(os.environ.get('QUEST_WRITE_BUFFER_MS', '0')) / 1000,
+    max_delay=(
+        float(os.environ['QUEST_WRITE_BUFFER_MAX_MS']) / 1000
+        if 'QUEST_WRITE_BUFFER_MAX_MS' in os.environ else None
+    )
+)
+
+# Expanded calendar windows, keyed by a fingerprint of the recurring tasks
+# so any change to them misses the cache
+MAX_CALENDAR_DAYS = 732
+calendar_cache: TTLCache[list] = TTLCache(
+    max_entries=int(os.environ.get('CALENDAR_CACHE_MAX_ENTRIES', '2000')),
+    ttl=float(os.environ.get('CALENDAR_CACHE_TTL_SECONDS', '600')),
+    max_weight=int(os.environ.get('CALENDAR_CACHE_MAX_OCCURRENCES', '2000000')),
+    weigh=len
+)
 
 # Create the main app without a prefix
 app = FastAPI()
 
-# Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+# Create a router with the /api prefix; request bodies may be compressed
+api_router = APIRouter(prefix="/api", route_class=DecompressingRoute)
 
 
 # Define Models
@@ -57,18 +144,123 @@ async def root():
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
+    await status_check_store.insert(status_obj.dict())
     return status_obj
 
-@api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+def status_check_query(
+    client_name: Optional[str], from_time: Optional[datetime], to_time: Optional[datetime]
+) -> dict:
+    from_time, to_time = utc_naive(from_time), utc_naive(to_time)
+    if from_time is not None and to_time is not None and to_time < from_time:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'to' must not be before 'from'"
+        )
+    return filter_query(client_name, from_time, to_time)
+
+@api_router.get("/status", response_model=dict)
+async def get_status_checks(
+    client_name: Optional[str] = None,
+    from_time: Optional[datetime] = Query(None, alias="from"),
+    to_time: Optional[datetime] = Query(None, alias="to"),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=STATUS_MAX_PAGE_SIZE)
+):
+    """Status checks newest first, optionally for one client and from <= timestamp < to.
+
+    A bare list by default; with ``cursor`` or ``limit`` a page with the
+    cursor of the next one.
+    """
+    query = status_check_query(client_name, from_time, to_time)
+    if cursor is None and limit is None:
+        return StreamingResponse(
+            status_check_store.stream_page(query, None, STATUS_UNPAGED_LIMIT, envelope=False),
+            media_type="application/json"
+        )
+    try:
+        position = decode_position(cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return StreamingResponse(
+        status_check_store.stream_page(query, position, limit or STATUS_PAGE_SIZE),
+        media_type="application/json"
+    )
+
+@api_router.get("/status/summary", response_model=dict)
+async def get_status_summary(
+    bucket: str = Query("hour", pattern=f"^({'|'.join(SUMMARY_BUCKETS)})$"),
+    client_name: Optional[str] = None,
+    from_time: Optional[datetime] = Query(None, alias="from"),
+    to_time: Optional[datetime] = Query(None, alias="to")
+):
+    """Status check counts per client per minute, hour or day (UTC)."""
+    query = status_check_query(client_name, from_time, to_time)
+    return {"bucket": bucket, "counts": await status_check_store.summarize(query, bucket)}
+
+
+# Avatar endpoints
+async def store_profile_picture(profile_picture: Optional[str]) -> Optional[str]:
+    """Move an uploaded picture into the avatar store, returning its URL."""
+    try:
+        return await avatar_store.store_picture(profile_picture)
+    except InvalidAvatar as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@api_router.get("/avatars/{digest}")
+async def get_avatar(digest: str, if_none_match: Optional[str] = Header(None)):
+    # Content-addressed, so a given URL never changes and can be cached forever
+    headers = {
+        "ETag": f'"{digest}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if not re.fullmatch(r"[0-9a-f]{64}", digest):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar not found")
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    avatar = await avatar_store.get(digest)
+    if avatar is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar not found")
+    data, content_type = avatar
+    headers.update({
+        # Uploaded SVGs must never run scripts when opened directly
+        "Content-Security-Policy": "default-src 'none'; style-src 'unsafe-inline'",
+        "X-Content-Type-Options": "nosniff",
+    })
+    return Response(content=data, media_type=content_type, headers=headers)
 
 
 # Authentication endpoints
+async def admit_auth_request(request: Request, account: Optional[str] = None) -> None:
+    """Shed the request with 429 when its address or account is over its rate."""
+    address = client_address(
+        request.client.host if request.client else None, request.headers.get("x-forwarded-for")
+    )
+    try:
+        await admission.admit(address, account)
+    except Throttled as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, please try again later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+async def issue_tokens(user: CurrentUser, family: Optional[str] = None) -> dict:
+    """A fresh access token and the next refresh token of ``family``."""
+    return {
+        "access_token": create_user_access_token(user),
+        "token_type": "bearer",
+        "refresh_token": await refresh_token_store.issue(user.id, family),
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    }
+
+
 @api_router.post("/register", response_model=Token)
-async def register_user(user_data: UserCreate):
+async def register_user(user_data: UserCreate, request: Request):
+    await admit_auth_request(request)
+    
     # Check if user already exists
     existing_email = await users_collection.find_one({"email": user_data.email})
     if existing_email:
@@ -88,9 +280,10 @@ async def register_user(user_data: UserCreate):
     profile_picture = user_data.profile_picture
     if not profile_picture:
         profile_picture = generate_default_avatar(user_data.username)
+    profile_picture = await store_profile_picture(profile_picture)
     
     # Create user (use username as display_name)
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     user = User(
         email=user_data.email,
         username=user_data.username,
@@ -100,21 +293,26 @@ async def register_user(user_data: UserCreate):
     )
     
     # Insert user into database
-    await users_collection.insert_one(user.dict())
-    
-    # Create access token
-    access_token_expires = timedelta(minutes=30 * 24 * 60)  # 30 days
-    access_token = create_access_token(
-        data={"sub": user.id}, expires_delta=access_token_expires
-    )
+    try:
+        await users_collection.insert_one(user.dict())
+    except DuplicateKeyError:
+        # A concurrent registration took the email or username after the
+        # checks above; the unique indexes caught it
+        if await users_collection.find_one({"email": user_data.email}, {"_id": 1}):
+            detail = "Email already registered"
+        else:
+            detail = "Username already taken"
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
     
-    # Return token and user info
+    # Return tokens and user info
+    tokens = await issue_tokens(CurrentUser(user.id, user.is_active, user.username))
     user_response = UserResponse(**user.dict())
-    return Token(access_token=access_token, user=user_response)
+    return Token(**tokens, user=user_response)
 
 
 @api_router.post("/login", response_model=Token)
-async def login_user(user_credentials: UserLogin):
+async def login_user(user_credentials: UserLogin, request: Request):
+    await admit_auth_request(request, user_credentials.email_or_username)
     user = await authenticate_user(
         user_credentials.email_or_username, 
         user_credentials.password, 
@@ -127,23 +325,74 @@ async def login_user(user_credentials: UserLogin):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Create access token
-    access_token_expires = timedelta(minutes=30 * 24 * 60)  # 30 days
-    access_token = create_access_token(
-        data={"sub": user.id}, expires_delta=access_token_expires
+    # Return tokens and user info; the documents are validated once, as the response
+    tokens = await issue_tokens(user)
+    profile = await get_user_profile(user.id, users_collection)
+    return {**tokens, "user": profile}
+
+
+@api_router.post("/token/refresh", response_model=TokenRefresh)
+async def refresh_access_token(request: RefreshTokenRequest):
+    """Exchange a refresh token for a new access token and its successor."""
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid or expired refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
     )
-    
-    # Return token and user info
-    user_response = UserResponse(**user.dict())
-    return Token(access_token=access_token, user=user_response)
+    try:
+        redeemed = await refresh_token_store.redeem(request.refresh_token)
+    except RefreshTokenReused as e:
+        # Whoever replayed it may hold access tokens from the family too
+        revocations.revoke_user(e.user_id)
+        await sync_hub.close_connections(e.user_id)
+        raise invalid
+    if redeemed is None:
+        raise invalid
+    # Refreshing is where deactivation catches up with claim-bearing tokens
+    user = await get_auth_user(redeemed.user_id, users_collection)
+    if user is None or not user.is_active:
+        raise invalid
+    return await issue_tokens(user, redeemed.family)
+
+
+@api_router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout_user(
+    request: Optional[RefreshTokenRequest] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Revoke the presented access token and the refresh token's family."""
+    if credentials is not None:
+        claims = revoke_access_token(credentials.credentials)
+        if claims is not None:
+            await sync_hub.close_connections(claims.user.id, claims.token_id)
+    if request is not None:
+        await refresh_token_store.revoke(request.refresh_token)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@api_router.post("/logout/all", status_code=status.HTTP_204_NO_CONTENT)
+async def logout_everywhere(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """End every session of the user: all refresh tokens and access tokens."""
+    current_user = await get_current_user(credentials)
+    await refresh_token_store.revoke_user(current_user.id)
+    revocations.revoke_user(current_user.id)
+    await sync_hub.close_connections(current_user.id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def read_profile(user_id: str) -> dict:
+    profile = await get_user_profile(user_id, users_collection)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return profile
 
 
 @api_router.get("/me", response_model=UserResponse)
 async def get_current_user_info(
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    user = await get_current_user(credentials, users_collection)
-    return UserResponse(**user.dict())
+    user = await get_current_user(credentials)
+    return await read_profile(user.id)
 
 
 @api_router.put("/me", response_model=UserResponse)
@@ -151,76 +400,606 @@ async def update_current_user(
     user_update: UserUpdate,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials, users_collection)
+    current_user = await get_current_user(credentials)
     
     # Update user data
     update_data = {}
     if user_update.display_name is not None:
         update_data["display_name"] = user_update.display_name
     if user_update.profile_picture is not None:
-        update_data["profile_picture"] = user_update.profile_picture
+        update_data["profile_picture"] = await store_profile_picture(
+            user_update.profile_picture
+        )
     
     if update_data:
         update_data["updated_at"] = datetime.utcnow()
-        await users_collection.update_one(
+        # Update and read back the updated profile in one round trip
+        updated_user_data = await users_collection.find_one_and_update(
             {"id": current_user.id}, 
-            {"$set": update_data}
+            {"$set": update_data},
+            projection=PROFILE_PROJECTION,
+            return_document=ReturnDocument.AFTER
         )
-        
-        # Get updated user
-        updated_user_data = await users_collection.find_one({"id": current_user.id})
-        return UserResponse(**updated_user_data)
+        if updated_user_data is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+        return updated_user_data
     
-    return UserResponse(**current_user.dict())
+    return await read_profile(current_user.id)
 
 
 # Quest data endpoints (user-specific)
+def quest_data_etag(version: int) -> str:
+    """Entity tag for a given quest data version."""
+    return f'"{version}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Check an If-Match / If-None-Match header value against an entity tag."""
+    if header is None:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def quest_data_etag_for(version: int, history_limit: Optional[int]) -> str:
+    """Entity tag for a (possibly history-trimmed) quest data representation."""
+    if history_limit is None:
+        return quest_data_etag(version)
+    return f'"{version}-h{history_limit}"'
+
+
+def check_if_match(if_match: Optional[str], version: Optional[int]) -> None:
+    """Raise 412 when an If-Match precondition does not hold."""
+    if if_match is None:
+        return
+    if version is None or not etag_matches(if_match, quest_data_etag(version)):
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="Quest data has changed since it was last read"
+        )
+
+
 @api_router.post("/quest-data", response_model=dict)
 async def save_quest_data(
     quest_data: QuestDataCreate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    x_sync_connection: Optional[str] = Header(None),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    current_user = await get_current_user(credentials)
+    
+    if write_buffer.enabled:
+        # Acknowledge now; the buffer persists the latest state shortly
+        pending = write_buffer.pending(current_user.id)
+        current_version = (
+            pending[1] if pending else await quest_store.read_version(current_user.id)
+        )
+        check_if_match(if_match, current_version)
+        new_version = write_buffer.submit(
+            current_user.id, quest_data.quest_data, current_version
+        )
+        unlocked = await achievement_engine.record(
+            current_user.id, quest_data.quest_data, [], new_version
+        )
+        await sync_hub.publish(
+            current_user.id, {"type": "quest_data", "version": new_version}, x_sync_connection
+        )
+        response.headers["ETag"] = quest_data_etag(new_version)
+        return {
+            "message": "Quest data saved successfully",
+            "version": new_version,
+            "achievements_unlocked": unlocked
+        }
+    
+    while True:
+        # Check if user already has quest data
+        current_version = await quest_store.read_version(current_user.id)
+        check_if_match(if_match, current_version)
+        
+        new_version = await quest_store.write(
+            current_user.id, quest_data.quest_data, current_version
+        )
+        if new_version is not None:
+            break
+        # Lost the race: without If-Match the last writer still wins, so retry
+        check_if_match(if_match, None)
+    
+    unlocked = await achievement_engine.record(
+        current_user.id, quest_data.quest_data, [], new_version
+    )
+    await sync_hub.publish(
+        current_user.id, {"type": "quest_data", "version": new_version}, x_sync_connection
+    )
+    response.headers["ETag"] = quest_data_etag(new_version)
+    return {
+        "message": "Quest data saved successfully",
+        "version": new_version,
+        "achievements_unlocked": unlocked
+    }
+
+
+@api_router.patch("/quest-data", response_model=dict)
+async def patch_quest_data(
+    operations: List[QuestDataPatchOperation],
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    x_sync_connection: Optional[str] = Header(None),
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials, users_collection)
+    """Apply RFC 6902 operations to the stored quest data.
+
+    Only the top-level keys named by the patch are read, and the write is a
+    targeted update of the changed paths where Mongo can express it.
+    """
+    current_user = await get_current_user(credentials)
+    patch = [operation.dict(by_alias=True, exclude_unset=True) for operation in operations]
+    
+    try:
+        keys = touched_keys(patch)
+    except JsonPatchError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
     
-    # Check if user already has quest data
-    existing_data = await quest_data_collection.find_one({"user_id": current_user.id})
+    if write_buffer.enabled:
+        await write_buffer.flush(current_user.id)
     
-    if existing_data:
-        # Update existing data
-        await quest_data_collection.update_one(
-            {"user_id": current_user.id},
-            {
-                "$set": {
-                    "quest_data": quest_data.quest_data,
-                    "updated_at": datetime.utcnow()
-                }
-            }
+    existing_data = await quest_store.read(current_user.id, keys)
+    if existing_data is None:
+        check_if_match(if_match, None)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No quest data to patch"
         )
+    current, current_version = existing_data
+    check_if_match(if_match, current_version)
+    
+    try:
+        patched = apply_patch(current, patch)
+    except JsonPatchTestFailed as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except JsonPatchError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    if not isinstance(patched, dict):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Quest data must remain a JSON object"
+        )
+    
+    # Guard against a concurrent write between our read and this update
+    if keys is None:
+        new_version = await quest_store.write(current_user.id, patched, current_version)
     else:
-        # Create new quest data
-        quest_data_obj = QuestData(
-            user_id=current_user.id,
-            quest_data=quest_data.quest_data
+        new_version = await quest_store.write_sections(
+            current_user.id,
+            {k: patched[k] for k in keys if k in patched},
+            [k for k in keys if k not in patched],
+            current_version,
+            update=compile_patch(current, patch),
+        )
+    if new_version is None:
+        check_if_match(if_match, None)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Quest data was modified concurrently, please retry"
         )
-        await quest_data_collection.insert_one(quest_data_obj.dict())
     
-    return {"message": "Quest data saved successfully"}
+    if keys is None:
+        unlocked = await achievement_engine.record(current_user.id, patched, [], new_version)
+    else:
+        unlocked = await achievement_engine.record(
+            current_user.id,
+            {k: patched[k] for k in keys if k in patched},
+            [k for k in keys if k not in patched],
+            new_version
+        )
+    # Other devices at current_version can apply the patch instead of refetching
+    await sync_hub.publish(current_user.id, {
+        "type": "quest_data_patch",
+        "base_version": current_version,
+        "version": new_version,
+        "operations": patch
+    }, x_sync_connection)
+    response.headers["ETag"] = quest_data_etag(new_version)
+    return {
+        "message": "Quest data patched successfully",
+        "version": new_version,
+        "achievements_unlocked": unlocked
+    }
 
 
 @api_router.get("/quest-data", response_model=dict)
 async def get_quest_data(
+    history_limit: Optional[int] = Query(None, ge=0, le=MAX_PAGE_SIZE),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials, users_collection)
+    """Return the user's quest state.
+
+    With ``history_limit`` the history sections only hold their newest
+    entries, and ``history`` carries cursors for the paginated history
+    endpoints. Such a trimmed state is for reading only: writing it back
+    with a full-state POST would drop the omitted history.
+    """
+    current_user = await get_current_user(credentials)
+    cache_headers = {"Cache-Control": "private, no-cache"}
+    history_sections = sorted({view.section for view in HISTORY_VIEWS.values()})
+    
+    # Saves still sitting in the write buffer are the latest state
+    quest_data = write_buffer.pending(current_user.id)
+    
+    if quest_data is None and if_none_match is not None:
+        # Cheap version probe so unchanged data never leaves the database
+        current_version = await quest_store.read_version(current_user.id)
+        if current_version is not None:
+            etag = quest_data_etag_for(current_version, history_limit)
+            if etag_matches(if_none_match, etag):
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers={"ETag": etag, **cache_headers}
+                )
+    
+    if quest_data is None and history_limit is None:
+        # A compressed blob is sent without being decoded and re-encoded
+        serialized = await quest_store.read_serialized(current_user.id)
+        if serialized is None:
+            return json_response({"quest_data": None}, accept_encoding, headers=cache_headers)
+        raw, version = serialized
+        etag = quest_data_etag_for(version, history_limit)
+        if etag_matches(if_none_match, etag):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED,
+                headers={"ETag": etag, **cache_headers}
+            )
+        return encoded_json_response(
+            object_with_raw("quest_data", raw), accept_encoding, headers={"ETag": etag, **cache_headers}
+        )
     
     # Get user's quest data
-    quest_data = await quest_data_collection.find_one({"user_id": current_user.id})
+    if quest_data is None:
+        quest_data = await quest_store.read(
+            current_user.id,
+            exclude=history_sections if history_limit is not None else None
+        )
     
     if quest_data:
-        return {"quest_data": quest_data["quest_data"]}
+        state, version = quest_data
+        etag = quest_data_etag_for(version, history_limit)
+        if etag_matches(if_none_match, etag):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED,
+                headers={"ETag": etag, **cache_headers}
+            )
+        payload = {"quest_data": state}
+        if history_limit is not None:
+            state = dict(state)
+            payload = {"quest_data": state, "history": {}}
+            trimmed = set()
+            for name, view in HISTORY_VIEWS.items():
+                items, next_cursor = await read_history_page(
+                    current_user.id, view, None, history_limit
+                )
+                payload["history"][name] = {"next_cursor": next_cursor}
+                if view.section not in trimmed:
+                    # The first view of a section decides which entries are kept,
+                    # in the chronological order the client stores them in
+                    state[view.section] = list(reversed(items))
+                    trimmed.add(view.section)
+        return json_response(payload, accept_encoding, headers={"ETag": etag, **cache_headers})
     else:
         # Return empty data structure for new users
-        return {"quest_data": None}
+        return json_response({"quest_data": None}, accept_encoding, headers=cache_headers)
+
+
+# Event-sourced quest data: reducer actions appended to a log, see quest_events
+@api_router.post("/quest-events", response_model=dict)
+async def append_quest_events(
+    batch: QuestEventBatch,
+    x_sync_connection: Optional[str] = Header(None),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Append a batch of reducer actions to the user's quest event log.
+
+    Sequence numbers must continue the log. On a 409 the client reads the
+    events after its last acknowledged sequence number, applies them, and
+    renumbers its unsent actions after ``head_seq``.
+    """
+    current_user = await get_current_user(credentials)
+    if write_buffer.enabled:
+        # Snapshots are built on the latest saved state
+        await write_buffer.flush(current_user.id)
+    
+    try:
+        result = await quest_event_log.append(
+            current_user.id, [event.dict() for event in batch.events]
+        )
+    except InvalidEvent as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    except SequenceConflict as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": str(e), "head_seq": e.head_seq}
+        )
+    
+    unlocked = []
+    if result.snapshot is not None:
+        unlocked = await achievement_engine.record(
+            current_user.id, result.snapshot.quest_data, [], result.snapshot.version
+        )
+    await sync_hub.publish(
+        current_user.id,
+        {"type": "quest_events", "head_seq": result.head_seq, "events": result.events},
+        x_sync_connection
+    )
+    return {
+        "head_seq": result.head_seq,
+        # What the server resolved for each action, to reconcile optimistic ids
+        "events": [
+            {name: event[name] for name in ("seq", "key", "at") if name in event}
+            for event in result.events
+        ],
+        "snapshot": (
+            {"seq": result.snapshot.seq, "version": result.snapshot.version}
+            if result.snapshot is not None else None
+        ),
+        "achievements_unlocked": unlocked
+    }
+
+
+@api_router.get("/quest-events", response_model=dict)
+async def get_quest_events(
+    after: Optional[int] = Query(None, ge=0),
+    limit: int = Query(EVENT_PAGE_SIZE, ge=1, le=EVENT_MAX_PAGE_SIZE),
+    accept_encoding: Optional[str] = Header(None),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Return the latest snapshot and the events after it.
+
+    With ``after`` only the events following that sequence number are
+    returned, a page at a time, e.g. to catch up or to replay history.
+    """
+    current_user = await get_current_user(credentials)
+    
+    if after is not None:
+        events = await quest_event_log.read_events(current_user.id, after, limit + 1)
+        next_after = events[limit - 1]["seq"] if len(events) > limit else None
+        return json_response(
+            {"events": events[:limit], "next_after": next_after}, accept_encoding
+        )
+    
+    if write_buffer.enabled:
+        await write_buffer.flush(current_user.id)
+    try:
+        snapshot_seq, snapshot, tail = await quest_event_log.read(current_user.id)
+    except SnapshotBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "1"}
+        )
+    quest_data, version = snapshot if snapshot is not None else (None, None)
+    return json_response({
+        "snapshot": {"seq": snapshot_seq, "version": version, "quest_data": quest_data},
+        "events": tail,
+        "head_seq": tail[-1]["seq"] if tail else snapshot_seq
+    }, accept_encoding)
+
+
+@api_router.websocket("/sync")
+async def sync_socket(websocket: WebSocket, token: Optional[str] = None):
+    """Push the user's quest data changes made from other connections.
+
+    Browsers cannot set headers on a WebSocket, so the access token comes
+    in the ``token`` query parameter. The socket is closed when that token
+    expires or is revoked, and the client reconnects with a fresh one.
+    """
+    try:
+        claims = verify_access_token(token or "")
+    except HTTPException:
+        await websocket.close(code=CLOSE_POLICY_VIOLATION)
+        return
+    connection = sync_hub.connect(claims.user.id, claims.token_id, claims.expires_at)
+    if connection is None:
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+        return
+    try:
+        await websocket.accept()
+        await sync_hub.serve(connection, websocket)
+    finally:
+        sync_hub.disconnect(connection)
+
+
+async def read_history_page(user_id: str, view, cursor, limit: int):
+    pending = write_buffer.pending(user_id)
+    if pending is not None:
+        items = pending[0].get(view.section)
+        items = items if isinstance(items, list) else []
+        return page_items(items, entity_ids(items), view.field, cursor, limit)
+    page = await quest_store.read_history(user_id, view, cursor, limit)
+    return page if page is not None else ([], None)
+
+
+async def list_history(
+    view_name: str, cursor: Optional[str], limit: int, credentials: HTTPAuthorizationCredentials
+) -> dict:
+    current_user = await get_current_user(credentials)
+    try:
+        position = decode_cursor(cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    items, next_cursor = await read_history_page(
+        current_user.id, HISTORY_VIEWS[view_name], position, limit
+    )
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@api_router.get("/quests/completed", response_model=dict)
+async def get_completed_quests(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Completed quests, newest first by dateCompleted."""
+    return await list_history("completed_quests", cursor, limit, credentials)
+
+
+@api_router.get("/rewards/claimed", response_model=dict)
+async def get_claimed_rewards(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Claimed rewards, newest first by dateClaimed."""
+    return await list_history("claimed_rewards", cursor, limit, credentials)
+
+
+@api_router.get("/inventory/used", response_model=dict)
+async def get_used_inventory_items(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Inventory usage history, newest first by dateUsed."""
+    return await list_history("used_items", cursor, limit, credentials)
+
+@api_router.get("/calendar", response_model=dict)
+async def get_calendar(
+    from_date: date = Query(..., alias="from"),
+    to_date: date = Query(..., alias="to"),
+    accept_encoding: Optional[str] = Header(None),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Occurrences of the user's active recurring tasks due in [from, to]."""
+    current_user = await get_current_user(credentials)
+    if to_date < from_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'to' must not be before 'from'"
+        )
+    if (to_date - from_date).days >= MAX_CALENDAR_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Calendar range must be shorter than {MAX_CALENDAR_DAYS} days"
+        )
+    
+    quest_data = write_buffer.pending(current_user.id)
+    if quest_data is None:
+        quest_data = await quest_store.read(current_user.id, ["recurringTasks"])
+    tasks = quest_data[0].get("recurringTasks") if quest_data else None
+    if not isinstance(tasks, list):
+        tasks = []
+    
+    key = (current_user.id, tasks_fingerprint(tasks), from_date, to_date)
+    occurrences = calendar_cache.get(key)
+    if occurrences is None:
+        occurrences = list(occurrences_between(tasks, from_date, to_date))
+        calendar_cache.set(key, occurrences)
+    return json_response(
+        {"from": from_date.isoformat(), "to": to_date.isoformat(), "occurrences": occurrences},
+        accept_encoding
+    )
+
+
+@api_router.get("/stats", response_model=dict)
+async def get_stats(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Quest and reward statistics from the user's incrementally kept counters."""
+    current_user = await get_current_user(credentials)
+    
+    if write_buffer.enabled:
+        await write_buffer.flush(current_user.id)
+    
+    counters = await quest_stats.get(current_user.id)
+    if counters is None:
+        # Saved before statistics were kept: count once, then keep up to date
+        existing_data = await quest_store.read(current_user.id, list(STAT_SECTIONS))
+        if existing_data is not None:
+            state, version = existing_data
+            await quest_stats.record(current_user.id, state, [], version, replace=True)
+            counters = await quest_stats.get(current_user.id)
+    stats = summarize(counters)
+    
+    # Level from the small xp/settings sections only
+    existing_data = await quest_store.read(current_user.id, ["xp", "settings"])
+    state = existing_data[0] if existing_data else {}
+    xp = state.get("xp") if isinstance(state.get("xp"), dict) else {}
+    settings = state.get("settings") if isinstance(state.get("settings"), dict) else {}
+    total_earned = xp.get("totalEarned", 0)
+    if not isinstance(total_earned, (int, float)):
+        total_earned = 0
+    xp_system = get_xp_system(settings.get("xpSystem"))
+    stats["level"] = {
+        "xp_system": xp_system.id,
+        **get_current_level(total_earned, xp_system),
+        **get_level_progress(total_earned, xp_system),
+    }
+    return stats
+
+
+@api_router.get("/achievements", response_model=dict)
+async def get_achievements(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Achievements unlocked by the user's saves, with their unlock dates."""
+    current_user = await get_current_user(credentials)
+    unlocked = await achievement_engine.unlocked(current_user.id)
+    return {
+        "achievements": [
+            {"id": achievement_id, "unlocked": True, "dateUnlocked": date_unlocked or None}
+            for achievement_id, date_unlocked in unlocked.items()
+        ]
+    }
+
+
+@api_router.get("/admin/export", dependencies=[Depends(require_admin)])
+async def export_data(
+    collections: Optional[str] = None,
+    batch_size: int = Query(DEFAULT_BATCH_SIZE, ge=1, le=MAX_BATCH_SIZE),
+    accept_encoding: Optional[str] = Header(None)
+):
+    """Stream users, quest data and related collections as NDJSON.
+    
+    ``collections`` is a comma-separated subset; the body is gzipped on the
+    fly when the client accepts gzip.
+    """
+    names = [name.strip() for name in collections.split(",")] if collections else None
+    unknown = [name for name in names or [] if name not in COLLECTION_KEYS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown collections: {', '.join(unknown)}"
+        )
+    chunks = export_lines(db, names, batch_size)
+    headers = {"Vary": "Accept-Encoding"}
+    if negotiate(accept_encoding, ("gzip",)):
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type="application/x-ndjson", headers=headers)
+
+
+@api_router.post("/admin/import", response_model=dict, dependencies=[Depends(require_admin)])
+async def import_data(
+    request: Request,
+    batch_size: int = Query(DEFAULT_BATCH_SIZE, ge=1, le=MAX_BATCH_SIZE),
+    on_conflict: str = Query(ON_CONFLICT_SKIP, pattern=f"^({ON_CONFLICT_SKIP}|{ON_CONFLICT_REPLACE})$")
+):
+    """Bulk-load an NDJSON export, optionally gzip-encoded.
+    
+    Documents whose key already exists are skipped, or replaced with
+    ``on_conflict=replace``. Batches before a malformed line stay applied.
+    """
+    encoding = request.headers.get("content-encoding", "identity").lower()
+    chunks = request.stream()
+    if encoding == "gzip":
+        chunks = gunzip_chunks(chunks)
+    elif encoding != "identity":
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Unsupported encoding: {encoding!r}"
+        )
+    try:
+        result = await import_stream(db, chunks, batch_size, on_conflict)
+    except InvalidImportLine as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except zlib.error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Malformed gzip request body")
+    return result
+
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -232,6 +1011,58 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so the timings include every other middleware
+app.add_middleware(MetricsMiddleware)
+
+
+def component_metrics():
+    """Stats kept by the caches, the hash pool, the write buffer and compression."""
+    yield from cache_families(
+        {"calendar": calendar_cache, "access_token": verified_tokens}
+    )
+    yield (
+        "access_token_revocations", "gauge", "Revoked access tokens and users held until expiry",
+        [("", {}, len(revocations))],
+    )
+    yield (
+        "password_hash_pending", "gauge", "Hash operations running or queued",
+        [("", {}, hash_pool.pending)],
+    )
+    yield (
+        "password_hash_rejected_total", "counter", "Hash operations shed by the pool, by cause",
+        [("", {"cause": cause}, count) for cause, count in hash_pool.rejected.items()],
+    )
+    yield (
+        "quest_write_buffer_events_total", "counter", "Write-behind buffer events",
+        [("", {"event": event}, count) for event, count in write_buffer.stats.items()],
+    )
+    entries = [(key.split(":", 1), entry) for key, entry in compression.stats.items()]
+    for field, help in (
+        ("calls", "Compression calls"),
+        ("bytes_in", "Bytes fed to the codec"),
+        ("bytes_out", "Bytes produced by the codec"),
+        ("cpu_seconds", "CPU time spent in the codec"),
+    ):
+        yield (
+            f"compression_{field}_total", "counter", help,
+            [("", {"operation": operation, "encoding": encoding}, entry[field])
+             for (operation, encoding), entry in entries],
+        )
+    yield (
+        "compression_ratio", "gauge", "Uncompressed over compressed bytes across all compress calls",
+        [("", {"encoding": encoding}, ratio) for encoding, ratio in compression.compression_ratios().items()],
+    )
+
+
+register_collector(component_metrics)
+register_collector(sync_hub.families)
+register_collector(admission.families)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
 
 # Configure logging
 logging.basicConfig(
@@ -240,6 +1071,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def bootstrap_indexes():
+    # Creates missing indexes, or with MONGO_INDEX_MODE=verify refuses to start
+    await ensure_indexes(
+        db,
+        os.environ.get('MONGO_INDEX_MODE', INDEX_MODE_CREATE),
+        normalized=quest_store.normalized
+    )
+
+@app.on_event("startup")
+async def start_sync_hub():
+    await sync_hub.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await sync_hub.stop()
+    await write_buffer.flush_all()
+    hash_pool.shutdown()
     client.close()
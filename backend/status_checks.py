@@ -0,0 +1,158 @@
+"""Status check storage with bounded retention, cursor pages and summaries.
+
+Status checks are pings written by clients and only ever read back in
+bulk, so ``status_checks`` keeps them for ``STATUS_CHECK_RETENTION_DAYS``
+and a TTL index on ``timestamp`` lets MongoDB expire older ones. Listings
+are newest first, ordered by timestamp and then id, with the same opaque
+cursors as the history views, and are streamed to the client as they are
+read. Without paging parameters a listing is the bare JSON list the
+endpoint has always returned, capped at ``UNPAGED_LIMIT`` rows. Summaries count checks per client per time bucket in an aggregation
+pipeline instead of shipping the raw rows.
+"""
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from history import InvalidCursor, decode_cursor, encode_cursor
+
+RETENTION_SECONDS = int(os.getenv("STATUS_CHECK_RETENTION_DAYS", "30")) * 24 * 60 * 60
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Rows in an unpaged listing
+UNPAGED_LIMIT = 1000
+# Rows are sent to the client this many at a time
+STREAM_CHUNK_ROWS = 100
+
+# Summary bucket -> $dateToString format of the bucket start
+SUMMARY_BUCKETS: Dict[str, str] = {
+    "minute": "%Y-%m-%dT%H:%M:00Z",
+    "hour": "%Y-%m-%dT%H:00:00Z",
+    "day": "%Y-%m-%dT00:00:00Z",
+}
+MAX_SUMMARY_ROWS = 10000
+
+
+def utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """``value`` as a naive UTC datetime, the way timestamps are stored."""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def decode_position(cursor: Optional[str]) -> Optional[Tuple[datetime, str]]:
+    position = decode_cursor(cursor)
+    if position is None:
+        return None
+    try:
+        return datetime.fromisoformat(position[0]), position[1]
+    except ValueError:
+        raise InvalidCursor("Invalid cursor")
+
+
+def filter_query(
+    client_name: Optional[str], start: Optional[datetime], end: Optional[datetime]
+) -> Dict[str, Any]:
+    """Checks from ``client_name`` (any if None) with start <= timestamp < end."""
+    query: Dict[str, Any] = {}
+    if client_name is not None:
+        query["client_name"] = client_name
+    timestamp: Dict[str, Any] = {}
+    if start is not None:
+        timestamp["$gte"] = utc_naive(start)
+    if end is not None:
+        timestamp["$lt"] = utc_naive(end)
+    if timestamp:
+        query["timestamp"] = timestamp
+    return query
+
+
+def _row(document: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": document.get("id"),
+        "client_name": document.get("client_name"),
+        "timestamp": document["timestamp"].isoformat(),
+    }
+
+
+class StatusCheckStore:
+    """Writes status checks and reads them back a page or a summary at a time."""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.status_checks
+
+    async def insert(self, check: Dict[str, Any]) -> None:
+        await self.collection.insert_one(dict(check))
+
+    async def stream_page(
+        self,
+        query: Dict[str, Any],
+        position: Optional[Tuple[datetime, str]],
+        limit: int,
+        envelope: bool = True,
+    ) -> AsyncIterator[bytes]:
+        """A ``{"items": [...], "next_cursor": ...}`` page as JSON chunks,
+        or without ``envelope`` just the items list.
+
+        The page is encoded while the cursor is read; ``next_cursor`` comes
+        last because it is only known once the page is exhausted.
+        """
+        if position is not None:
+            timestamp, check_id = position
+            query = {"$and": [query, {"$or": [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "id": {"$lt": check_id}},
+            ]}]}
+        documents = (
+            self.collection.find(query, {"_id": 0})
+            .sort([("timestamp", -1), ("id", -1)])
+            .limit(limit + 1)
+            .batch_size(min(limit + 1, STREAM_CHUNK_ROWS))
+        )
+        yield b'{"items":[' if envelope else b"["
+        sent = 0
+        last = None
+        has_more = False
+        rows: List[str] = []
+        async for document in documents:
+            if sent == limit:
+                has_more = True
+                break
+            rows.append(json.dumps(_row(document), separators=(",", ":")))
+            last = document
+            sent += 1
+            if len(rows) >= STREAM_CHUNK_ROWS:
+                yield (("," if sent > len(rows) else "") + ",".join(rows)).encode("utf-8")
+                rows = []
+        if rows:
+            yield (("," if sent > len(rows) else "") + ",".join(rows)).encode("utf-8")
+        if not envelope:
+            yield b"]"
+            return
+        next_cursor = (
+            encode_cursor((last["timestamp"].isoformat(), last["id"]))
+            if has_more and last is not None else None
+        )
+        yield ('],"next_cursor":' + json.dumps(next_cursor) + "}").encode("utf-8")
+
+    async def summarize(self, query: Dict[str, Any], bucket: str) -> List[Dict[str, Any]]:
+        """Check counts per client per ``bucket``, oldest bucket first."""
+        pipeline = [
+            {"$match": query},
+            {"$group": {
+                "_id": {
+                    "bucket": {"$dateToString": {"format": SUMMARY_BUCKETS[bucket], "date": "$timestamp"}},
+                    "client_name": "$client_name",
+                },
+                "count": {"$sum": 1},
+            }},
+            {"$sort": {"_id.bucket": 1, "_id.client_name": 1}},
+            {"$limit": MAX_SUMMARY_ROWS},
+        ]
+        return [
+            {"bucket": row["_id"]["bucket"], "client_name": row["_id"]["client_name"], "count": row["count"]}
+            async for row in self.collection.aggregate(pipeline)
+        ]
@@ -0,0 +1,254 @@
+"""Pushes quest data changes to a user's other open connections.
+
+Each authenticated client may hold a WebSocket on /api/sync. After a save,
+patch or event batch the handler publishes a small message to the user's
+channel: the new version, plus the delta when the write was one (JSON
+Patch operations or quest events). Every connection of that user gets the
+message except the one that made the write, named by the
+``X-Sync-Connection`` header. The hub tells each connection its id in the
+``hello`` message.
+
+Fan-out goes through a ``SyncBackend``. ``LocalBackend`` delivers within
+the process and is enough for a single worker. With several workers a
+backend over a shared bus delivers every published message to each
+worker's hub instead. It implements the same three coroutines and the hub
+is unchanged.
+
+Every connection has a bounded outgoing queue. A connection that falls
+``SYNC_QUEUE_SIZE`` messages behind has its queue replaced by a single
+``resync`` message. A client that far behind refetches the quest data
+anyway, so a slow socket never holds more than that many messages. A send
+that stalls past ``SEND_TIMEOUT`` closes the connection. Connections per
+user are capped by ``SYNC_MAX_CONNECTIONS_PER_USER``, counted per worker.
+
+A socket is authenticated once, when it connects, so it is closed when
+the access token it was opened with expires. ``close_connections`` closes
+a user's sockets early, for example after logout or revocation. The
+request goes through the backend, so it reaches every worker.
+"""
+import abc
+import asyncio
+import os
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+import json_codec
+
+MAX_CONNECTIONS_PER_USER = int(os.getenv("SYNC_MAX_CONNECTIONS_PER_USER", "5"))
+QUEUE_SIZE = int(os.getenv("SYNC_QUEUE_SIZE", "32"))
+# Idle connections get an application-level ping this often, so dead
+# peers and proxies with idle timeouts are noticed
+PING_INTERVAL = float(os.getenv("SYNC_PING_SECONDS", "25"))
+SEND_TIMEOUT = 10.0
+
+# Close codes
+CLOSE_POLICY_VIOLATION = 1008  # bad or missing token
+CLOSE_TRY_AGAIN_LATER = 1013  # too many connections for this user
+CLOSE_SESSION_ENDED = 4001  # token expired or revoked; reconnect with a new one
+
+# Published through the backend to close connections instead of delivered
+_CLOSE = "_close"
+
+Deliver = Callable[[str, Dict[str, Any]], None]
+
+
+class SyncBackend(abc.ABC):
+    """Carries published messages to the hub of every worker."""
+
+    @abc.abstractmethod
+    async def start(self, deliver: Deliver) -> None:
+        """Begin calling ``deliver(user_id, message)`` for every message published."""
+
+    @abc.abstractmethod
+    async def publish(self, user_id: str, message: Dict[str, Any]) -> None:
+        """Hand ``message`` to ``deliver`` in every worker."""
+
+    async def stop(self) -> None:
+        pass
+
+
+class LocalBackend(SyncBackend):
+    """Delivers within this process; enough with a single worker."""
+
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def publish(self, user_id: str, message: Dict[str, Any]) -> None:
+        if self._deliver is not None:
+            self._deliver(user_id, message)
+
+    async def stop(self) -> None:
+        self._deliver = None
+
+
+class Connection:
+    """One subscriber socket's outgoing queue."""
+
+    def __init__(
+        self, user_id: str, queue_size: int, token_id: Optional[str] = None, expires_at: Optional[float] = None
+    ):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        # The access token the socket was opened with, and its expiry (epoch seconds)
+        self.token_id = token_id
+        self.expires_at = expires_at
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(queue_size)
+        self.closed = asyncio.Event()
+
+    def offer(self, message: Dict[str, Any]) -> bool:
+        """Queue ``message``; False if the queue overflowed into a resync."""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+            return False
+
+
+class SyncHub:
+    """Per-user fan-out of change messages to open connections."""
+
+    def __init__(
+        self,
+        backend: Optional[SyncBackend] = None,
+        max_connections_per_user: int = MAX_CONNECTIONS_PER_USER,
+        queue_size: int = QUEUE_SIZE,
+    ):
+        self.backend = backend or LocalBackend()
+        self.max_connections_per_user = max_connections_per_user
+        self.queue_size = queue_size
+        # user id -> connection id -> connection
+        self._connections: Dict[str, Dict[str, Connection]] = {}
+        self._count = 0
+        self.stats = {
+            "published": 0, "delivered": 0, "resyncs": 0, "rejected": 0, "send_timeouts": 0,
+            "expired": 0, "closed": 0,
+        }
+
+    async def start(self) -> None:
+        await self.backend.start(self._deliver)
+
+    async def stop(self) -> None:
+        await self.backend.stop()
+
+    def connection_count(self) -> int:
+        return self._count
+
+    def connect(
+        self, user_id: str, token_id: Optional[str] = None, expires_at: Optional[float] = None
+    ) -> Optional[Connection]:
+        """Register a connection, or return None when the user is at the limit."""
+        connections = self._connections.setdefault(user_id, {})
+        if len(connections) >= self.max_connections_per_user:
+            self.stats["rejected"] += 1
+            return None
+        connection = Connection(user_id, self.queue_size, token_id, expires_at)
+        connections[connection.id] = connection
+        self._count += 1
+        return connection
+
+    def disconnect(self, connection: Connection) -> None:
+        connections = self._connections.get(connection.user_id, {})
+        if connections.pop(connection.id, None) is not None:
+            self._count -= 1
+        if not connections:
+            self._connections.pop(connection.user_id, None)
+
+    async def publish(self, user_id: str, message: Dict[str, Any], origin: Optional[str] = None) -> None:
+        """Send ``message`` to the user's connections other than ``origin``."""
+        if user_id not in self._connections and isinstance(self.backend, LocalBackend):
+            # Nobody is listening anywhere
+            return
+        self.stats["published"] += 1
+        await self.backend.publish(user_id, {**message, "origin": origin})
+
+    async def close_connections(self, user_id: str, token_id: Optional[str] = None) -> None:
+        """Close the user's connections, or only those opened with ``token_id``."""
+        if user_id not in self._connections and isinstance(self.backend, LocalBackend):
+            return
+        await self.backend.publish(user_id, {"type": _CLOSE, "token_id": token_id})
+
+    def _deliver(self, user_id: str, message: Dict[str, Any]) -> None:
+        if message.get("type") == _CLOSE:
+            for connection in list(self._connections.get(user_id, {}).values()):
+                if message.get("token_id") in (None, connection.token_id):
+                    self.stats["closed"] += 1
+                    connection.closed.set()
+            return
+        for connection in list(self._connections.get(user_id, {}).values()):
+            if connection.id == message.get("origin"):
+                continue
+            if connection.offer(message):
+                self.stats["delivered"] += 1
+            else:
+                self.stats["resyncs"] += 1
+
+    async def serve(self, connection: Connection, websocket: WebSocket) -> None:
+        """Pump ``connection``'s queue into an accepted ``websocket`` until it closes.
+
+        Incoming messages are read and ignored; reading is how a disconnect
+        is noticed.
+        """
+        async def drain_incoming():
+            try:
+                while True:
+                    await websocket.receive_text()
+            except (WebSocketDisconnect, RuntimeError):
+                pass
+
+        async def send(message: Dict[str, Any]) -> None:
+            await asyncio.wait_for(websocket.send_text(json_codec.dumps(message).decode("utf-8")), SEND_TIMEOUT)
+
+        async def pump():
+            """Returns when the token expires."""
+            await send({"type": "hello", "connection_id": connection.id})
+            while True:
+                wait = PING_INTERVAL
+                if connection.expires_at is not None:
+                    remaining = connection.expires_at - time.time()
+                    if remaining <= 0:
+                        return
+                    wait = min(wait, remaining)
+                try:
+                    message = await asyncio.wait_for(connection.queue.get(), wait)
+                except asyncio.TimeoutError:
+                    if connection.expires_at is not None and connection.expires_at <= time.time():
+                        return
+                    message = {"type": "ping"}
+                await send(message)
+
+        reader = asyncio.ensure_future(drain_incoming())
+        writer = asyncio.ensure_future(pump())
+        closer = asyncio.ensure_future(connection.closed.wait())
+        try:
+            done, _ = await asyncio.wait((reader, writer, closer), return_when=asyncio.FIRST_COMPLETED)
+            if writer in done and isinstance(writer.exception(), asyncio.TimeoutError):
+                self.stats["send_timeouts"] += 1
+                await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+            elif writer in done and writer.exception() is None:
+                self.stats["expired"] += 1
+                await websocket.close(code=CLOSE_SESSION_ENDED)
+            elif closer in done:
+                await websocket.close(code=CLOSE_SESSION_ENDED)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            reader.cancel()
+            writer.cancel()
+            closer.cancel()
+
+    def families(self) -> Iterable[Any]:
+        """Metric families for the metrics endpoint."""
+        yield "sync_connections", "gauge", "Open sync connections", [("", {}, self.connection_count())]
+        yield (
+            "sync_events_total", "counter", "Sync hub events",
+            [("", {"event": event}, count) for event, count in self.stats.items()],
+        )
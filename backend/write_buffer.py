@@ -0,0 +1,186 @@
+"""Per-user write-behind buffer for full-state quest data saves.
+
+The client saves its whole state after every reducer action, so bursts of
+actions arrive as bursts of full-state POSTs for the same user. The buffer
+acknowledges each save immediately, keeps only the latest state per user
+and writes it to the store once the user has been quiet for ``delay``
+seconds (or at most ``max_delay`` seconds after the first buffered save).
+
+A failed write is retried with exponential backoff. After
+``MAX_FLUSH_ATTEMPTS`` failures in a row the buffered state is dropped and
+logged, since a write the store keeps refusing (say, a document over the
+size limit) will not succeed by retrying.
+"""
+import asyncio
+import logging
+import weakref
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from quest_store import QuestStore
+
+logger = logging.getLogger(__name__)
+
+MAX_FLUSH_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 30.0
+
+
+@dataclass
+class PendingWrite:
+    quest_data: Dict[str, Any]
+    version: int  # version handed out to the client for this state
+    base_version: Optional[int]  # version currently stored, None if no document
+    first_submit: float
+    last_submit: float
+    failures: int = 0  # consecutive failed writes
+    retry_at: Optional[float] = None  # set after a failed write
+
+
+class QuestWriteBuffer:
+    """Coalesces quest data saves per user before they reach the store."""
+
+    def __init__(self, store: QuestStore, delay: float, max_delay: Optional[float] = None):
+        self.store = store
+        self.delay = delay
+        self.max_delay = max_delay if max_delay is not None else delay * 5
+        self._pending: Dict[str, PendingWrite] = {}
+        self._closing = False
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = (
+            weakref.WeakValueDictionary()
+        )
+        self.stats = {
+            "submitted": 0,
+            "coalesced": 0,
+            "flushed": 0,
+            "flush_failures": 0,
+            "overwrites": 0,
+            "dropped": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.delay > 0
+
+    def pending(self, user_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        """The buffered state and version for a user, if any."""
+        entry = self._pending.get(user_id)
+        if entry is None:
+            return None
+        return entry.quest_data, entry.version
+
+    def submit(
+        self, user_id: str, quest_data: Dict[str, Any], current_version: Optional[int]
+    ) -> int:
+        """Buffer a full-state save and return the version it will be stored as.
+
+        ``current_version`` is the latest version the caller knows about,
+        including any buffered one.
+        """
+        now = asyncio.get_running_loop().time()
+        new_version = (current_version or 0) + 1
+        self.stats["submitted"] += 1
+
+        entry = self._pending.get(user_id)
+        if entry is not None:
+            self.stats["coalesced"] += 1
+            entry.quest_data = quest_data
+            entry.version = new_version
+            entry.last_submit = now
+        else:
+            self._pending[user_id] = PendingWrite(
+                quest_data=quest_data,
+                version=new_version,
+                base_version=current_version,
+                first_submit=now,
+                last_submit=now,
+            )
+
+        if user_id not in self._tasks:
+            self._tasks[user_id] = asyncio.create_task(self._flush_later(user_id))
+        return new_version
+
+    async def _flush_later(self, user_id: str) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                entry = self._pending.get(user_id)
+                if entry is None:
+                    return
+                if entry.retry_at is not None:
+                    deadline = entry.retry_at
+                else:
+                    deadline = min(
+                        entry.last_submit + self.delay,
+                        entry.first_submit + self.max_delay,
+                    )
+                wait = deadline - loop.time()
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            await self.flush(user_id)
+        finally:
+            if self._tasks.get(user_id) is asyncio.current_task():
+                del self._tasks[user_id]
+            if user_id in self._pending and user_id not in self._tasks and not self._closing:
+                # More saves arrived while flushing, or the flush failed
+                self._tasks[user_id] = asyncio.create_task(self._flush_later(user_id))
+
+    async def flush(self, user_id: str) -> None:
+        """Write a user's buffered state to the store now."""
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        async with lock:
+            entry = self._pending.get(user_id)
+            if entry is None:
+                return
+            quest_data, version, expected = entry.quest_data, entry.version, entry.base_version
+            try:
+                written = await self.store.write(user_id, quest_data, expected, new_version=version)
+                while written is None:
+                    # Someone else wrote in between; the buffered full-state
+                    # save wins, just like an unconditional POST
+                    self.stats["overwrites"] += 1
+                    expected = await self.store.read_version(user_id)
+                    version = max(version, (expected or 0) + 1)
+                    written = await self.store.write(user_id, quest_data, expected, new_version=version)
+            except Exception:
+                self.stats["flush_failures"] += 1
+                entry.failures += 1
+                if entry.failures >= MAX_FLUSH_ATTEMPTS:
+                    self.stats["dropped"] += 1
+                    del self._pending[user_id]
+                    logger.exception(
+                        "Dropping buffered quest data for user %s after %d failed writes",
+                        user_id, entry.failures,
+                    )
+                    return
+                backoff = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (entry.failures - 1))
+                entry.retry_at = asyncio.get_running_loop().time() + backoff
+                logger.exception(
+                    "Failed to flush buffered quest data for user %s, retrying in %.1fs", user_id, backoff
+                )
+                return
+
+            self.stats["flushed"] += 1
+            if entry.quest_data is quest_data:
+                del self._pending[user_id]
+            else:
+                # Newer saves were buffered while this one was being written
+                entry.base_version = version
+                entry.version = max(entry.version, version + 1)
+                entry.failures = 0
+                entry.retry_at = None
+
+    async def flush_all(self) -> None:
+        """Flush every buffered user, e.g. on shutdown."""
+        self._closing = True
+        await asyncio.gather(*(self.flush(user_id) for user_id in list(self._pending)))
+        for task in list(self._tasks.values()):
+            task.cancel()
+        self._tasks.clear()
+        if self.enabled:
+            logger.info("Quest write buffer flushed: %s", self.stats)
+
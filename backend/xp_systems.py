@@ -0,0 +1,147 @@
+"""XP systems and level math, mirroring ``frontend/src/data/xpSystems.js``.
+
+Keep the tables here in sync with the frontend. Single lookups bisect the
+level thresholds; ``batch_levels`` does the same for many XP totals at once
+with NumPy, e.g. for admin reports or after a user switches XP system.
+"""
+from bisect import bisect_right
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+
+class Rank(NamedTuple):
+    value: str
+    xp: int
+
+
+class XPSystem(NamedTuple):
+    id: str
+    name: str
+    ranks: List[Rank]
+    reward_range: Dict[str, int]
+    monthly_bonus_xp: List[int]  # indexed by level - 1
+    level_thresholds: List[int]  # total XP at which each level starts
+
+
+class LevelTitle(NamedTuple):
+    title: str
+    icon: str
+
+
+XP_SYSTEMS: Dict[str, XPSystem] = {
+    "SIMPLE": XPSystem(
+        "simple",
+        "Simple Starter",
+        [Rank("Easy", 10), Rank("Medium", 20), Rank("Hard", 30), Rank("Extreme", 50)],
+        {"min": 0, "max": 50},
+        [0, 10, 20, 30, 40],
+        [0, 250, 600, 1000, 1500],
+    ),
+    "DEFAULT": XPSystem(
+        "default",
+        "Default",
+        [Rank("Common", 25), Rank("Rare", 50), Rank("Epic", 75), Rank("Legendary", 100)],
+        {"min": 0, "max": 150},
+        [0, 25, 50, 75, 100],
+        [0, 500, 1200, 2000, 3000],
+    ),
+    "CHALLENGER": XPSystem(
+        "challenger",
+        "Heroic Grind",
+        [Rank("Novice", 50), Rank("Skilled", 100), Rank("Veteran", 150), Rank("Elite", 200)],
+        {"min": 50, "max": 400},
+        [0, 40, 80, 120, 160],
+        [0, 750, 1800, 3000, 4500],
+    ),
+    "PRECISION": XPSystem(
+        "precision",
+        "Epic Precision",
+        [Rank("Tier I", 30), Rank("Tier II", 60), Rank("Tier III", 90), Rank("Tier IV", 120)],
+        {"min": 0, "max": 300},
+        [0, 20, 45, 65, 85],
+        [0, 400, 950, 1600, 2400],
+    ),
+    "ULTRA_RPG": XPSystem(
+        "ultra_rpg",
+        "Relaxed Explorer",
+        [Rank("Fledgling", 15), Rank("Adept", 25), Rank("Hero", 40), Rank("Warlord", 60)],
+        {"min": 0, "max": 75},
+        [0, 15, 30, 45, 60],
+        [0, 300, 720, 1200, 1800],
+    ),
+}
+
+LEVEL_TITLES: List[LevelTitle] = [
+    LevelTitle("Wanderer", "🚶"),
+    LevelTitle("Explorer", "🧭"),
+    LevelTitle("Champion", "🏆"),
+    LevelTitle("Legend", "⭐"),
+    LevelTitle("Mythic", "🌟"),
+]
+
+_BY_ID = {system.id: system for system in XP_SYSTEMS.values()}
+
+
+def get_xp_system(system_id: Optional[str]) -> XPSystem:
+    """The XP system with this id, falling back to DEFAULT like the client."""
+    return _BY_ID.get(system_id, XP_SYSTEMS["DEFAULT"])
+
+
+def get_current_level(total_xp: float, system: XPSystem) -> dict:
+    thresholds = system.level_thresholds
+    level = max(1, bisect_right(thresholds, total_xp))
+    return {
+        "level": level,
+        "title": LEVEL_TITLES[level - 1].title,
+        "icon": LEVEL_TITLES[level - 1].icon,
+        "xp_required": thresholds[level - 1],
+        "next_level_xp": thresholds[level] if level < len(thresholds) else None,
+    }
+
+
+def get_level_progress(total_xp: float, system: XPSystem) -> dict:
+    current = get_current_level(total_xp, system)
+    if current["next_level_xp"] is None:
+        return {"progress": 100, "progress_xp": 0, "total_xp_for_next": 0}
+    progress_xp = total_xp - current["xp_required"]
+    total_xp_for_next = current["next_level_xp"] - current["xp_required"]
+    return {
+        "progress": min(100, progress_xp / total_xp_for_next * 100),
+        "progress_xp": progress_xp,
+        "total_xp_for_next": total_xp_for_next,
+    }
+
+
+def monthly_bonus_xp(level: int, system: XPSystem) -> int:
+    return system.monthly_bonus_xp[level - 1]
+
+
+def batch_levels(total_xp: Sequence[float], system: XPSystem) -> Dict[str, np.ndarray]:
+    """Levels and progress for many XP totals at once.
+
+    Returns arrays aligned with ``total_xp``. At the top level
+    ``next_level_xp`` is -1 and progress is 100, as in ``get_level_progress``.
+    """
+    totals = np.asarray(total_xp, dtype=np.float64)
+    thresholds = np.asarray(system.level_thresholds, dtype=np.float64)
+    # Same rule as bisect_right: the number of thresholds <= total
+    level = np.maximum(1, np.searchsorted(thresholds, totals, side="right"))
+    xp_required = thresholds[level - 1]
+    at_top = level >= len(thresholds)
+    next_level_xp = np.where(at_top, -1, thresholds[np.minimum(level, len(thresholds) - 1)])
+    total_xp_for_next = np.where(at_top, 0, next_level_xp - xp_required)
+    progress_xp = np.where(at_top, 0, totals - xp_required)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        progress = np.where(
+            at_top, 100, np.minimum(100, progress_xp / total_xp_for_next * 100)
+        )
+    return {
+        "level": level,
+        "xp_required": xp_required,
+        "next_level_xp": next_level_xp,
+        "progress": progress,
+        "progress_xp": progress_xp,
+        "total_xp_for_next": total_xp_for_next,
+        "monthly_bonus_xp": np.asarray(system.monthly_bonus_xp)[level - 1],
+    }
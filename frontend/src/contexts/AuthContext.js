@@ -3,9 +3,14 @@ import axios from 'axios';
 
 const AuthContext = createContext();
 
+// Shared by concurrent requests that hit an expired access token, since a
+// refresh token can only be redeemed once
+let refreshInFlight = null;
+
 const initialState = {
   user: null,
   token: null,
+  refreshToken: null,
   isAuthenticated: false,
   isLoading: true,
   error: null,
@@ -26,17 +31,26 @@ function authReducer(state, action) {
         ...state,
         user: action.payload.user,
         token: action.payload.access_token,
+        refreshToken: action.payload.refresh_token || state.refreshToken,
         isAuthenticated: true,
         isLoading: false,
         error: null,
         isNewRegistration: action.payload.isNewRegistration || false
       };
     
+    case 'TOKEN_REFRESHED':
+      return {
+        ...state,
+        token: action.payload.access_token,
+        refreshToken: action.payload.refresh_token
+      };
+    
     case 'LOGIN_ERROR':
       return {
         ...state,
         user: null,
         token: null,
+        refreshToken: null,
         isAuthenticated: false,
         isLoading: false,
         error: action.payload
@@ -47,6 +61,7 @@ function authReducer(state, action) {
         ...state,
         user: null,
         token: null,
+        refreshToken: null,
         isAuthenticated: false,
         isLoading: false,
         error: null,
@@ -92,6 +107,58 @@ export function AuthProvider({ children }) {
     }
   }, [state.token]);
   
+  // Access tokens are short-lived: on a 401, redeem the refresh token once
+  // and retry the request with the new access token
+  useEffect(() => {
+    const interceptor = axios.interceptors.response.use(
+      response => response,
+      async error => {
+        const request = error.config;
+        const refreshToken = localStorage.getItem('auth_refresh_token');
+        if (
+          error.response?.status !== 401 || !request || request._retried || !refreshToken ||
+          request.url?.endsWith('/api/token/refresh')
+        ) {
+          return Promise.reject(error);
+        }
+        request._retried = true;
+        try {
+          if (!refreshInFlight) {
+            refreshInFlight = axios
+              .post(`${API_URL}/api/token/refresh`, { refresh_token: refreshToken })
+              .then(response => response.data)
+              .finally(() => { refreshInFlight = null; });
+          }
+          const tokens = await refreshInFlight;
+          localStorage.setItem('auth_token', tokens.access_token);
+          localStorage.setItem('auth_refresh_token', tokens.refresh_token);
+          axios.defaults.headers.common['Authorization'] = `Bearer ${tokens.access_token}`;
+          dispatch({ type: 'TOKEN_REFRESHED', payload: tokens });
+          request.headers['Authorization'] = `Bearer ${tokens.access_token}`;
+          return axios(request);
+        } catch (refreshError) {
+          // Another tab may have redeemed the same refresh token first and
+          // stored its successor; carry on with the tokens it stored
+          const storedRefreshToken = localStorage.getItem('auth_refresh_token');
+          const storedToken = localStorage.getItem('auth_token');
+          if (storedRefreshToken && storedToken && storedRefreshToken !== refreshToken) {
+            const tokens = { access_token: storedToken, refresh_token: storedRefreshToken };
+            axios.defaults.headers.common['Authorization'] = `Bearer ${storedToken}`;
+            dispatch({ type: 'TOKEN_REFRESHED', payload: tokens });
+            request.headers['Authorization'] = `Bearer ${storedToken}`;
+            return axios(request);
+          }
+          localStorage.removeItem('auth_token');
+          localStorage.removeItem('auth_refresh_token');
+          localStorage.removeItem('auth_user');
+          dispatch({ type: 'LOGOUT' });
+          return Promise.reject(error);
+        }
+      }
+    );
+    return () => axios.interceptors.response.eject(interceptor);
+  }, [API_URL]);
+  
   // Load user from localStorage on app start
   useEffect(() => {
     const loadUserFromStorage = async () => {
@@ -109,7 +176,9 @@ export function AuthProvider({ children }) {
             dispatch({
               type: 'LOGIN_SUCCESS',
               payload: {
-                access_token: token,
+                // Read again: a refresh during the /me request may have replaced it
+                access_token: localStorage.getItem('auth_token'),
+                refresh_token: localStorage.getItem('auth_refresh_token'),
                 user: response.data
               }
             });
@@ -123,6 +192,7 @@ export function AuthProvider({ children }) {
         console.error('Failed to load user from storage:', error);
         // Clear invalid tokens
         localStorage.removeItem('auth_token');
+        localStorage.removeItem('auth_refresh_token');
         localStorage.removeItem('auth_user');
         delete axios.defaults.headers.common['Authorization'];
         dispatch({ type: 'SET_LOADING', payload: false });
@@ -137,11 +207,15 @@ export function AuthProvider({ children }) {
     if (state.isAuthenticated && state.user && state.token) {
       localStorage.setItem('auth_token', state.token);
       localStorage.setItem('auth_user', JSON.stringify(state.user));
+      if (state.refreshToken) {
+        localStorage.setItem('auth_refresh_token', state.refreshToken);
+      }
     } else {
       localStorage.removeItem('auth_token');
+      localStorage.removeItem('auth_refresh_token');
       localStorage.removeItem('auth_user');
     }
-  }, [state.isAuthenticated, state.user, state.token]);
+  }, [state.isAuthenticated, state.user, state.token, state.refreshToken]);
   
   const register = async (userData) => {
     try {
@@ -196,7 +270,16 @@ export function AuthProvider({ children }) {
   };
   
   const logout = () => {
+    // Revoke server-side; the local session ends either way
+    axios
+      .post(
+        `${API_URL}/api/logout`,
+        { refresh_token: state.refreshToken || '' },
+        { headers: { Authorization: `Bearer ${state.token}` } }
+      )
+      .catch(() => {});
     localStorage.removeItem('auth_token');
+    localStorage.removeItem('auth_refresh_token');
     localStorage.removeItem('auth_user');
     delete axios.defaults.headers.common['Authorization'];
     dispatch({ type: 'LOGOUT' });
@@ -71,6 +71,8 @@ const RecurringTasks = () => {
     const taskData = {
       ...newTask,
       xpReward,
+      // Fixed start of the series; lastAdded moves as occurrences are added
+      createdAt: new Date().toISOString().split('T')[0],
       lastAdded: new Date().toISOString().split('T')[0],
       // Set appropriate days based on frequency
       days: newTask.frequency === 'Weekends' ? ['Sat', 'Sun'] :
@@ -145,7 +147,11 @@ const RecurringTasks = () => {
     // Update last added date
     dispatch({ 
       type: 'UPDATE_RECURRING_TASK', 
-      payload: { ...task, lastAdded: new Date().toISOString().split('T')[0] }
+      payload: {
+        ...task,
+        lastAdded: new Date().toISOString().split('T')[0],
+        generatedCount: (task.generatedCount || 0) + 1
+      }
     });
     
     toast({
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+
+
+@pytest.fixture
+def db():
+    """A fresh in-memory database."""
+    from mongomock_motor import AsyncMongoMockClient
+
+    return AsyncMongoMockClient()["test_database"]
+
+
+@pytest.fixture(scope="session")
+def server_module():
+    """The app module, backed by an in-memory database."""
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    os.environ.setdefault("AUTH_IP_RATE_PER_MINUTE", "0")
+    os.environ.setdefault("AUTH_ACCOUNT_RATE_PER_MINUTE", "0")
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+    import server
+
+    return server
+
+
+@pytest.fixture(scope="session")
+def client(server_module):
+    # Shutdown stops the hash pool for good, so the app runs once per session
+    from fastapi.testclient import TestClient
+
+    with TestClient(server_module.app) as test_client:
+        yield test_client
+
+
+def register(client, username):
+    """Register ``username`` and return its auth headers."""
+    response = client.post(
+        "/api/register",
+        json={"email": f"{username}@example.com", "username": username, "password": "Password1"},
+    )
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
@@ -0,0 +1,99 @@
+// Regenerates quest_reducer.json from the client reducer:
+//   TZ=UTC node tests/fixtures/quest_reducer.js tests/fixtures/quest_reducer.json
+// questReducer is lifted out of QuestContext.js and run with the clock fixed.
+// Achievement checks are stubbed out; the server does not port them.
+const fs = require('fs');
+const vm = require('vm');
+const src = require('path').join(__dirname, '..', '..', 'frontend', 'src') + '/';
+const strip = (text) => text.replace(/^import .*$/mg, '').replace(/^export /mg, '');
+const ctxText = fs.readFileSync(src + 'contexts/QuestContext.js', 'utf8');
+const start = ctxText.indexOf('function questReducer');
+let depth = 0, end = -1;
+for (let i = ctxText.indexOf('{', start); i < ctxText.length; i++) {
+  if (ctxText[i] === '{') depth++;
+  if (ctxText[i] === '}') { depth--; if (depth === 0) { end = i + 1; break; } }
+}
+const NOW = Date.UTC(2026, 2, 15, 12, 30, 0, 250);
+const code = [
+  strip(fs.readFileSync(src + 'data/mock.js', 'utf8')),
+  strip(fs.readFileSync(src + 'data/xpSystems.js', 'utf8')),
+  strip(fs.readFileSync(src + 'utils/timeUtils.js', 'utf8')),
+  'const checkAchievements = (state) => ({achievements: state.achievements, newlyUnlocked: []});',
+  'const initializeAchievements = () => [];',
+  `const RealDate = Date; Date = class extends RealDate { constructor(...a) { if (a.length) super(...a); else super(${NOW}); } static now() { return ${NOW}; } };`,
+  ctxText.slice(start, end),
+  'this.questReducer = questReducer; this.mockRewards = mockRewards;',
+].join('\n');
+const sandbox = {};
+vm.createContext(sandbox);
+vm.runInContext(code, sandbox);
+
+const clone = (v) => JSON.parse(JSON.stringify(v));
+const base = {
+  xp: { currentXP: 60, totalEarned: 640, totalSpent: 580, completedQuests: 4, lastMonthlyBonus: '2026-02-01T09:00:00.000Z' },
+  quests: [
+    { id: 'q1', title: 'Write report', rank: 'Rare', xpReward: 50, progressStatus: 'in_progress', isImportant: true },
+    { id: 'q2', title: 'Water plants', rank: 'Common', xpReward: 25, progressStatus: 'not_started', isImportant: false },
+  ],
+  completedQuests: [
+    { id: 'c1', title: 'Old task', rank: 'Common', xpReward: 25, xpEarned: 25, dateCompleted: '2026-03-01T10:00:00.000Z' },
+  ],
+  rewards: clone(sandbox.mockRewards),
+  inventory: [
+    { id: 'inv_1', rewardId: '1', rewardName: '🎮 Gaming Session', dateClaimed: '2026-03-10T10:00:00.000Z', xpCost: 50, description: 'Enjoy 1 hour of your favorite game' },
+  ],
+  claimedRewards: [
+    { id: 'claimed_1', rewardName: '🍿 Movie Night', xpCost: 75, dateClaimed: '2026-03-02T19:00:00.000Z', dateUsed: '2026-03-02T20:00:00.000Z' },
+  ],
+  settings: {
+    xpSystem: 'default',
+    autoCleanup: { enabled: true, frequency: '1month', recurringOnly: false, keepImportant: true, includeRewards: false },
+    notifications: { levelUp: true, questDue: true, rewardClaimed: true },
+    calendarView: { enabled: true, defaultView: 'month' },
+  },
+  recurringTasks: [
+    { id: 'r1', name: 'Daily Exercise', rank: 'Common', frequency: 'Daily', days: ['Mon'], status: 'Active', lastAdded: '2026-03-14', xpReward: 25, isImportant: false, startBeforeDue: 0, customFrequency: null, yearlyDate: null },
+  ],
+  achievements: [],
+  notifications: [{ id: 'n1', type: 'level_up', message: 'Level up', timestamp: '2026-03-14T08:00:00.000Z' }],
+};
+const cases = [
+  ['add_quest', [{ type: 'ADD_QUEST', payload: { title: 'New quest', rank: 'Epic', xpReward: 75 } }]],
+  ['add_quest_with_status', [{ type: 'ADD_QUEST', payload: { title: 'Started', xpReward: 10, progressStatus: 'in_progress' } }]],
+  ['update_quest', [{ type: 'UPDATE_QUEST', payload: { id: 'q2', title: 'Water all plants', xpReward: 30 } }]],
+  ['update_quest_progress', [{ type: 'UPDATE_QUEST_PROGRESS', payload: { id: 'q2', progressStatus: 'in_progress', title: 'ignored' } }]],
+  ['delete_quest', [{ type: 'DELETE_QUEST', payload: 'q1' }]],
+  ['complete_quest', [{ type: 'COMPLETE_QUEST', payload: 'q1' }]],
+  ['complete_missing_quest', [{ type: 'COMPLETE_QUEST', payload: 'nope' }]],
+  ['claim_reward', [{ type: 'CLAIM_REWARD', payload: '2' }]],
+  ['claim_unaffordable_reward', [{ type: 'CLAIM_REWARD', payload: '6' }]],
+  ['use_inventory_item', [{ type: 'USE_INVENTORY_ITEM', payload: 'inv_1' }]],
+  ['add_reward', [{ type: 'ADD_REWARD', payload: { name: 'Nap', cost: 15, description: 'Short nap' } }]],
+  ['update_reward', [{ type: 'UPDATE_REWARD', payload: { id: '1', cost: 5 } }]],
+  ['delete_reward', [{ type: 'DELETE_REWARD', payload: '2' }]],
+  ['add_recurring_task', [{ type: 'ADD_RECURRING_TASK', payload: { name: 'Stretch', frequency: 'Daily', xpReward: 10 } }]],
+  ['update_recurring_task', [{ type: 'UPDATE_RECURRING_TASK', payload: { id: 'r1', status: 'Inactive' } }]],
+  ['delete_recurring_task', [{ type: 'DELETE_RECURRING_TASK', payload: 'r1' }]],
+  ['update_settings', [{ type: 'UPDATE_SETTINGS', payload: { calendarView: { enabled: false, defaultView: 'week' } } }]],
+  ['change_xp_system', [{ type: 'CHANGE_XP_SYSTEM', payload: 'simple' }]],
+  ['apply_monthly_bonus', [{ type: 'APPLY_MONTHLY_BONUS' }]],
+  ['reset_everything', [
+    { type: 'UPDATE_REWARD', payload: { id: '1', cost: 5 } },
+    { type: 'DELETE_REWARD', payload: '2' },
+    { type: 'RESET_EVERYTHING' },
+  ]],
+  ['reset_everything_keeping_rewards', [{ type: 'RESET_EVERYTHING', payload: { eraseRewards: false, resetXPSystem: true } }]],
+  ['load_state', [{ type: 'LOAD_STATE', payload: { xp: { currentXP: 1, totalEarned: 1, totalSpent: 0, completedQuests: 0 }, quests: [], notifications: [] } }]],
+  ['dismiss_notification', [{ type: 'DISMISS_NOTIFICATION', payload: 'n1' }]],
+];
+const keyFor = { ADD_QUEST: String(NOW), ADD_REWARD: String(NOW), ADD_RECURRING_TASK: String(NOW), CLAIM_REWARD: `inv_${NOW}`, USE_INVENTORY_ITEM: `claimed_${NOW}` };
+const out = { at: new Date(NOW).toISOString(), initial: base, cases: {} };
+for (const [name, actions] of cases) {
+  let state = clone(base);
+  for (const action of actions) state = sandbox.questReducer(state, clone(action));
+  out.cases[name] = {
+    events: actions.map((a, i) => ({ seq: i + 1, type: a.type, payload: a.payload === undefined ? null : a.payload, ...(keyFor[a.type] ? { key: keyFor[a.type] } : {}) })),
+    expected: JSON.parse(JSON.stringify(state)),
+  };
+}
+fs.writeFileSync(process.argv[2], JSON.stringify(out, null, 1) + '\n');
@@ -0,0 +1,65 @@
+from achievements import (
+    ITEM_USED, QUEST_COMPLETED, XP_CHANGED, derive_events, empty_progress, evaluate,
+)
+
+
+def quest(n, day=None, **fields):
+    return {"id": f"q{n}", "dateCompleted": f"2025-01-{day or n:02d}T10:00:00Z", **fields}
+
+
+def replay(saves):
+    """Progress and unlocks after feeding ``saves`` through one progress document."""
+    progress, unlocked, unlocks = empty_progress(), {}, []
+    for sections, removed in saves:
+        events = derive_events(progress, sections, removed)
+        unlocks.append([a["id"] for a in evaluate(progress, unlocked, events, "now")])
+    return progress, unlocked, unlocks
+
+
+def test_appends_emit_only_the_new_entries():
+    progress = empty_progress()
+    assert len(derive_events(progress, {"completedQuests": [quest(1), quest(2)]}, [])) == 2
+    events = derive_events(progress, {"completedQuests": [quest(1), quest(2), quest(3)]}, [])
+    assert [(e.type, e.data["id"]) for e in events] == [(QUEST_COMPLETED, "q3")]
+    assert derive_events(progress, {"completedQuests": [quest(1), quest(2), quest(3)]}, []) == []
+
+
+def test_rewritten_history_recounts_from_scratch():
+    history = [quest(n, day=1, isImportant=True) for n in range(1, 5)]
+    rewritten = [quest(1, day=1), quest(9, day=2)]
+    progress, unlocked, unlocks = replay([
+        ({"completedQuests": history}, []),
+        ({"completedQuests": rewritten}, []),
+    ])
+    fresh, _, _ = replay([({"completedQuests": rewritten}, [])])
+    assert progress == fresh
+    assert progress["counters"]["completed"] == 2 and progress["counters"]["important"] == 0
+    # Unlocks earned before the rewrite are kept and not reported again
+    assert "speed_runner" in unlocks[0] and unlocks[1] == []
+    assert "speed_runner" in unlocked
+
+
+def test_an_edit_before_the_tail_is_not_taken_for_an_append():
+    progress = empty_progress()
+    derive_events(progress, {"completedQuests": [quest(1), quest(2)]}, [])
+    events = derive_events(progress, {"completedQuests": [quest(1), quest(7), quest(3)]}, [])
+    assert [e.data["id"] for e in events] == ["q1", "q7", "q3"]
+    assert progress["counters"]["completed"] == 0  # reset; evaluate() recounts
+
+
+def test_removing_the_history_resets_it():
+    progress, _, _ = replay([({"completedQuests": [quest(1), quest(2)]}, []), ({}, ["completedQuests"])])
+    assert progress["counters"] == empty_progress()["counters"]
+    assert progress["seen"]["completed"] == {"count": 0, "tail_id": None}
+    _, _, unlocks = replay([({}, ["completedQuests"]), ({"completedQuests": [quest(5)]}, [])])
+    assert unlocks[1] == ["first_quest"]
+
+
+def test_rewritten_claims_and_xp():
+    progress = empty_progress()
+    claims = [{"id": "r1"}, {"id": "r2"}]
+    assert [e.type for e in derive_events(progress, {"claimedRewards": claims}, [])] == [ITEM_USED] * 2
+    assert len(derive_events(progress, {"claimedRewards": [{"id": "r3"}]}, [])) == 1
+    events = derive_events(progress, {"xp": {"totalEarned": 1300, "totalSpent": 0}}, [])
+    assert [(e.type, e.data["level"]) for e in events] == [(XP_CHANGED, 3)]
+    assert derive_events(progress, {"xp": {"totalEarned": 1300, "totalSpent": 0}}, []) == []
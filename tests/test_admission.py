@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from admission import (
+    AdmissionController, BucketLimit, BucketStore, LocalBucketStore, MongoBucketStore, Throttled, client_address,
+)
+from hashing import HashPool, HashPoolSaturated
+
+
+def test_bucket_stores_must_implement_take():
+    with pytest.raises(TypeError):
+        BucketStore()
+
+
+@pytest.mark.parametrize("make_store", [lambda db: LocalBucketStore(), MongoBucketStore], ids=["local", "mongo"])
+def test_bucket_spends_its_burst_then_refills_at_rate(db, make_store):
+    store = make_store(db)
+    limit = BucketLimit(rate=2.0, burst=3)
+
+    async def scenario():
+        assert [await store.take("k", limit, 100.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+        assert await store.take("k", limit, 100.0) == pytest.approx(0.5)
+        assert await store.take("k", limit, 100.25) == pytest.approx(0.25)
+        assert await store.take("k", limit, 100.5) == 0.0
+        # Idle time refills no further than the burst
+        assert [await store.take("k", limit, 1000.0) for _ in range(4)][-1] > 0
+        assert await store.take("other", limit, 100.0) == 0.0
+
+    asyncio.run(scenario())
+
+
+def test_local_store_drops_the_least_recently_used_bucket():
+    store = LocalBucketStore(max_keys=2)
+    limit = BucketLimit(rate=1.0, burst=1)
+
+    async def scenario():
+        await store.take("a", limit, 0.0)
+        await store.take("b", limit, 0.0)
+        await store.take("a", limit, 0.0)
+        await store.take("c", limit, 0.0)
+        assert len(store) == 2
+        # "a" was used more recently than "b", so it survived empty
+        assert await store.take("a", limit, 0.0) > 0
+        assert await store.take("b", limit, 0.0) == 0.0
+
+    asyncio.run(scenario())
+
+
+def test_controller_sheds_per_account_regardless_of_case():
+    controller = AdmissionController(ip_limit=BucketLimit(0, 0), account_limit=BucketLimit.per_minute(1, 1))
+
+    async def scenario():
+        await controller.admit("1.2.3.4", "Someone@Example.com")
+        with pytest.raises(Throttled) as shed:
+            await controller.admit("5.6.7.8", " someone@example.com")
+        assert shed.value.reason == "account" and shed.value.retry_after >= 59
+        assert controller.shed == {"ip": 0, "account": 1}
+
+    asyncio.run(scenario())
+
+
+def test_client_address_trusts_only_the_configured_hops():
+    assert client_address("10.0.0.1", "6.6.6.6, 1.2.3.4", hops=0) == "10.0.0.1"
+    assert client_address("10.0.0.1", "6.6.6.6, 1.2.3.4", hops=1) == "1.2.3.4"
+    assert client_address("10.0.0.1", "1.2.3.4", hops=3) == "1.2.3.4"
+    assert client_address(None, None) == "unknown"
+
+
+def test_estimated_wait_counts_only_the_queue_ahead():
+    pool = HashPool(max_workers=2, max_pending=10, max_queue_seconds=1.0)
+    try:
+        pool.mean_seconds = 0.4
+        pool.pending = 1
+        assert pool.estimated_wait() == 0
+        pool.pending = 2
+        assert pool.estimated_wait() == pytest.approx(0.2)
+        pool.pending = 6
+        assert pool.estimated_wait() == pytest.approx(1.0)
+    finally:
+        pool.shutdown()
+
+
+def test_pool_rejects_when_the_wait_is_too_long():
+    pool = HashPool(max_workers=1, max_pending=10, max_queue_seconds=1.0)
+
+    async def scenario():
+        assert await pool.run("hash", lambda x: x * 2, 21) == 42
+        pool.mean_seconds = 0.5
+        pool.pending = 3
+        with pytest.raises(HashPoolSaturated) as shed:
+            await pool.run("hash", lambda: None)
+        assert shed.value.retry_after == 2 and pool.rejected == {"pending": 0, "wait": 1}
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        pool.shutdown()
@@ -0,0 +1,127 @@
+import time
+
+from .conftest import register
+
+
+def _skip_prechecks(monkeypatch, collection, count):
+    """Make the first ``count`` lookups miss, as if another request won a race."""
+    find_one = collection.find_one
+    calls = []
+
+    async def racing_find_one(filter, *args, **kwargs):
+        calls.append(filter)
+        if len(calls) <= count:
+            return None
+        return await find_one(filter, *args, **kwargs)
+
+    monkeypatch.setattr(collection, "find_one", racing_find_one)
+
+
+def test_register_race_on_email_is_rejected(client, server_module, monkeypatch):
+    register(client, "racer1")
+    _skip_prechecks(monkeypatch, server_module.users_collection, 2)
+    response = client.post(
+        "/api/register",
+        json={"email": "racer1@example.com", "username": "racer1b", "password": "Password1"},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Email already registered"
+
+
+def test_register_race_on_username_is_rejected(client, server_module, monkeypatch):
+    register(client, "racer2")
+    _skip_prechecks(monkeypatch, server_module.users_collection, 2)
+    response = client.post(
+        "/api/register",
+        json={"email": "racer2b@example.com", "username": "racer2", "password": "Password1"},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Username already taken"
+
+
+def test_legacy_tokens_without_claims_are_rejected(client):
+    from auth import create_access_token
+
+    user_id = client.get("/api/me", headers=register(client, "legacy1")).json()["id"]
+    legacy = create_access_token({"sub": user_id})
+    response = client.get("/api/me", headers={"Authorization": f"Bearer {legacy}"})
+    assert response.status_code == 401
+
+
+def test_access_tokens_carry_whole_second_issue_times(client):
+    from jose import jwt
+
+    token = register(client, "issued1")["Authorization"].split()[1]
+    assert isinstance(jwt.get_unverified_claims(token)["iat"], int)
+
+
+def test_logout_everywhere_revokes_every_session(client):
+    response = client.post(
+        "/api/register",
+        json={"email": "everywhere@example.com", "username": "everywhere", "password": "Password1"},
+    )
+    first = response.json()
+    second = client.post(
+        "/api/login", json={"email_or_username": "everywhere", "password": "Password1"}
+    ).json()
+    headers = {"Authorization": f"Bearer {second['access_token']}"}
+    assert client.post("/api/logout/all", headers=headers).status_code == 204
+    for tokens in (first, second):
+        me = client.get("/api/me", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+        assert me.status_code == 401
+        refreshed = client.post("/api/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+        assert refreshed.status_code == 401
+
+
+def _session(client, username):
+    response = client.post(
+        "/api/register",
+        json={"email": f"{username}@example.com", "username": username, "password": "Password1"},
+    )
+    return response.json()
+
+
+def _refresh(client, refresh_token):
+    return client.post("/api/token/refresh", json={"refresh_token": refresh_token})
+
+
+def test_refresh_rotates_the_token(client):
+    first = _session(client, "rotate1")
+    second = _refresh(client, first["refresh_token"])
+    assert second.status_code == 200
+    second = second.json()
+    assert second["refresh_token"] != first["refresh_token"]
+    assert client.get("/api/me", headers={"Authorization": f"Bearer {second['access_token']}"}).status_code == 200
+    assert _refresh(client, second["refresh_token"]).status_code == 200
+
+
+def test_a_concurrent_refresh_within_the_grace_period_revokes_nothing(client):
+    first = _session(client, "rotate2")
+    second = _refresh(client, first["refresh_token"]).json()
+    assert _refresh(client, first["refresh_token"]).status_code == 401
+    assert _refresh(client, second["refresh_token"]).status_code == 200
+
+
+def test_reusing_a_rotated_token_revokes_the_user(client, monkeypatch):
+    import refresh_tokens
+
+    monkeypatch.setattr(refresh_tokens, "REUSE_GRACE_SECONDS", 0)
+    first = _session(client, "rotate3")
+    second = _refresh(client, first["refresh_token"]).json()
+    time.sleep(0.01)
+    assert _refresh(client, first["refresh_token"]).status_code == 401
+    # The successor and every access token issued so far stop working
+    assert _refresh(client, second["refresh_token"]).status_code == 401
+    for tokens in (first, second):
+        me = client.get("/api/me", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+        assert me.status_code == 401
+
+
+def test_logout_revokes_the_refresh_family(client):
+    first = _session(client, "rotate4")
+    second = _refresh(client, first["refresh_token"]).json()
+    headers = {"Authorization": f"Bearer {second['access_token']}"}
+    response = client.post("/api/logout", json={"refresh_token": second["refresh_token"]}, headers=headers)
+    assert response.status_code == 204
+    assert _refresh(client, second["refresh_token"]).status_code == 401
+    assert client.get("/api/me", headers=headers).status_code == 401
@@ -0,0 +1,52 @@
+import asyncio
+import gzip
+import zlib
+
+import pytest
+
+import compression
+from compression import PayloadTooLarge, compress, decompress
+from data_transfer import gunzip_chunks
+
+PAYLOAD = b'{"quests": []}' * 500
+
+
+@pytest.mark.parametrize("encoding", compression.available_encodings() + ("zlib",))
+def test_round_trip(encoding):
+    assert decompress(compress(PAYLOAD, encoding), encoding) == PAYLOAD
+
+
+@pytest.mark.parametrize("encoding", compression.available_encodings() + ("zlib",))
+def test_expansion_past_max_size_is_refused(encoding):
+    bomb = compress(b"\0" * (4 * 1024 * 1024), encoding)
+    with pytest.raises(PayloadTooLarge):
+        decompress(bomb, encoding, max_size=64 * 1024)
+
+
+@pytest.mark.parametrize("encoding", [e for e in ("gzip", "zlib", "br") if e in compression.available_encodings() + ("zlib",)])
+def test_truncated_stream_is_rejected(encoding):
+    with pytest.raises(ValueError):
+        decompress(compress(PAYLOAD, encoding)[:-8], encoding)
+
+
+def test_truncated_gzip_stream_is_rejected():
+    async def chunks():
+        yield gzip.compress(PAYLOAD)[:-8]
+
+    async def drain():
+        return [chunk async for chunk in gunzip_chunks(chunks())]
+
+    with pytest.raises(zlib.error):
+        asyncio.run(drain())
+
+
+def test_truncated_request_body_is_a_bad_request(client):
+    body = gzip.compress(b'{"client_name": "probe"}')
+    headers = {"Content-Encoding": "gzip", "Content-Type": "application/json"}
+    assert client.post("/api/status", content=body, headers=headers).status_code == 200
+    assert client.post("/api/status", content=body[:-8], headers=headers).status_code == 400
+
+
+def test_compression_ratios_are_exported(client):
+    compress(PAYLOAD, "gzip")
+    assert 'compression_ratio{encoding="gzip"}' in client.get("/metrics").text
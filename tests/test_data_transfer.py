@@ -0,0 +1,32 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from data_transfer import export_lines, import_stream
+from quest_events import QuestEventLog
+from quest_store import QuestStore
+
+
+def test_quest_event_log_survives_export_and_import(db):
+    async def scenario():
+        log = QuestEventLog(db, QuestStore(db), snapshot_every=2)
+        await log.append("u1", [
+            {"seq": seq, "type": "ADD_QUEST", "payload": {"title": f"q{seq}"}} for seq in (1, 2, 3)
+        ])
+        chunks = [chunk async for chunk in export_lines(db)]
+
+        async def replay():
+            for chunk in chunks:
+                yield chunk
+
+        target = AsyncMongoMockClient()["import_target"]
+        result = await import_stream(target, replay())
+        assert result["collections"]["quest_events"]["inserted"] == 3
+        imported = QuestEventLog(target, QuestStore(target))
+        assert await imported.head_seq("u1") == 3
+        assert await imported.snapshot_seq("u1") == 3
+        # The next batch continues the log instead of conflicting
+        appended = await imported.append("u1", [{"seq": 4, "type": "DELETE_QUEST", "payload": "x"}])
+        assert appended.head_seq == 4
+
+    asyncio.run(scenario())
@@ -0,0 +1,28 @@
+import asyncio
+
+from pymongo import ASCENDING
+
+from indexes import INDEX_MODE_VERIFY, REQUIRED_INDEXES, ensure_indexes, missing_indexes
+
+
+def test_ensure_indexes_on_collections_with_existing_indexes(db):
+    async def scenario():
+        await db.users.insert_one({"id": "u1", "email": "a@x.com", "username": "a"})
+        await db.users.create_index([("email", ASCENDING)], unique=True, name="users_email_unique")
+        created = await ensure_indexes(db)
+        assert "users.users_email_unique" not in created
+        assert "users.users_id_unique" in created
+        assert await missing_indexes(db) == []
+        assert await ensure_indexes(db) == []
+        await ensure_indexes(db, INDEX_MODE_VERIFY)
+
+    asyncio.run(scenario())
+
+
+def test_index_with_different_options_is_missing(db):
+    async def scenario():
+        await db.users.create_index([("email", ASCENDING)], name="email_plain")
+        missing = await missing_indexes(db)
+        assert [spec for spec in REQUIRED_INDEXES if spec.name == "users_email_unique"][0] in missing
+
+    asyncio.run(scenario())
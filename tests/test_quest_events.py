@@ -0,0 +1,220 @@
+"""Quest event log tests.
+
+``fixtures/quest_reducer.json`` holds the output of ``questReducer`` from
+frontend/src/contexts/QuestContext.js for each action, run under Node with
+the clock fixed to the fixture's ``at`` (regenerate with
+``fixtures/quest_reducer.js``). Each event carries the id the client
+generated as its ``key``.
+"""
+import asyncio
+import copy
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from quest_events import (
+    InvalidEvent, QuestEventLog, SequenceConflict, SnapshotBusy, apply_events, resolve
+)
+from quest_store import QuestStore
+
+with open(os.path.join(os.path.dirname(__file__), "fixtures", "quest_reducer.json"), encoding="utf-8") as f:
+    REDUCER_FIXTURES = json.load(f)
+
+# Client state the server reducer does not maintain
+DERIVED_KEYS = ("achievements", "notifications", "lastCompletedQuestId")
+# Actions whose fixture checks notifications, which the client changes in no other way
+NOTIFICATION_CASES = ("dismiss_notification", "load_state")
+
+
+def _resolved(events):
+    now = datetime.utcnow()
+    return [resolve({**event, "at": REDUCER_FIXTURES["at"]}, now) for event in events]
+
+
+def _comparable(state, name):
+    state = copy.deepcopy(state)
+    for key in DERIVED_KEYS:
+        if key != "notifications" or name not in NOTIFICATION_CASES:
+            state.pop(key, None)
+    for used in state.get("claimedRewards", []):
+        # Recorded by the server to recognise replayed claims
+        used.pop("inventoryId", None)
+    return state
+
+
+@pytest.mark.parametrize("name", sorted(REDUCER_FIXTURES["cases"]))
+def test_reducer_matches_the_client(name):
+    case = REDUCER_FIXTURES["cases"][name]
+    state = apply_events(copy.deepcopy(REDUCER_FIXTURES["initial"]), _resolved(case["events"]))
+    assert _comparable(state, name) == _comparable(case["expected"], name)
+
+
+def test_every_action_has_a_fixture():
+    from quest_events import ACTIONS
+
+    covered = {event["type"] for case in REDUCER_FIXTURES["cases"].values() for event in case["events"]}
+    assert covered == set(ACTIONS)
+
+
+@pytest.mark.parametrize("name", sorted(REDUCER_FIXTURES["cases"]))
+def test_replaying_a_tail_already_applied_changes_nothing(name):
+    events = _resolved(REDUCER_FIXTURES["cases"][name]["events"])
+    once = apply_events(copy.deepcopy(REDUCER_FIXTURES["initial"]), events)
+    for start in range(len(events)):
+        again = apply_events(copy.deepcopy(once), events[start:])
+        assert again == once
+
+
+def test_replayed_claim_is_not_charged_twice():
+    claim = _resolved([{"seq": 1, "type": "CLAIM_REWARD", "payload": "2"}])
+    use = _resolved([{"seq": 2, "type": "USE_INVENTORY_ITEM", "payload": claim[0]["key"]}])
+    state = apply_events(copy.deepcopy(REDUCER_FIXTURES["initial"]), claim + use)
+    replayed = apply_events(copy.deepcopy(state), claim + use)
+    assert replayed == state
+    assert state["xp"]["totalSpent"] == REDUCER_FIXTURES["initial"]["xp"]["totalSpent"] + 25
+
+
+def _batch(first, *titles):
+    return [
+        {"seq": first + i, "type": "ADD_QUEST", "payload": {"title": title, "xpReward": 10}}
+        for i, title in enumerate(titles)
+    ]
+
+
+@pytest.fixture
+def log(db):
+    return QuestEventLog(db, QuestStore(db), snapshot_every=1000)
+
+
+def test_read_retries_when_a_compaction_lands_between_head_and_snapshot(log, monkeypatch):
+    async def scenario():
+        await log.append("u1", _batch(1, "a", "b"))
+        read = log.store.read
+        compacted = []
+
+        async def read_racing_compaction(user_id, *args, **kwargs):
+            # Compact once, from the first read; the compaction's own read
+            # goes straight through
+            if not compacted:
+                compacted.append(None)
+                compacted[0] = await log.compact(user_id)
+            return await read(user_id, *args, **kwargs)
+
+        monkeypatch.setattr(log.store, "read", read_racing_compaction)
+        seq, (state, version), tail = await log.read("u1")
+        assert compacted[0] is not None
+        assert seq == 2 and tail == []
+        assert [quest["title"] for quest in state["quests"]] == ["a", "b"]
+
+    asyncio.run(scenario())
+
+
+def test_read_after_a_full_save_returns_the_saved_data_and_the_tail(log):
+    async def scenario():
+        await log.append("u1", _batch(1, "a"))
+        await log.compact("u1")
+        state, version = await log.store.read("u1")
+        await log.store.write("u1", {**state, "quests": []}, version)
+        await log.append("u1", _batch(2, "b"))
+        seq, (state, _), tail = await log.read("u1")
+        assert seq == 1 and state["quests"] == []
+        assert [event["seq"] for event in tail] == [2]
+
+    asyncio.run(scenario())
+
+
+def test_read_gives_up_while_another_worker_compacts(log, monkeypatch):
+    async def scenario():
+        await log.append("u1", _batch(1, "a"))
+        await log.compact("u1")
+        # Another worker is rewriting the snapshot
+        await log.heads.update_one(
+            {"user_id": "u1"}, {"$set": {"compacting_until": datetime.utcnow() + timedelta(seconds=30)}}
+        )
+        state, version = await log.store.read("u1")
+        await log.store.write("u1", state, version)
+        monkeypatch.setattr("quest_events.READ_RETRY_SECONDS", 0)
+        with pytest.raises(SnapshotBusy):
+            await log.read("u1")
+        await log.append("u1", _batch(2, "b"))
+        assert await log.compact("u1") is None
+
+    asyncio.run(scenario())
+
+
+def test_a_stale_compaction_lease_is_ignored(log):
+    async def scenario():
+        await log.append("u1", _batch(1, "a"))
+        # Left behind by a worker that died mid-compaction
+        await log.heads.update_one(
+            {"user_id": "u1"}, {"$set": {"compacting_until": datetime.utcnow() - timedelta(seconds=1)}},
+            upsert=True,
+        )
+        snapshot = await log.compact("u1")
+        assert snapshot is not None and snapshot.seq == 1
+        head = await log.heads.find_one({"user_id": "u1"})
+        assert head["compacting_until"] is None
+        seq, (state, _), tail = await log.read("u1")
+        assert seq == 1 and tail == [] and len(state["quests"]) == 1
+
+    asyncio.run(scenario())
+
+
+def test_append_acknowledges_a_retried_batch(log):
+    async def scenario():
+        first = await log.append("u1", _batch(1, "a", "b"))
+        retried = await log.append("u1", _batch(1, "a", "b"))
+        assert retried.head_seq == first.head_seq == 2
+        assert [event["key"] for event in retried.events] == [event["key"] for event in first.events]
+        # A retry that overlaps the log and then continues it
+        extended = await log.append("u1", _batch(2, "b", "c"))
+        assert extended.head_seq == 3
+        assert await log.events.count_documents({"user_id": "u1"}) == 3
+
+    asyncio.run(scenario())
+
+
+def test_append_rejects_a_gap(log):
+    async def scenario():
+        await log.append("u1", _batch(1, "a"))
+        with pytest.raises(SequenceConflict) as conflict:
+            await log.append("u1", _batch(3, "c"))
+        assert conflict.value.head_seq == 1
+
+    asyncio.run(scenario())
+
+
+def test_append_rejects_a_batch_that_disagrees_with_the_log(log):
+    async def scenario():
+        await log.append("u1", _batch(1, "a", "b"))
+        with pytest.raises(SequenceConflict) as conflict:
+            await log.append("u1", _batch(2, "not b", "c"))
+        assert conflict.value.head_seq == 2
+        assert await log.head_seq("u1") == 2
+
+    asyncio.run(scenario())
+
+
+def test_append_rejects_invalid_events(log):
+    async def scenario():
+        with pytest.raises(InvalidEvent):
+            await log.append("u1", [{"seq": 1, "type": "RESET_ALL", "payload": None}])
+        with pytest.raises(InvalidEvent):
+            await log.append("u1", [{"seq": 1, "type": "COMPLETE_QUEST", "payload": {"id": "q1"}}])
+        assert await log.head_seq("u1") == 0
+
+    asyncio.run(scenario())
+
+
+def test_compaction_snapshot_equals_replaying_the_log(db):
+    async def scenario():
+        log = QuestEventLog(db, QuestStore(db), snapshot_every=3)
+        await log.append("u1", _batch(1, "a", "b"))
+        result = await log.append("u1", [{"seq": 3, "type": "COMPLETE_QUEST", "payload": "placeholder"}])
+        assert result.snapshot is not None and result.snapshot.seq == 3
+        state, _ = await log.store.read("u1")
+        assert state == apply_events({}, await log.read_events("u1", 0))
+
+    asyncio.run(scenario())
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from quest_patch import (
+    JsonPatchError, JsonPatchTestFailed, apply_patch, compile_patch, parse_pointer, touched_keys,
+)
+
+DOCUMENT = {
+    "quests": [{"id": "a", "name": "A"}, {"id": "b", "name": "B"}, {"id": "c", "name": "C"}],
+    "settings": {"theme": "dark", "a/b": 1, "m~n": 2},
+    "user": {"xp": 10},
+}
+
+
+def test_pointer_unescaping():
+    assert parse_pointer("") == []
+    assert parse_pointer("/a~1b/m~0n/~01") == ["a/b", "m~n", "~1"]
+    with pytest.raises(JsonPatchError):
+        parse_pointer("quests")
+
+
+def test_operations():
+    patched = apply_patch(DOCUMENT, [
+        {"op": "add", "path": "/quests/-", "value": {"id": "d"}},
+        {"op": "add", "path": "/quests/0", "value": {"id": "z"}},
+        {"op": "remove", "path": "/settings/a~1b"},
+        {"op": "replace", "path": "/settings/m~0n", "value": 3},
+        {"op": "move", "from": "/user/xp", "path": "/settings/xp"},
+        {"op": "copy", "from": "/quests/1", "path": "/user/first"},
+        {"op": "test", "path": "/user/first/name", "value": "A"},
+    ])
+    assert [quest["id"] for quest in patched["quests"]] == ["z", "a", "b", "c", "d"]
+    assert patched["settings"] == {"theme": "dark", "m~n": 3, "xp": 10}
+    assert patched["user"] == {"first": {"id": "a", "name": "A"}}
+    # The input is left alone and copies are independent
+    assert DOCUMENT["user"] == {"xp": 10}
+    assert patched["user"]["first"] is not patched["quests"][1]
+
+
+@pytest.mark.parametrize("operation, error", [
+    ({"op": "test", "path": "/user/xp", "value": 11}, JsonPatchTestFailed),
+    ({"op": "remove", "path": "/quests/-"}, JsonPatchError),
+    ({"op": "add", "path": "/quests/01", "value": 1}, JsonPatchError),
+    ({"op": "add", "path": "/quests/4", "value": 1}, JsonPatchError),
+    ({"op": "replace", "path": "/missing", "value": 1}, JsonPatchError),
+    ({"op": "move", "from": "/settings", "path": "/settings/inner"}, JsonPatchError),
+    ({"op": "copy", "path": "/user/copy"}, JsonPatchError),
+    ({"op": "add", "path": "/user/xp/deeper", "value": 1}, JsonPatchError),
+    ({"op": "frobnicate", "path": "/user"}, JsonPatchError),
+])
+def test_invalid_operations(operation, error):
+    with pytest.raises(error):
+        apply_patch(DOCUMENT, [operation])
+
+
+def test_touched_keys():
+    assert touched_keys([
+        {"op": "move", "from": "/user/xp", "path": "/settings/xp"},
+        {"op": "add", "path": "/user/level", "value": 2},
+    ]) == ["settings", "user"]
+    assert touched_keys([{"op": "replace", "path": "", "value": {}}]) is None
+    assert touched_keys([{"op": "add", "path": "/a.b", "value": 1}]) is None
+
+
+@pytest.mark.parametrize("operations", [
+    [{"op": "add", "path": "/quests/-", "value": {"id": "d"}}],
+    [{"op": "add", "path": "/quests/1", "value": {"id": "x"}}],
+    [{"op": "remove", "path": "/quests/0"}],
+    [{"op": "remove", "path": "/quests/2"}],
+    [{"op": "replace", "path": "/quests/1/name", "value": "Bee"}],
+    [{"op": "replace", "path": "/quests/1", "value": {"id": "b2"}}],
+    [{"op": "remove", "path": "/settings/theme"}, {"op": "add", "path": "/settings/font", "value": "serif"}],
+    [{"op": "move", "from": "/user/xp", "path": "/settings/xp"}],
+    [{"op": "copy", "from": "/quests/0", "path": "/user/first"}],
+    [{"op": "move", "from": "/quests/2", "path": "/user/last"}],
+    [{"op": "test", "path": "/user/xp", "value": 10}, {"op": "replace", "path": "/user/xp", "value": 20}],
+])
+def test_compiled_update_matches_applying_the_patch(db, operations):
+    update = compile_patch(DOCUMENT, operations)
+    assert update is not None
+
+    async def scenario():
+        await db.quest_data.insert_one({"user_id": "u1", "quest_data": DOCUMENT})
+        await db.quest_data.update_one({"user_id": "u1"}, update)
+        return (await db.quest_data.find_one({"user_id": "u1"}))["quest_data"]
+
+    assert asyncio.run(scenario()) == apply_patch(DOCUMENT, operations)
+
+
+@pytest.mark.parametrize("operations", [
+    [{"op": "replace", "path": "", "value": {}}],
+    [{"op": "remove", "path": "/quests/1"}],
+    [{"op": "add", "path": "/settings/a.b", "value": 1}],
+    [{"op": "replace", "path": "/settings/a~1b", "value": 1}, {"op": "remove", "path": "/settings"}],
+    [{"op": "replace", "path": "/user/xp", "value": 1}, {"op": "replace", "path": "/user/xp", "value": 2}],
+    [{"op": "move", "from": "/quests/1", "path": "/user/middle"}],
+])
+def test_patches_without_a_single_update_are_not_compiled(operations):
+    assert compile_patch(DOCUMENT, operations) is None
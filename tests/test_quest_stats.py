@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from quest_stats import QuestStats, rebuild_all, summarize
+from quest_store import STORAGE_DOCUMENT, STORAGE_NORMALIZED, QuestStore
+
+
+def completed(n, xp=10, rank="B"):
+    return {"id": f"q{n}", "xpEarned": xp, "rank": rank, "dateCompleted": f"2025-01-{n:02d}T12:00:00Z"}
+
+
+def claimed(n):
+    return {"id": f"r{n}", "xpCost": 25, "dateClaimed": f"2025-02-{n:02d}T08:00:00+02:00"}
+
+
+@pytest.mark.parametrize("mode, compression", [
+    (STORAGE_DOCUMENT, None), (STORAGE_DOCUMENT, "zlib"), (STORAGE_NORMALIZED, None),
+])
+def test_incremental_counters_match_a_rebuild(db, mode, compression):
+    async def scenario():
+        stats = QuestStats(db)
+        store = QuestStore(db, mode, compression, counters=stats)
+        for user in ("u1", "u2"):
+            version = await store.write(user, {"completedQuests": [completed(1)], "settings": {}}, None)
+            # Appends advance the counters by the delta
+            version = await store.write_sections(
+                user, {"completedQuests": [completed(1), completed(2, 15, "A"), completed(3)]}, [], version
+            )
+            version = await store.write_sections(user, {"claimedRewards": [claimed(1), claimed(2)]}, [], version)
+        # An edit that is not an append forces a recount
+        await store.write_sections("u2", {"completedQuests": [completed(3, 7, "S")]}, [], version)
+        await store.write("u3", {"settings": {}}, None)
+
+        incremental = {doc["user_id"]: doc async for doc in db.quest_stats.find({}, {"_id": 0, "updated_at": 0})}
+        await db.quest_stats.delete_many({})
+        assert await rebuild_all(db, store, batch_size=2) == 3
+        rebuilt = {doc["user_id"]: doc async for doc in db.quest_stats.find({}, {"_id": 0, "updated_at": 0})}
+        assert set(rebuilt) == {"u1", "u2", "u3"}
+        for user in ("u1", "u2"):
+            assert rebuilt[user] == incremental[user]
+        assert summarize(rebuilt["u1"])["quests"]["completed"] == 3
+        assert summarize(rebuilt["u2"])["quests"]["rank_distribution"] == {"S": 1}
+
+    asyncio.run(scenario())
+
+
+def test_averages_round_half_up_like_the_client():
+    document = {"sections": {
+        "completedQuests": {"count": 2, "xp": 5, "ranks": {}, "weekdays": {}, "tail_id": "q2"},
+        "claimedRewards": {"count": 4, "xp": 10, "ranks": {}, "weekdays": {}, "tail_id": "r4"},
+    }}
+    summary = summarize(document)
+    assert summary["quests"]["average_xp"] == 3
+    assert summary["rewards"]["average_xp"] == 3
+    assert summarize(None)["quests"]["average_xp"] == 0
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from indexes import ensure_indexes
+from quest_store import STORAGE_DOCUMENT, STORAGE_NORMALIZED, QuestStore
+
+from .conftest import register
+
+LAYOUTS = [(STORAGE_DOCUMENT, None), (STORAGE_DOCUMENT, "zlib"), (STORAGE_NORMALIZED, None)]
+STATE = {"quests": [{"id": "a"}, {"id": "b"}], "settings": {"theme": "dark"}}
+
+
+@pytest.mark.parametrize("mode, compression", LAYOUTS)
+def test_writes_compare_and_set_the_version(db, mode, compression):
+    async def scenario():
+        # The unique index on user_id decides between concurrent creators
+        await ensure_indexes(db, normalized=True)
+        store = QuestStore(db, mode, compression)
+        assert await store.write("u1", STATE, None) == 1
+        # A second creator loses instead of overwriting
+        assert await store.write("u1", {"quests": []}, None) is None
+        assert await store.write("u1", {**STATE, "quests": [{"id": "c"}]}, 1) == 2
+        assert await store.write("u1", STATE, 1) is None
+        assert await store.write_sections("u1", {"settings": {}}, [], 1) is None
+        assert await store.write_sections("u1", {"settings": {}}, ["quests"], 2) == 3
+        assert await store.read("u1") == ({"settings": {}}, 3)
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("mode, compression", LAYOUTS)
+def test_concurrent_writers_at_one_version_have_a_single_winner(db, mode, compression):
+    async def scenario():
+        store = QuestStore(db, mode, compression)
+        await store.write("u1", STATE, None)
+        results = await asyncio.gather(*(
+            store.write_sections("u1", {"quests": [{"id": f"w{n}"}]}, [], 1) for n in range(5)
+        ))
+        assert sorted(results, key=str) == [2, None, None, None, None]
+        winner = results.index(2)
+        assert await store.read("u1") == ({**STATE, "quests": [{"id": f"w{winner}"}]}, 2)
+
+    asyncio.run(scenario())
+
+
+def test_stale_if_match_is_refused(client):
+    headers = register(client, "casuser")
+    saved = client.post("/api/quest-data", json={"quest_data": STATE}, headers=headers)
+    etag = saved.headers["ETag"]
+    assert client.post(
+        "/api/quest-data", json={"quest_data": {}}, headers={**headers, "If-Match": etag}
+    ).status_code == 200
+    assert client.post(
+        "/api/quest-data", json={"quest_data": STATE}, headers={**headers, "If-Match": etag}
+    ).status_code == 412
+    patched = client.patch(
+        "/api/quest-data", json=[{"op": "add", "path": "/settings", "value": {}}],
+        headers={**headers, "If-Match": etag},
+    )
+    assert patched.status_code == 412
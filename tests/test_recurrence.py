@@ -0,0 +1,105 @@
+from datetime import date
+from itertools import islice
+
+import pytest
+
+from recurrence import anchor_date, occurrences, occurrences_between
+
+
+def task(**fields):
+    return {"id": "1", "name": "t", "status": "Active", **fields}
+
+
+def first(series, n=4):
+    return [occurrence.isoformat() for occurrence in islice(series, n)]
+
+
+def test_fixed_frequencies():
+    assert first(occurrences(task(frequency="Weekdays", startDate="2025-01-03"))) == [
+        "2025-01-03", "2025-01-06", "2025-01-07", "2025-01-08",
+    ]
+    assert first(occurrences(task(frequency="Weekly", days=["Tue"], startDate="2025-01-01")), 2) == [
+        "2025-01-07", "2025-01-14",
+    ]
+    assert first(occurrences(task(frequency="Monthly", days=["31st"], startDate="2025-01-15")), 3) == [
+        "2025-01-31", "2025-02-28", "2025-03-31",
+    ]
+    assert first(occurrences(task(frequency="Yearly", yearlyDate="02-29", startDate="2023-06-01")), 2) == [
+        "2024-02-29", "2028-02-29",
+    ]
+
+
+def test_paused_tasks_have_no_occurrences():
+    assert list(occurrences(task(frequency="Daily", startDate="2025-01-01", status="Paused"))) == []
+
+
+def test_skipping_ahead_matches_walking_from_the_start():
+    custom = task(frequency="Custom", startDate="2025-01-01", customFrequency={
+        "interval": 3, "unit": "weeks", "weeklyDays": ["Mon", "Thu"],
+    })
+    walked = [d for d in islice(occurrences(custom), 200) if d >= date(2026, 3, 1)]
+    assert first(occurrences(custom, date(2026, 3, 1)), 10) == first(walked, 10)
+
+
+def test_anchor_ignores_last_added_when_a_creation_date_is_known():
+    created = task(id="1736899200000", lastAdded="2025-02-10")  # 2025-01-15 UTC
+    assert anchor_date(created) == date(2025, 1, 15)
+    assert anchor_date({**created, "createdAt": "2025-01-10"}) == date(2025, 1, 10)
+    assert anchor_date(task(lastAdded="2025-02-10")) == date(2025, 2, 10)
+
+
+@pytest.mark.parametrize("unit, expected", [
+    ("weeks", ["2025-01-27", "2025-02-10", "2025-02-24"]),
+    ("months", ["2025-03-13", "2025-05-13", "2025-07-13"]),
+])
+def test_adding_an_occurrence_keeps_the_phase(unit, expected):
+    custom = task(frequency="Custom", createdAt="2025-01-13", customFrequency={"interval": 2, "unit": unit})
+    moved = {**custom, "lastAdded": "2025-01-20"}
+    assert first(occurrences(custom, date(2025, 1, 20)), 3) == expected
+    assert first(occurrences(moved, date(2025, 1, 20)), 3) == expected
+
+
+def test_end_after_counts_from_the_start_and_respects_generated_count():
+    custom = task(frequency="Custom", createdAt="2025-01-01", lastAdded="2025-01-03", customFrequency={
+        "interval": 1, "unit": "days", "endCondition": "after", "endAfter": 3,
+    })
+    assert first(occurrences(custom)) == ["2025-01-01", "2025-01-02", "2025-01-03"]
+    assert first(occurrences(custom, date(2025, 1, 3))) == ["2025-01-03"]
+    assert list(occurrences({**custom, "generatedCount": 3})) == []
+
+
+@pytest.mark.parametrize("fields", [
+    {"frequency": "Daily"},
+    {"frequency": "Monthly"},
+    {"frequency": "Yearly"},
+    {"frequency": "Custom", "customFrequency": {"interval": 7, "unit": "days"}},
+    {"frequency": "Custom", "customFrequency": {"interval": 2, "unit": "weeks"}},
+    {"frequency": "Custom", "customFrequency": {"interval": 5, "unit": "months"}},
+    {"frequency": "Custom", "customFrequency": {"interval": 3, "unit": "years"}},
+])
+def test_series_stop_at_the_last_representable_date(fields):
+    near_end = date(9999, 12, 1)
+    due = list(occurrences(task(startDate="9999-01-01", **fields), near_end))
+    window = occurrences_between([task(startDate="9999-01-01", **fields)], near_end, date.max)
+    assert [o["dueDate"] for o in window] == [d.isoformat() for d in due]
+    if fields["frequency"] == "Daily":
+        assert due[-1] == date.max
+
+
+def test_occurrences_between_merges_tasks_in_date_order():
+    tasks = [
+        task(id="a", frequency="Custom", startDate="2025-01-01", startBeforeDue=2,
+             customFrequency={"interval": 2, "unit": "days"}),
+        task(id="b", frequency="Weekly", days=["Fri"], startDate="2025-01-01"),
+        "not a task",
+    ]
+    result = list(occurrences_between(tasks, date(2025, 1, 2), date(2025, 1, 5)))
+    assert [(o["task_id"], o["dueDate"]) for o in result] == [
+        ("a", "2025-01-03"), ("b", "2025-01-03"), ("a", "2025-01-05"),
+    ]
+    assert result[0]["startDate"] == "2025-01-01"
+
+
+def test_lead_time_does_not_underflow():
+    early = task(frequency="Daily", startDate="0001-01-01", startBeforeDue=30)
+    assert next(occurrences_between([early], date.min, date.min))["startDate"] == "0001-01-01"
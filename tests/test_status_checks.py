@@ -0,0 +1,20 @@
+from urllib.parse import quote
+
+
+def test_status_listing_is_a_bare_list_unless_paged(client):
+    for n in range(3):
+        assert client.post("/api/status", json={"client_name": "listing"}).status_code == 200
+
+    listed = client.get("/api/status", params={"client_name": "listing"}).json()
+    assert isinstance(listed, list) and len(listed) == 3
+    assert [row["timestamp"] for row in listed] == sorted((row["timestamp"] for row in listed), reverse=True)
+
+    page = client.get("/api/status", params={"client_name": "listing", "limit": 2}).json()
+    assert page["items"] == listed[:2] and page["next_cursor"]
+    rest = client.get(f"/api/status?client_name=listing&cursor={quote(page['next_cursor'])}").json()
+    assert rest == {"items": listed[2:], "next_cursor": None}
+
+
+def test_status_listing_rejects_bad_paging(client):
+    assert client.get("/api/status", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/api/status", params={"limit": 0}).status_code == 422
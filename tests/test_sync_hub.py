@@ -0,0 +1,125 @@
+import asyncio
+import time
+import uuid
+from datetime import timedelta
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from sync_hub import CLOSE_SESSION_ENDED, LocalBackend, SyncBackend, SyncHub
+
+from .conftest import register
+
+
+def test_backends_must_implement_start_and_publish():
+    class Incomplete(SyncBackend):
+        async def start(self, deliver):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+    LocalBackend()
+
+
+def test_messages_skip_the_origin_and_other_users():
+    async def scenario():
+        hub = SyncHub()
+        await hub.start()
+        a, b = hub.connect("u1"), hub.connect("u1")
+        other = hub.connect("u2")
+        await hub.publish("u1", {"type": "quest_data", "version": 2}, origin=a.id)
+        assert a.queue.empty() and other.queue.empty()
+        assert b.queue.get_nowait() == {"type": "quest_data", "version": 2, "origin": a.id}
+
+    asyncio.run(scenario())
+
+
+def test_a_full_queue_collapses_into_a_resync():
+    async def scenario():
+        hub = SyncHub(queue_size=3)
+        await hub.start()
+        connection = hub.connect("u1")
+        for version in range(5):
+            await hub.publish("u1", {"type": "quest_data", "version": version})
+        assert [connection.queue.get_nowait() for _ in range(connection.queue.qsize())] == [
+            {"type": "resync"}, {"type": "quest_data", "version": 4, "origin": None},
+        ]
+        assert hub.stats["resyncs"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_connections_are_capped_and_counted_per_user():
+    async def scenario():
+        hub = SyncHub(max_connections_per_user=2)
+        first, second = hub.connect("u1"), hub.connect("u1")
+        assert hub.connect("u1") is None and hub.stats["rejected"] == 1
+        assert hub.connection_count() == 2
+        hub.disconnect(first)
+        hub.disconnect(first)
+        assert hub.connection_count() == 1
+        hub.disconnect(second)
+        assert hub.connection_count() == 0 and hub._connections == {}
+
+    asyncio.run(scenario())
+
+
+def test_publishing_to_a_user_without_connections_is_skipped():
+    async def scenario():
+        hub = SyncHub()
+        await hub.start()
+        hub.connect("u1")
+        await hub.publish("u2", {"type": "quest_data", "version": 1})
+        assert hub.stats["published"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_close_connections_by_token():
+    async def scenario():
+        hub = SyncHub()
+        await hub.start()
+        a = hub.connect("u1", token_id="t1")
+        b = hub.connect("u1", token_id="t2")
+        await hub.close_connections("u1", "t1")
+        assert a.closed.is_set() and not b.closed.is_set()
+        await hub.close_connections("u1")
+        assert b.closed.is_set()
+
+    asyncio.run(scenario())
+
+
+def _open(client, token):
+    socket = client.websocket_connect(f"/api/sync?token={token}")
+    websocket = socket.__enter__()
+    assert websocket.receive_json()["type"] == "hello"
+    return socket, websocket
+
+
+def test_logout_closes_the_socket_opened_with_the_token(client):
+    token = register(client, "syncout")["Authorization"].split()[1]
+    socket, websocket = _open(client, token)
+    try:
+        client.post("/api/logout", headers={"Authorization": f"Bearer {token}"})
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+        assert closed.value.code == CLOSE_SESSION_ENDED
+    finally:
+        socket.__exit__(None, None, None)
+
+
+def test_socket_closes_when_its_token_expires(client):
+    from auth import ACCESS_TOKEN_TYPE, create_access_token
+
+    user_id = client.get("/api/me", headers=register(client, "syncexp")).json()["id"]
+    token = create_access_token(
+        {"sub": user_id, "act": True, "typ": ACCESS_TOKEN_TYPE, "jti": uuid.uuid4().hex, "iat": int(time.time())},
+        timedelta(seconds=1),
+    )
+    socket, websocket = _open(client, token)
+    try:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+        assert closed.value.code == CLOSE_SESSION_ENDED
+    finally:
+        socket.__exit__(None, None, None)
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+import write_buffer
+from quest_store import QuestStore
+from write_buffer import MAX_FLUSH_ATTEMPTS, QuestWriteBuffer
+
+
+@pytest.fixture
+def store(db):
+    return QuestStore(db)
+
+
+def test_saves_in_a_burst_are_written_once(store):
+    async def scenario():
+        buffer = QuestWriteBuffer(store, delay=0.02)
+        versions = [buffer.submit("u1", {"quests": [n]}, n or None) for n in range(5)]
+        assert versions == [1, 2, 3, 4, 5]
+        assert buffer.pending("u1") == ({"quests": [4]}, 5)
+        await asyncio.sleep(0.1)
+        assert buffer.pending("u1") is None
+        assert await store.read("u1") == ({"quests": [4]}, 5)
+        assert buffer.stats["flushed"] == 1 and buffer.stats["coalesced"] == 4
+
+    asyncio.run(scenario())
+
+
+def test_flush_all_writes_what_is_pending(store):
+    async def scenario():
+        buffer = QuestWriteBuffer(store, delay=60)
+        buffer.submit("u1", {"quests": []}, None)
+        await buffer.flush_all()
+        assert await store.read("u1") == ({"quests": []}, 1)
+
+    asyncio.run(scenario())
+
+
+def test_failing_writes_back_off_and_are_dropped(store, monkeypatch):
+    attempts = []
+
+    async def failing_write(*args, **kwargs):
+        attempts.append(asyncio.get_running_loop().time())
+        raise RuntimeError("document too large")
+
+    monkeypatch.setattr(store, "write", failing_write)
+    monkeypatch.setattr(write_buffer, "RETRY_BASE_SECONDS", 0.01)
+
+    async def scenario():
+        buffer = QuestWriteBuffer(store, delay=0.001)
+        buffer.submit("u1", {"quests": []}, None)
+        await asyncio.sleep(0.5)
+        assert len(attempts) == MAX_FLUSH_ATTEMPTS
+        gaps = [later - earlier for earlier, later in zip(attempts, attempts[1:])]
+        assert all(later > earlier for earlier, later in zip(gaps, gaps[1:]))
+        assert buffer.pending("u1") is None
+        assert buffer.stats["dropped"] == 1
+        assert buffer.stats["flush_failures"] == MAX_FLUSH_ATTEMPTS
+
+    asyncio.run(scenario())
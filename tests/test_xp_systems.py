@@ -0,0 +1,67 @@
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from xp_systems import (
+    LEVEL_TITLES, XP_SYSTEMS, batch_levels, get_current_level, get_level_progress, get_xp_system,
+)
+
+XP_SYSTEMS_JS = Path(__file__).parents[1] / "frontend" / "src" / "data" / "xpSystems.js"
+
+
+def client_level(total_xp, thresholds):
+    """getCurrentLevel from xpSystems.js: scan down for the first threshold reached."""
+    for i in range(len(thresholds) - 1, -1, -1):
+        if total_xp >= thresholds[i]:
+            return i + 1
+    return 1
+
+
+def test_tables_match_the_client():
+    source = XP_SYSTEMS_JS.read_text()
+    client = {
+        system_id: (json.loads(bonus), json.loads(thresholds))
+        for system_id, bonus, thresholds in re.findall(
+            r"id: '(\w+)',.*?monthlyBonusXP: (\[[^\]]*\]),\s*levelThresholds: (\[[^\]]*\])", source, re.S
+        )
+    }
+    assert client == {
+        system.id: (system.monthly_bonus_xp, system.level_thresholds) for system in XP_SYSTEMS.values()
+    }
+
+
+@pytest.mark.parametrize("system", XP_SYSTEMS.values(), ids=lambda system: system.id)
+def test_levels_match_the_client_scan(system):
+    thresholds = system.level_thresholds
+    probes = [-5, 0.5, 10 ** 6] + [t + delta for t in thresholds for delta in (-1, -0.01, 0, 0.01, 1)]
+    for total_xp in probes:
+        current = get_current_level(total_xp, system)
+        level = client_level(total_xp, thresholds)
+        assert current["level"] == level, total_xp
+        assert current["title"] == LEVEL_TITLES[level - 1].title
+        assert current["xp_required"] == thresholds[level - 1]
+        assert current["next_level_xp"] == (thresholds[level] if level < len(thresholds) else None)
+
+
+def test_progress_within_and_at_the_top_level():
+    system = get_xp_system("default")
+    assert get_level_progress(850, system) == {"progress": 50.0, "progress_xp": 350, "total_xp_for_next": 700}
+    assert get_level_progress(3000, system) == {"progress": 100, "progress_xp": 0, "total_xp_for_next": 0}
+    assert get_xp_system("unknown") is XP_SYSTEMS["DEFAULT"]
+
+
+@pytest.mark.parametrize("system", XP_SYSTEMS.values(), ids=lambda system: system.id)
+def test_batch_levels_agree_with_single_lookups(system):
+    totals = [0, 1, 499.5, 500, 1199, 1200, 2999, 3000, 4500, 10 ** 6, -3]
+    batch = batch_levels(totals, system)
+    for i, total_xp in enumerate(totals):
+        current = get_current_level(total_xp, system)
+        progress = get_level_progress(total_xp, system)
+        assert batch["level"][i] == current["level"]
+        assert batch["next_level_xp"][i] == (current["next_level_xp"] or -1)
+        assert batch["progress_xp"][i] == progress["progress_xp"]
+        assert batch["total_xp_for_next"][i] == progress["total_xp_for_next"]
+        assert np.isclose(batch["progress"][i], progress["progress"])